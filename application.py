@@ -1,22 +1,46 @@
+import os
+import time
 import tkinter as tk
 from tkinter import ttk
 
+import croprecord
+import fileops as fops
+import profiling
 import ui_generics as ui
 import ui_imageset as imageset_tab
 import ui_video as video_tab
 import ui_tagger as tagger_tab
 
+CROP_WRITER_POLL_MS = 250
+RESIZE_SETTLE_MS = 200
+STAGE_STATS_UPDATE_MS = 1000
+PROFILE_HOTKEY = "<F12>"
+EXPORT_TIMINGS_HOTKEY = "<F11>"
+
 
 class Application(tk.Tk):
     imageset_tab = None
     video_tab = None
     tag_editor_tab = None
+    crop_writer = None
+    crop_recorder = None
+    tabs = None
+    resize_idle_job = None
+    resize_settle_job = None
+    profiler = None
+    profiler_job = None
 
     def __init__(self, geometry):
         super().__init__()
         self.geometry(geometry)
         self.title("Fast Batch Image Crop")
+        self.crop_writer = fops.CropWriter()
+        self.crop_recorder = croprecord.CropRecorder()
+        self.profiler = profiling.EventLoopProfiler()
         self.init_ui()
+        self.protocol("WM_DELETE_WINDOW", self.window_close_callback)
+        self.after(CROP_WRITER_POLL_MS, self.poll_crop_writer)
+        self.after(STAGE_STATS_UPDATE_MS, self.poll_stage_timings)
         self.console.write_info("Application init complete.")
 
     def init_ui(self):
@@ -26,20 +50,117 @@ class Application(tk.Tk):
         self.console = ui.SingleLineConsole(self)
         self.console.grid(column=0, row=1, sticky="news")
 
-        tabs = ttk.Notebook(self)
-        tabs.grid(column=0, row=0, sticky="news")
+        self.tabs = ttk.Notebook(self)
+        self.tabs.grid(column=0, row=0, sticky="news")
 
-        self.imageset_tab = imageset_tab.ImagesetTab(self.console)
-        self.video_tab = video_tab.VideoTab(self.console)
+        self.imageset_tab = imageset_tab.ImagesetTab(self.console, self.crop_writer, self.crop_recorder)
+        self.video_tab = video_tab.VideoTab(self.console, self.crop_writer, self.crop_recorder)
         self.tag_editor_tab = tagger_tab.TagEditorTab(self.console)
 
-        tabs.add(self.imageset_tab, text="Image Set")
-        tabs.add(self.video_tab, text="Video")
-        tabs.add(self.tag_editor_tab, text="Tag Editor")
+        self.tabs.add(self.imageset_tab, text="Image Set")
+        self.tabs.add(self.video_tab, text="Video")
+        self.tabs.add(self.tag_editor_tab, text="Tag Editor")
 
+        self.tabs.bind("<<NotebookTabChanged>>", self.tab_changed_callback)
         self.bind("<Configure>", self.window_configure_callback)
+        self.bind(PROFILE_HOTKEY, self.toggle_profiler_callback)
+        self.bind(EXPORT_TIMINGS_HOTKEY, self.export_timings_callback)
         self.console.write_info("UI init done.")
 
     def window_configure_callback(self, event):
-        self.imageset_tab.window_reconfigure(event)
-        self.tag_editor_tab.window_reconfigure(event)
+        # <Configure> of every child widget also reaches this binding
+        if event.widget is not self:
+            return
+
+        if self.resize_idle_job is None:
+            self.resize_idle_job = self.after_idle(self.resize_interim_callback)
+        if self.resize_settle_job is not None:
+            self.after_cancel(self.resize_settle_job)
+        self.resize_settle_job = self.after(RESIZE_SETTLE_MS, self.resize_settled_callback)
+
+    def get_visible_tab(self):
+        return self.nametowidget(self.tabs.select())
+
+    def resize_interim_callback(self):
+        self.resize_idle_job = None
+        self.get_visible_tab().window_reconfigure(final=False)
+
+    def resize_settled_callback(self):
+        self.resize_settle_job = None
+        self.get_visible_tab().window_reconfigure(final=True)
+
+    def tab_changed_callback(self, event):
+        self.flush_crop_writer()
+        self.get_visible_tab().window_reconfigure(final=True)
+
+    def poll_stage_timings(self):
+        summary = profiling.get_stage_timings().summary(self.get_visible_tab().stage_scope)
+        self.console.write_stats(f"p50/p95 ms: {summary}" if summary else "")
+        self.after(STAGE_STATS_UPDATE_MS, self.poll_stage_timings)
+
+    def toggle_profiler_callback(self, event):
+        if self.profiler.running:
+            self.stop_profiler()
+            return
+        self.profiler.start()
+        self.profiler_job = self.after(profiling.DEFAULT_PROFILE_SECONDS * 1000, self.stop_profiler)
+        self.console.write_info(
+            f"Profiling for {profiling.DEFAULT_PROFILE_SECONDS} s, press F12 to stop early."
+        )
+
+    def stop_profiler(self):
+        if self.profiler_job is not None:
+            self.after_cancel(self.profiler_job)
+            self.profiler_job = None
+        path = self._timestamped_cache_path("profile", ".prof")
+        try:
+            report_path = self.profiler.stop(path)
+        except OSError as exc:
+            self.console.write_error(f"Could not write profile: {exc}")
+            return
+        if report_path is not None:
+            self.console.write_info(f"Profile written to {path} (summary in {report_path}).")
+
+    def export_timings_callback(self, event):
+        path = self._timestamped_cache_path("timings", ".json")
+        try:
+            profiling.get_stage_timings().export(path)
+        except OSError as exc:
+            self.console.write_error(f"Could not export timings: {exc}")
+            return
+        self.console.write_info(f"Stage timings written to {path}.")
+
+    def _timestamped_cache_path(self, prefix, extension):
+        return os.path.join(fops.get_cache_folder("profiles"), f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}{extension}")
+
+    def window_close_callback(self):
+        if self.profiler.running:
+            self.stop_profiler()
+        self.flush_crop_writer()
+        self.crop_writer.close()
+        self.imageset_tab.prefetcher.shutdown()
+        self.tag_editor_tab.prefetcher.shutdown()
+        self.tag_editor_tab.close_tag_store()
+        self.video_tab.close_video()
+        self.video_tab.close_frame_extractor()
+        self.destroy()
+
+    def flush_crop_writer(self):
+        pending = self.crop_writer.pending()
+        if pending:
+            self.console.write_info(f"Writing {pending} pending crop(s)...")
+        self.crop_writer.flush()
+        self.report_crop_writer_failures()
+
+    def poll_crop_writer(self):
+        self.report_crop_writer_failures()
+        self.after(CROP_WRITER_POLL_MS, self.poll_crop_writer)
+
+    def report_crop_writer_failures(self):
+        for image_path, message in self.crop_writer.pop_failures():
+            self.console.write_error(f"Could not save {image_path}: {message}")
+        for level, message in self.crop_recorder.pop_messages():
+            if level == croprecord.MESSAGE_WARNING:
+                self.console.write_warning(message)
+            else:
+                self.console.write_error(message)
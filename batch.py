@@ -0,0 +1,384 @@
+"""Headless batch cropping driven by a crop manifest.
+
+A manifest is a JSON Lines file with one crop per line:
+
+    {"source": "photos/img_001.jpg", "box": [120, 40, 632, 552], "orientation": "exif",
+     "rotation": 90, "output_size": [512, 512], "class_name": "ClassA", "description": "high, thin"}
+
+box is (left, upper, right, lower) in pixels of the source image after rotation,
+rotation is in degrees counter-clockwise as passed to imageops.rotate_image, and
+every key except source and box is optional. With "orientation": "exif" the
+source is first turned upright by its EXIF orientation, as the tabs show it;
+without, box and rotation apply to the pixels as stored, which is what
+journals written before the tabs honoured EXIF orientation hold.
+
+A "frame" key makes source a video and selects the frame to crop, and
+"encoder" names a fileops.ENCODER_PROFILES entry (by default the profile
+matching the output extension, else fileops.DEFAULT_ENCODER_PROFILE).
+Relative source paths are resolved against the manifest folder. Crops are
+written to "output" (relative to the output folder) when given, a later entry
+with the same output replacing an earlier one, and otherwise like the Image
+Set tab does, as <source name>_<n>.png (or the extension of the encoder, plus
+.txt for descriptions) in the output folder or in its class_name subfolder, n
+counting the crops of each source in manifest order.
+
+The crop journal the tabs keep in every output folder (fileops.CropJournal)
+uses the same format, and the render command re-materializes a dataset from it
+at a new output size, skipping crops whose output is already up to date.
+
+The dedup command hashes every image below an output folder, prints groups of
+near duplicates and rewrites the hash index the tabs append to as they crop
+(hashindex.DatasetHashIndex).
+
+The export command consolidates the Tag Editor's per-image .tagdata files into
+one COCO-style JSON file, YOLO label files or JSON Lines (see tagexport).
+
+Usage:
+    python batch.py crop MANIFEST OUTPUT_FOLDER [--encoder NAME] [--workers N]
+    python batch.py render JOURNAL OUTPUT_FOLDER [--width W] [--height H] [--encoder NAME] [--force] [--workers N]
+    python batch.py dedup OUTPUT_FOLDER [--threshold N] [--workers N]
+    python batch.py export FOLDER OUTPUT --format {coco,yolo,jsonl} [--recursive] [--box-size N] [--workers N]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+from PIL import Image
+
+import fileops as fops
+import hashindex
+import imageops as iops
+import tagexport
+import videoops as vops
+
+
+def read_manifest(path: str) -> List[dict]:
+    """Read crop entries from a JSON Lines manifest.
+
+    Args:
+        path: Manifest file path
+
+    Returns:
+        List of entries with absolute source paths
+
+    Raises:
+        ValueError: If a line is not valid JSON or misses source or box
+    """
+    base_path = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise ValueError(f"{path}:{line_number}: {exc}") from exc
+            if "source" not in entry or "box" not in entry:
+                raise ValueError(f"{path}:{line_number}: entry needs 'source' and 'box'")
+            entry["source"] = os.path.join(base_path, entry["source"])
+            entries.append(entry)
+    return entries
+
+
+def build_output_paths(entry: dict, crop_index: int, output_folder: str) -> Tuple[str, str]:
+    """Build the image and description paths for a manifest entry.
+
+    Args:
+        entry: Manifest entry
+        crop_index: Index of the crop among the crops of the same source
+        output_folder: Root output folder
+
+    Returns:
+        Tuple of (image_path, description_path)
+    """
+    extension = ".png"
+    if entry.get("encoder") is not None:
+        extension = fops.get_encoder_profile(entry["encoder"]).extension
+
+    if entry.get("output") is not None:
+        image_path = os.path.join(output_folder, entry["output"])
+        base_path = os.path.splitext(image_path)[0]
+        if entry.get("encoder") is not None:
+            image_path = base_path + extension
+        return image_path, base_path + ".txt"
+
+    base_name = os.path.splitext(os.path.basename(entry["source"]))[0]
+    folder = output_folder
+    if entry.get("class_name") is not None:
+        folder = os.path.join(output_folder, entry["class_name"])
+    return (
+        os.path.join(folder, f"{base_name}_{crop_index}{extension}"),
+        os.path.join(folder, f"{base_name}_{crop_index}.txt"),
+    )
+
+
+def group_by_source(entries: List[dict], output_folder: str) -> List[Tuple[str, List[dict]]]:
+    """Group entries by source so each source is decoded once, keeping manifest order.
+
+    Each entry gets its image_path and description_path assigned. Of entries
+    naming the same "output", only the last is kept, as a journal records a
+    file written again by a later session.
+
+    Raises:
+        ValueError: If two entries without "output" would write the same file,
+            e.g. crops of sources of the same name in different folders
+    """
+    groups = OrderedDict()
+    crop_counts = {}
+    entries_by_output = {}
+    for entry in entries:
+        crop_index = crop_counts.get(entry["source"], 0)
+        crop_counts[entry["source"]] = crop_index + 1
+        entry["image_path"], entry["description_path"] = build_output_paths(
+            entry, crop_index, output_folder
+        )
+        output_key = os.path.normcase(os.path.abspath(entry["image_path"]))
+        earlier = entries_by_output.get(output_key)
+        if earlier is not None:
+            if entry.get("output") is None or earlier.get("output") is None:
+                raise ValueError(
+                    f"Crops of {earlier['source']} and {entry['source']} "
+                    f"would both be written to {entry['image_path']}"
+                )
+            earlier_jobs = groups[earlier["source"]]
+            earlier_jobs[:] = [job for job in earlier_jobs if job is not earlier]
+        entries_by_output[output_key] = entry
+        groups.setdefault(entry["source"], []).append(entry)
+    return [(source, jobs) for source, jobs in groups.items() if jobs]
+
+
+def is_up_to_date(entry: dict) -> bool:
+    """Check whether the output of an entry is newer than its source and of the right size."""
+    try:
+        if os.path.getmtime(entry["image_path"]) < os.path.getmtime(entry["source"]):
+            return False
+        output_size = entry.get("output_size")
+        if output_size is None:
+            return True
+        with Image.open(entry["image_path"]) as img:
+            return all(
+                expected is None or expected == actual
+                for expected, actual in zip(output_size, img.size)
+            )
+    except OSError:
+        return False
+
+
+def iter_source_images(source: str, jobs: List[dict]) -> Iterator[Tuple[Image.Image, Optional[int], List[dict]]]:
+    """Decode each image a group of entries needs once, yielding it with its EXIF transpose and entries.
+
+    Still images are decoded once, as stored, with the transpose turning them
+    upright (or None); for videos every referenced frame is decoded once, in
+    frame order.
+    """
+    if all(entry.get("frame") is None for entry in jobs):
+        image, orientation = iops.load_unoriented_image(source)
+        yield image, orientation, jobs
+        return
+
+    frames = OrderedDict()
+    for entry in sorted(jobs, key=lambda e: e["frame"]):
+        frames.setdefault(entry["frame"], []).append(entry)
+
+    frame_indices = list(frames)
+    decoded = 0
+    for frame_index, frame in vops.read_frames(source, frame_indices, vops.get_video_index(source)):
+        if frame_index != frame_indices[decoded]:
+            break
+        decoded += 1
+        yield Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), None, frames[frame_index]
+    if decoded < len(frame_indices):
+        raise ValueError(f"Could not read frame {frame_indices[decoded]}")
+
+
+def render_entry(image, entry: dict) -> None:
+    """Crop, resize and write a single manifest entry from an already rotated image."""
+    cropped_image = iops.crop_image(image, 1.0, entry["box"])
+    output_size = entry.get("output_size")
+    if output_size is not None:
+        cropped_image = iops.resize_image(cropped_image, width=output_size[0], height=output_size[1])
+
+    profile = None
+    if entry.get("encoder") is not None:
+        profile = fops.get_encoder_profile(entry["encoder"])
+    fops.save_image_to_file(cropped_image, entry["image_path"], profile)
+    fops.save_image_description_to_file(entry.get("description"), entry["description_path"])
+
+
+def render_source(group: Tuple[str, List[dict]]) -> Tuple[str, int, Optional[str]]:
+    """Decode a source once and render all of its crops.
+
+    Returns:
+        Tuple of (source, number of crops written, error message or None)
+    """
+    source, jobs = group
+    written = 0
+    try:
+        for image, orientation, image_jobs in iter_source_images(source, jobs):
+            # Keyed by (whether upright by EXIF orientation, rotation)
+            rotated_images = {(False, 0): image}
+            for entry in image_jobs:
+                upright = orientation is not None and entry.get("orientation") == fops.ORIENTATION_EXIF
+                key = (upright, entry.get("rotation", 0) % 360)
+                if key not in rotated_images:
+                    view = image.transpose(orientation) if upright else image
+                    rotated_images[key] = iops.rotate_image(view, key[1])
+                render_entry(rotated_images[key], entry)
+                written += 1
+    except Exception as exc:
+        return source, written, str(exc)
+    return source, written, None
+
+
+def render_groups(groups: List[Tuple[str, List[dict]]], workers: Optional[int] = None) -> int:
+    """Render grouped entries on a process pool, printing progress.
+
+    Returns:
+        Number of sources that failed
+    """
+    failures = 0
+    with multiprocessing.Pool(processes=workers) as pool:
+        for done, (source, written, error) in enumerate(
+            pool.imap_unordered(render_source, groups), start=1
+        ):
+            if error is None:
+                print(f"[{done}/{len(groups)}] {source}: {written} crop(s)")
+            else:
+                failures += 1
+                print(f"[{done}/{len(groups)}] {source}: ERROR after {written} crop(s): {error}", file=sys.stderr)
+    return failures
+
+
+def apply_encoder(entries: List[dict], encoder: Optional[str]) -> None:
+    """Override the encoder profile of every entry when one was given on the command line."""
+    if encoder is None:
+        return
+    for entry in entries:
+        entry["encoder"] = encoder
+
+
+def crop_command(args) -> int:
+    entries = read_manifest(args.manifest)
+    apply_encoder(entries, args.encoder)
+    groups = group_by_source(entries, args.output_folder)
+    print(f"Rendering {sum(len(jobs) for _, jobs in groups)} crop(s) from {len(groups)} source(s).")
+    return 1 if render_groups(groups, args.workers) else 0
+
+
+def render_command(args) -> int:
+    entries = read_manifest(args.journal)
+    if args.width is not None or args.height is not None:
+        for entry in entries:
+            entry["output_size"] = [args.width, args.height]
+    apply_encoder(entries, args.encoder)
+
+    groups = group_by_source(entries, args.output_folder)
+    total = sum(len(jobs) for _, jobs in groups)
+    if not args.force:
+        groups = [
+            (source, [entry for entry in jobs if not is_up_to_date(entry)])
+            for source, jobs in groups
+        ]
+        groups = [(source, jobs) for source, jobs in groups if jobs]
+
+    pending = sum(len(jobs) for _, jobs in groups)
+    print(f"Rendering {pending} of {total} crop(s), {total - pending} up to date.")
+    return 1 if render_groups(groups, args.workers) else 0
+
+
+def dedup_command(args) -> int:
+    paths = list(hashindex.iter_dataset_images(args.output_folder))
+    print(f"Hashing {len(paths)} image(s).")
+
+    hashes = {}
+    failures = 0
+    with multiprocessing.Pool(processes=args.workers) as pool:
+        for path, hash_value, error in pool.imap_unordered(hashindex.hash_image_file, paths, chunksize=16):
+            if error is None:
+                hashes[os.path.relpath(path, args.output_folder)] = hash_value
+            else:
+                failures += 1
+                print(f"{path}: ERROR: {error}", file=sys.stderr)
+
+    groups = hashindex.find_duplicate_groups(hashes, args.threshold)
+    for group in groups:
+        print(f"{len(group)} near duplicate(s):")
+        for output in group:
+            print(f"    {output}")
+    print(f"{len(groups)} group(s), {sum(len(group) for group in groups)} image(s) within {args.threshold} bit(s).")
+
+    hashindex.DatasetHashIndex(args.output_folder).rewrite(hashes)
+    return 1 if failures else 0
+
+
+def export_command(args) -> int:
+    annotated = tagexport.iter_annotated_images(args.folder, args.recursive, args.workers)
+    if args.format == "coco":
+        stats = tagexport.export_coco(annotated, args.output, args.box_size)
+    elif args.format == "yolo":
+        stats = tagexport.export_yolo(annotated, args.output, args.box_size)
+    else:
+        stats = tagexport.export_jsonl(annotated, args.output)
+
+    for name, error in stats.errors:
+        print(f"{name}: ERROR: {error}", file=sys.stderr)
+    print(f"Exported {stats.tags} tag(s) of {stats.images} image(s) to {args.output}.")
+    return 1 if stats.errors else 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fast Batch Image Crop headless tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    crop_parser = subparsers.add_parser("crop", help="Render the crops listed in a manifest.")
+    crop_parser.add_argument("manifest", help="JSON Lines crop manifest")
+    crop_parser.add_argument("output_folder", help="Folder to write crops to")
+    crop_parser.add_argument("--encoder", choices=fops.ENCODER_PROFILES, default=None, help="Encoder profile for all crops")
+    crop_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    crop_parser.set_defaults(func=crop_command)
+
+    render_parser = subparsers.add_parser("render", help="Re-render an output folder from its crop journal.")
+    render_parser.add_argument("journal", help=f"Crop journal ({fops.CROP_JOURNAL_FILENAME} in an output folder)")
+    render_parser.add_argument("output_folder", help="Folder to write crops to")
+    render_parser.add_argument("--width", type=int, default=None, help="New output width")
+    render_parser.add_argument("--height", type=int, default=None, help="New output height")
+    render_parser.add_argument("--encoder", choices=fops.ENCODER_PROFILES, default=None, help="New encoder profile")
+    render_parser.add_argument("--force", action="store_true", help="Render crops that are up to date too")
+    render_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    render_parser.set_defaults(func=render_command)
+
+    dedup_parser = subparsers.add_parser("dedup", help="Report near-duplicate images in an output folder.")
+    dedup_parser.add_argument("output_folder", help="Output folder to scan")
+    dedup_parser.add_argument(
+        "--threshold", type=int, default=hashindex.DEFAULT_DUPLICATE_THRESHOLD,
+        help=f"Maximum differing dhash bits (default: {hashindex.DEFAULT_DUPLICATE_THRESHOLD})",
+    )
+    dedup_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    dedup_parser.set_defaults(func=dedup_command)
+
+    export_parser = subparsers.add_parser("export", help="Export Tag Editor annotations to one dataset file.")
+    export_parser.add_argument("folder", help="Image folder with .tagdata files")
+    export_parser.add_argument("output", help="Output file (coco, jsonl) or folder (yolo)")
+    export_parser.add_argument("--format", choices=tagexport.EXPORT_FORMATS, required=True, help="Export format")
+    export_parser.add_argument("--recursive", action="store_true", help="Include subfolders")
+    export_parser.add_argument(
+        "--box-size", type=int, default=tagexport.DEFAULT_BOX_SIZE,
+        help=f"Box size around point tags in pixels (default: {tagexport.DEFAULT_BOX_SIZE})",
+    )
+    export_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    export_parser.set_defaults(func=export_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
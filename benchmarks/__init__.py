@@ -0,0 +1,5 @@
+"""Benchmarks of the image pipeline.
+
+Run the reproducible suite with python -m benchmarks, or a single micro
+benchmark with python -m benchmarks.<name>.
+"""
@@ -0,0 +1,69 @@
+"""Reproducible benchmarks of the imageops and fileops hot paths.
+
+Times load_image (JPEG, PNG and WebP), crop_image, resize_image,
+rotate_image and scale_image on synthetic images of the given sizes,
+fileops.save_image_to_file with every encoder profile on a 1 MP crop, and
+fileops.get_image_files on synthetic folders of the given file counts. Each
+case runs in its own process with warmup runs, and reports the median time
+and peak resident memory.
+
+Results can be saved as JSON with --output and compared against a saved
+baseline with --baseline; the exit status is 1 when any case is slower than
+its baseline by more than --threshold.
+
+Usage:
+    python -m benchmarks [--megapixels MP ...] [--formats FMT ...] [--files N ...]
+                         [--warmup N] [--repeat N] [--data DIR] [--filter TEXT]
+                         [--output RESULTS.json] [--baseline RESULTS.json] [--threshold FRACTION]
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+
+from benchmarks import harness, suite, synthetic
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the imageops and fileops hot paths.")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 12])
+    parser.add_argument("--formats", nargs="+", choices=synthetic.IMAGE_FORMATS, default=list(synthetic.IMAGE_FORMATS))
+    parser.add_argument("--files", type=int, nargs="*", default=[10000])
+    parser.add_argument("--warmup", type=int, default=harness.DEFAULT_WARMUP)
+    parser.add_argument("--repeat", type=int, default=harness.DEFAULT_REPEAT)
+    parser.add_argument("--data", default=None, help="Folder to keep generated inputs in (default: temporary)")
+    parser.add_argument("--filter", default=None, help="Only run cases whose name contains this text")
+    parser.add_argument("--output", default=None, help="Write results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Compare against results saved with --output")
+    parser.add_argument("--threshold", type=float, default=harness.DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    data_folder = args.data if args.data is not None else tempfile.mkdtemp(prefix="benchmark-data-")
+    try:
+        print(f"Preparing inputs in {data_folder}...", flush=True)
+        cases = suite.build_cases(args, data_folder)
+        print(f"{len(cases)} case(s), {args.warmup} warmup and {args.repeat} timed run(s) each")
+        results = harness.run_cases(cases, args.warmup, args.repeat)
+    finally:
+        if args.data is None:
+            shutil.rmtree(data_folder, ignore_errors=True)
+
+    if args.output is not None:
+        harness.save_results(
+            args.output,
+            results,
+            {"warmup": args.warmup, "repeat": args.repeat, "canvas_size": suite.CANVAS_SIZE, "output_width": suite.OUTPUT_WIDTH},
+        )
+
+    if args.baseline is not None:
+        print(f"Against {args.baseline}, threshold {args.threshold:.0%}")
+        regressions = harness.compare(results, harness.load_results(args.baseline), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,67 @@
+"""Encode time and output size of the fileops encoder profiles.
+
+Encodes representative crops in memory: a smooth photo-like crop, a noisy
+high-detail crop and a crop with an alpha channel. The former PNG setting
+(optimize=True) is included for comparison.
+
+Usage:
+    python -m benchmarks.encoders [--size S] [--repeat N]
+"""
+
+import argparse
+import io
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageFilter
+
+import fileops as fops
+
+
+def make_test_crops(size):
+    """Build (name, image) pairs of representative crops."""
+    gradient = Image.linear_gradient("L").resize((size, size))
+    noise = Image.effect_noise((size, size), 48)
+    photo = Image.merge(
+        "RGB", (gradient, noise.filter(ImageFilter.GaussianBlur(4)), gradient.rotate(90))
+    )
+    detail = Image.merge("RGB", (noise, gradient, noise.rotate(180)))
+    alpha = photo.convert("RGBA")
+    alpha.putalpha(gradient.rotate(45))
+    return [("photo", photo), ("detail", detail), ("alpha", alpha)]
+
+
+def encode(image, profile):
+    if profile.format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=profile.format, **profile.options)
+    return buffer.tell()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark encoder profiles.")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    crops = make_test_crops(args.size)
+    print(f"{args.size}x{args.size} crops, median of {args.repeat}")
+    print(f"  {'profile':<15}" + "".join(f"{name:>22}" for name, _ in crops))
+    legacy = fops.EncoderProfile("png-optimize", ".png", "PNG", {"optimize": True})
+    for profile in [legacy, *fops.ENCODER_PROFILES.values()]:
+        cells = []
+        for _, image in crops:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                nbytes = encode(image, profile)
+                timings.append((time.perf_counter() - start) * 1000)
+            cells.append(f"{statistics.median(timings):8.1f} ms {nbytes / 1024:7.1f} KiB")
+        print(f"  {profile.name:<15}" + "".join(f"{cell:>22}" for cell in cells))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
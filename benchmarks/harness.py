@@ -0,0 +1,157 @@
+"""Timing, peak memory and baseline comparison for the benchmark suite.
+
+Every case runs in a freshly spawned process so that its peak resident set
+size is not inflated by earlier cases: the case's setup builds its input,
+warmup runs are discarded, then the timed runs follow. Results are written as
+JSON and can be compared against a stored baseline.
+"""
+
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import PIL
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESULTS_VERSION = 1
+DEFAULT_WARMUP = 1
+DEFAULT_REPEAT = 5
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+class Case(NamedTuple):
+    """A benchmark case; setup and run must be module level functions so they can be pickled.
+
+    setup(*args) builds the input passed to run, outside of the timings.
+    """
+
+    name: str
+    setup: Callable
+    run: Callable
+    args: Tuple = ()
+
+
+class Result(NamedTuple):
+    name: str
+    median_ms: float
+    min_ms: float
+    max_ms: float
+    repeat: int
+    peak_rss_mib: Optional[float]
+    peak_rss_delta_mib: Optional[float]
+
+
+def peak_rss_mib() -> Optional[float]:
+    """Return the peak resident set size of this process in MiB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(case: Case, warmup: int, repeat: int) -> Result:
+    """Run a case in this process and return its timings."""
+    state = case.setup(*case.args)
+    setup_peak = peak_rss_mib()
+    for _ in range(warmup):
+        case.run(state)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case.run(state)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    peak = peak_rss_mib()
+    return Result(
+        case.name,
+        statistics.median(timings),
+        min(timings),
+        max(timings),
+        repeat,
+        peak,
+        None if peak is None else peak - setup_peak,
+    )
+
+
+def run_cases(cases: List[Case], warmup: int = DEFAULT_WARMUP, repeat: int = DEFAULT_REPEAT) -> List[Result]:
+    """Measure every case in its own spawned process, printing results as they come."""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        with context.Pool(processes=1, maxtasksperchild=1) as pool:
+            result = pool.apply(measure, (case, warmup, repeat))
+        results.append(result)
+        memory = "" if result.peak_rss_mib is None else f"  peak {result.peak_rss_mib:8.1f} MiB (+{result.peak_rss_delta_mib:.1f})"
+        print(f"  {result.name:<40} {result.median_ms:10.2f} ms{memory}", flush=True)
+    return results
+
+
+def environment() -> Dict[str, str]:
+    """Describe the interpreter and libraries results were measured with."""
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def save_results(path: str, results: List[Result], parameters: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "version": RESULTS_VERSION,
+                "environment": environment(),
+                "parameters": parameters,
+                "results": {result.name: result._asdict() for result in results},
+            },
+            f,
+            indent=2,
+        )
+
+
+def load_results(path: str) -> Dict[str, dict]:
+    """Read the results of a saved run, keyed by case name.
+
+    Raises:
+        ValueError: If the file is not a results file of this version
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    if data.get("version") != RESULTS_VERSION:
+        raise ValueError(f"{path} is not a version {RESULTS_VERSION} benchmark results file")
+    return data["results"]
+
+
+def compare(results: List[Result], baseline: Dict[str, dict], threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[str]:
+    """Print each case against the baseline and return the names of regressed cases.
+
+    A case regresses when its median time exceeds the baseline median by more
+    than threshold (a fraction). Cases missing from the baseline are reported
+    but never regress.
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.name)
+        if reference is None:
+            print(f"  {result.name:<40} {result.median_ms:10.2f} ms  (not in baseline)")
+            continue
+        change = result.median_ms / reference["median_ms"] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(result.name)
+        print(
+            f"  {result.name:<40} {reference['median_ms']:10.2f} -> {result.median_ms:10.2f} ms"
+            f"  {change:+7.1%}{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
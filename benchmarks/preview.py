@@ -0,0 +1,132 @@
+"""Time-to-first-pixel of the preview paths.
+
+Compares a full decode scaled with LANCZOS, a reduced-resolution decode
+through iops.ImageSource scaled with LANCZOS, the progressive path's interim
+preview (iops.fast_scale_image) and its LANCZOS upgrade, on synthetic JPEGs
+and PNGs, and scaling an already decoded video frame with LANCZOS against the
+fast path used during playback. PNGs have no reduced-resolution decode, so
+there the upgrade only saves time by reusing the interim preview's decode.
+
+Usage:
+    python -m benchmarks.preview [--width W] [--height H] [--canvas CW CH] [--repeat N]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import imageops as iops
+
+
+IMAGE_FORMATS = (("JPEG", ".jpg", {"quality": 90}), ("PNG", ".png", {"compress_level": 1}))
+
+
+def make_test_image(path, width, height, options):
+    """Write a noisy gradient image that does not compress away."""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 64)
+    Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT))).save(
+        path, **options
+    )
+
+
+def full_lanczos(path, canvas_size):
+    image = iops.load_image(path)
+    return iops.scale_image(image, iops.fit_ratio(image.size, canvas_size))
+
+
+def draft_lanczos(path, canvas_size):
+    image = iops.ImageSource(path)
+    return iops.scale_image(image, iops.fit_ratio(image.size, canvas_size))
+
+
+def draft_fast(path, canvas_size):
+    image = iops.ImageSource(path)
+    return iops.fast_scale_image(image, iops.fit_ratio(image.size, canvas_size))
+
+
+def interim_source(path, canvas_size):
+    image = iops.ImageSource(path)
+    iops.fast_scale_image(image, iops.fit_ratio(image.size, canvas_size))
+    return image
+
+
+def upgrade_lanczos(image, canvas_size):
+    return iops.scale_image(image, iops.fit_ratio(image.size, canvas_size))
+
+
+def frame_lanczos(frame, canvas_size):
+    return iops.scale_image(frame, iops.fit_ratio(frame.size, canvas_size))
+
+
+def frame_fast(frame, canvas_size):
+    return iops.fast_scale_image(frame, iops.fit_ratio(frame.size, canvas_size))
+
+
+def time_path(function, source, canvas_size, repeat, prepare=None):
+    """Return the median time of function in milliseconds, excluding prepare."""
+    timings = []
+    for _ in range(repeat):
+        argument = source if prepare is None else prepare(source, canvas_size)
+        start = time.perf_counter()
+        function(argument, canvas_size)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def print_comparison(paths, source, canvas_size, repeat):
+    baseline = None
+    for name, function, *prepare in paths:
+        milliseconds = time_path(function, source, canvas_size, repeat, *prepare)
+        baseline = baseline or milliseconds
+        print(f"  {name:<30} {milliseconds:8.1f} ms  {baseline / milliseconds:5.1f}x")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark preview time-to-first-pixel.")
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--canvas", type=int, nargs=2, default=(1280, 800))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    canvas_size = tuple(args.canvas)
+    with tempfile.TemporaryDirectory() as folder:
+        for name, extension, options in IMAGE_FORMATS:
+            path = os.path.join(folder, "test" + extension)
+            make_test_image(path, args.width, args.height, options)
+
+            print(
+                f"{args.width}x{args.height} {name} on a {canvas_size[0]}x{canvas_size[1]} canvas, "
+                f"median of {args.repeat}"
+            )
+            print_comparison(
+                (
+                    ("full decode + LANCZOS", full_lanczos),
+                    ("draft decode + LANCZOS", draft_lanczos),
+                    ("draft decode + fast (interim)", draft_fast),
+                    ("upgrade of the interim", upgrade_lanczos, interim_source),
+                ),
+                path,
+                canvas_size,
+                args.repeat,
+            )
+
+        frame = iops.load_image(path).resize((1920, 1080))
+        print("1920x1080 decoded video frame on the same canvas")
+        print_comparison(
+            (("LANCZOS", frame_lanczos), ("fast (playback)", frame_fast)),
+            frame,
+            canvas_size,
+            args.repeat,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
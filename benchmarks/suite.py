@@ -0,0 +1,111 @@
+"""Benchmark cases of the imageops and fileops hot paths.
+
+Setup and run functions live here rather than in __main__ so that the
+spawned processes the cases run in can import them.
+"""
+
+import functools
+import os
+
+import fileops as fops
+import imageops as iops
+from benchmarks import harness, synthetic
+
+CANVAS_SIZE = (1280, 800)
+OUTPUT_WIDTH = 1024
+SAVE_MEGAPIXELS = 1
+
+
+def setup_path(path):
+    return path
+
+
+def setup_image(path):
+    return iops.load_image(path)
+
+
+def setup_save(path, folder):
+    return iops.load_image(path), folder
+
+
+def run_load_image(path):
+    iops.load_image(path)
+
+
+def run_crop_image(image):
+    width, height = image.size
+    iops.crop_image(image, 1.0, (width // 4, height // 4, width * 3 // 4, height * 3 // 4))
+
+
+def run_resize_image(image):
+    iops.resize_image(image, width=OUTPUT_WIDTH)
+
+
+def run_rotate_image(image):
+    iops.rotate_image(image, 90)
+
+
+def run_scale_image(image):
+    iops.scale_image(image, iops.fit_ratio(image.size, CANVAS_SIZE))
+
+
+def run_get_image_files(path):
+    fops.get_image_files(path, recursive=True)
+
+
+def run_save_image(state, profile_name):
+    image, folder = state
+    profile = fops.get_encoder_profile(profile_name)
+    fops.save_image_to_file(image, os.path.join(folder, "crop" + profile.extension), profile)
+
+
+def image_input(data_folder, megapixels, format_name):
+    return (synthetic.image_file(data_folder, megapixels, format_name),)
+
+
+def save_input(data_folder):
+    return synthetic.image_file(data_folder, SAVE_MEGAPIXELS, "png"), os.path.join(data_folder, "saved")
+
+
+def file_tree_input(data_folder, count):
+    return (synthetic.file_tree(data_folder, count),)
+
+
+def build_cases(args, data_folder):
+    """Build the cases selected by the command line, generating only the inputs they need."""
+    specs = []
+    for megapixels in args.megapixels:
+        for format_name in args.formats:
+            specs.append((
+                f"load_image/{format_name}/{megapixels:g}mp", setup_path, run_load_image,
+                functools.partial(image_input, data_folder, megapixels, format_name),
+            ))
+        for name, run in (
+            ("crop_image", run_crop_image),
+            ("resize_image", run_resize_image),
+            ("rotate_image", run_rotate_image),
+            ("scale_image", run_scale_image),
+        ):
+            specs.append((
+                f"{name}/{megapixels:g}mp", setup_image, run,
+                functools.partial(image_input, data_folder, megapixels, args.formats[0]),
+            ))
+
+    for profile_name in fops.ENCODER_PROFILES:
+        specs.append((
+            f"save_image_to_file/{profile_name}/{SAVE_MEGAPIXELS:g}mp", setup_save,
+            functools.partial(run_save_image, profile_name=profile_name),
+            functools.partial(save_input, data_folder),
+        ))
+
+    for count in args.files:
+        specs.append((
+            f"get_image_files/{count}", setup_path, run_get_image_files,
+            functools.partial(file_tree_input, data_folder, count),
+        ))
+
+    return [
+        harness.Case(name, setup, run, make_input())
+        for name, setup, run, make_input in specs
+        if args.filter is None or args.filter in name
+    ]
@@ -0,0 +1,69 @@
+"""Deterministic synthetic inputs for the benchmark suite.
+
+Inputs are generated into a data folder once and reused on later runs, so
+repeated runs and runs on other machines measure identical files.
+"""
+
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+import fileops as fops
+
+IMAGE_FORMATS = {"jpeg": ("JPEG", ".jpg", {"quality": 90}), "png": ("PNG", ".png", {}), "webp": ("WEBP", ".webp", {"quality": 90})}
+IMAGE_ASPECT = 3 / 2
+NOISE_TILE = 256
+FILES_PER_FOLDER = 1000
+SEED = 1234
+
+
+def image_size(megapixels: float):
+    """Return the 3:2 (width, height) closest to a pixel count in megapixels."""
+    height = int(math.sqrt(megapixels * 1_000_000 / IMAGE_ASPECT))
+    return int(height * IMAGE_ASPECT), height
+
+
+def make_image(width: int, height: int, seed: int = SEED) -> Image.Image:
+    """Build a gradient with tiled noise, which neither compresses away nor takes long to generate."""
+    rng = np.random.RandomState(seed)
+    tile = Image.fromarray(rng.randint(0, 256, (NOISE_TILE, NOISE_TILE, 3), dtype=np.uint8))
+    noise = Image.new("RGB", (width, height))
+    for upper in range(0, height, NOISE_TILE):
+        for left in range(0, width, NOISE_TILE):
+            noise.paste(tile, (left, upper))
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    return Image.blend(gradient, noise, 0.35)
+
+
+def image_file(folder: str, megapixels: float, format_name: str) -> str:
+    """Return the path of a synthetic image, generating it on first use."""
+    pillow_format, extension, options = IMAGE_FORMATS[format_name]
+    path = os.path.join(folder, "images", f"{megapixels:g}mp{extension}")
+    if not os.path.exists(path):
+        fops.create_folder(os.path.dirname(path))
+        image = make_image(*image_size(megapixels))
+        fops.atomic_write(path, lambda f: image.save(f, format=pillow_format, **options))
+    return path
+
+
+def file_tree(folder: str, count: int) -> str:
+    """Return a folder holding count empty image files in subfolders, generating it on first use.
+
+    Files are spread over subfolders of FILES_PER_FOLDER so that listings
+    exercise the recursive walk; a marker file records a complete tree.
+    """
+    root = os.path.join(folder, "trees", str(count))
+    marker = os.path.join(root, ".complete")
+    if os.path.exists(marker):
+        return root
+
+    extensions = [extension for _, extension, _ in IMAGE_FORMATS.values()]
+    for index in range(count):
+        subfolder = os.path.join(root, f"{index // FILES_PER_FOLDER:05d}")
+        if index % FILES_PER_FOLDER == 0:
+            fops.create_folder(subfolder)
+        open(os.path.join(subfolder, f"img_{index}{extensions[index % len(extensions)]}"), "wb").close()
+    open(marker, "wb").close()
+    return root
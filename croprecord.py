@@ -0,0 +1,86 @@
+"""Journal and hash index bookkeeping of the crops the tabs write."""
+
+import functools
+import os
+import queue
+import threading
+from typing import Callable, List, Tuple
+
+import fileops as fops
+import hashindex
+import imageops as iops
+
+MESSAGE_WARNING = "warning"
+MESSAGE_ERROR = "error"
+
+
+class CropRecorder:
+    """Records written crops in the crop journal and hash index of their output folder.
+
+    Recording is done by the CropJob.on_written callbacks of on_written(), so it
+    runs on a crop writer thread once the crop is on disk: crops that fail to
+    save are never journaled, and hashing stays off the Tk thread. Errors and
+    near duplicate warnings are queued for the Tk thread to show, see
+    pop_messages().
+    """
+
+    def __init__(self):
+        self._journals = {}
+        self._hash_indexes = {}
+        self._messages = queue.Queue()
+        self._lock = threading.Lock()
+
+    def on_written(self, output_root: str, entry: dict, warn_duplicates: bool) -> Callable[[fops.CropJob], None]:
+        """Build the callback recording a crop once it has been written.
+
+        Args:
+            output_root: Output folder the crop is recorded in
+            entry: Crop record in batch manifest format, completed with "output"
+            warn_duplicates: Whether to warn when the crop nearly duplicates an indexed one
+
+        Returns:
+            Callback for CropJob.on_written
+        """
+        return functools.partial(self._record, output_root, entry, warn_duplicates)
+
+    def pop_messages(self) -> List[Tuple[str, str]]:
+        """Return and forget the (MESSAGE_WARNING or MESSAGE_ERROR, text) pairs queued so far."""
+        messages = []
+        while True:
+            try:
+                messages.append(self._messages.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def _record(self, output_root: str, entry: dict, warn_duplicates: bool, job: fops.CropJob) -> None:
+        output = os.path.relpath(job.image_path, output_root)
+        entry["output"] = output
+        crop_hash = iops.dhash(job.image)
+
+        with self._lock:
+            journal = self._journals.get(output_root)
+            if journal is None:
+                journal = self._journals[output_root] = fops.CropJournal(output_root)
+            try:
+                journal.append(entry)
+            except OSError as exc:
+                self._messages.put((MESSAGE_ERROR, f"Could not write crop journal: {exc}"))
+
+            hash_index = self._hash_indexes.get(output_root)
+            if hash_index is None:
+                hash_index = self._hash_indexes[output_root] = hashindex.DatasetHashIndex(output_root)
+            duplicates = hash_index.find(crop_hash) if warn_duplicates else []
+            try:
+                hash_index.add(output, crop_hash)
+            except OSError as exc:
+                self._messages.put((MESSAGE_ERROR, f"Could not write hash index: {exc}"))
+                return
+
+        # A crop written to the same file before was replaced by this one
+        duplicates = [duplicate for duplicate in duplicates if duplicate[1] != output]
+        if duplicates:
+            distance, duplicate = duplicates[0]
+            self._messages.put((
+                MESSAGE_WARNING,
+                f"Crop nearly duplicates {duplicate} (distance {distance}) and {len(duplicates) - 1} other(s).",
+            ))
@@ -1,15 +1,70 @@
 """File operations for image and tag data management."""
 
-import glob
+import io
 import os
 import sys
 import errno
 import json
-from typing import Optional, List, Tuple
+import queue
+import tempfile
+import threading
+import functools
+import re
+from array import array
+from typing import Callable, IO, Iterable, Iterator, NamedTuple, Optional, List, Tuple
 from PIL import Image
 
+import imageops as iops
+import profiling
+
 ERROR_INVALID_NAME = 123
 
+# Readable input formats; crops are written with an ENCODER_PROFILES entry instead
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff")
+DEFAULT_SCAN_BATCH_SIZE = 2000
+
+CROP_JOURNAL_FILENAME = "crops.jsonl"
+# Journal "orientation" of boxes given after the source's EXIF orientation
+ORIENTATION_EXIF = "exif"
+CACHE_FOLDER_NAME = "fastbatchimagecrop"
+
+DEFAULT_WRITER_QUEUE_SIZE = 32
+DEFAULT_WRITER_WORKERS = 2
+
+
+def _read_umask() -> int:
+    # The umask can only be read by setting it, so do it once, at import
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _read_umask()
+
+
+class EncoderProfile(NamedTuple):
+    """A named output encoding: file extension, Pillow format and save options."""
+
+    name: str
+    extension: str
+    format: str
+    options: dict
+
+
+ENCODER_PROFILES = {
+    profile.name: profile
+    for profile in (
+        EncoderProfile("png-fast", ".png", "PNG", {"compress_level": 1}),
+        EncoderProfile("png", ".png", "PNG", {"compress_level": 6}),
+        EncoderProfile("png-small", ".png", "PNG", {"compress_level": 9}),
+        EncoderProfile("jpeg-95", ".jpg", "JPEG", {"quality": 95}),
+        EncoderProfile("jpeg-85", ".jpg", "JPEG", {"quality": 85}),
+        EncoderProfile("webp-90", ".webp", "WEBP", {"quality": 90, "method": 4}),
+        EncoderProfile("webp-lossless", ".webp", "WEBP", {"lossless": True, "quality": 50, "method": 4}),
+    )
+}
+DEFAULT_ENCODER_PROFILE = "png"
+
 
 def sanitize_path(filepath: str) -> str:
     """Sanitize a file path to prevent path traversal attacks.
@@ -54,40 +109,230 @@ def validate_write_path(
     return sanitized
 
 
-def get_image_files(path: str) -> Tuple[Tuple[str, str], ...]:
+def natural_sort_key(text: str) -> list:
+    """Sort key ordering embedded numbers by value, e.g. img2 before img10."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", text)]
+
+
+def scan_image_files(
+    path: str,
+    recursive: bool = False,
+    exclude: Tuple[str, ...] = (),
+    batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+) -> Iterator[List[Tuple[str, str]]]:
+    """Walk a directory once, yielding image files in batches as they are found.
+
+    Extensions are matched case-insensitively. Each directory is read with a
+    single os.scandir call and its files are naturally sorted before its
+    subdirectories are visited, so concatenating the batches gives a stable,
+    naturally sorted listing.
+
+    Args:
+        path: Directory path to search for images
+        recursive: Also search subdirectories
+        exclude: Directory paths to skip when recursing
+        batch_size: Maximum number of files per batch
+
+    Yields:
+        Lists of (name, filepath) pairs, name being relative to path
+    """
+    excluded = {os.path.normcase(os.path.abspath(p)) for p in exclude if p}
+    stack = [(path, "")]
+    batch = []
+    while stack:
+        directory, prefix = stack.pop()
+        filenames = []
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                        filenames.append(entry.name)
+                    elif recursive and entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.name)
+        except OSError:
+            continue
+
+        filenames.sort(key=natural_sort_key)
+        for filename in filenames:
+            batch.append((prefix + filename, os.path.join(directory, filename)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        subdirectories.sort(key=natural_sort_key, reverse=True)
+        for subdirectory in subdirectories:
+            subdirectory_path = os.path.join(directory, subdirectory)
+            if os.path.normcase(os.path.abspath(subdirectory_path)) not in excluded:
+                stack.append((subdirectory_path, prefix + subdirectory + os.sep))
+
+    if batch:
+        yield batch
+
+
+def get_image_files(path: str, recursive: bool = False) -> Tuple[Tuple[str, str], ...]:
     """Get all image files from a directory.
 
     Args:
         path: Directory path to search for images
+        recursive: Also search subdirectories
 
     Returns:
-        Tuple of (filename, filepath) pairs sorted by filepath
+        Tuple of (filename, filepath) pairs in natural order
     """
-    types = ("*.jpg", "*.JPG", "*.jpeg", "*.JPEG", "*.png", "*.PNG", "*.webp", "*.WEBP")
-    filepaths: List[str] = []
-    filenames: List[str] = []
-    for t in types:
-        filepaths.extend(glob.glob(os.path.join(path, t)))
+    files: List[Tuple[str, str]] = []
+    for batch in scan_image_files(path, recursive):
+        files.extend(batch)
+    return tuple(files)
+
+
+class ImageFileList:
+    """Compact sequence of (filename, filepath) pairs below a shared root folder.
+
+    Names relative to the root are stored UTF-8 encoded in one bytearray with
+    an array of end offsets rather than as two str objects per file, which
+    keeps million-file listings small. Indexing returns the same
+    (filename, filepath) pairs get_image_files does, in O(1).
+    """
+
+    def __init__(self, root: str, files: Iterable[Tuple[str, str]] = ()):
+        self.root = root
+        self._names = bytearray()
+        self._ends = array("Q")
+        self.extend(files)
+
+    def __len__(self) -> int:
+        return len(self._ends)
 
-    filepaths = sorted(filepaths)
+    def __getitem__(self, index: int) -> Tuple[str, str]:
+        name = self.name(index)
+        return name, os.path.join(self.root, name)
 
-    for file in filepaths:
-        _, tail = os.path.split(file)
-        filenames.append(tail)
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        for index in range(len(self)):
+            yield self[index]
 
-    return tuple(zip(filenames, filepaths))
+    def name(self, index: int) -> str:
+        """Return the filename at index, relative to the root folder."""
+        if index < 0:
+            index += len(self._ends)
+        if not 0 <= index < len(self._ends):
+            raise IndexError("ImageFileList index out of range")
+        start = self._ends[index - 1] if index > 0 else 0
+        return self._names[start:self._ends[index]].decode("utf-8", "surrogateescape")
 
+    def extend(self, files: Iterable[Tuple[str, str]]) -> None:
+        """Append (filename, filepath) pairs whose filename is relative to the root."""
+        for name, _ in files:
+            self._names += name.encode("utf-8", "surrogateescape")
+            self._ends.append(len(self._names))
 
-def save_image_to_file(image: Image.Image, filepath: str) -> None:
+
+class DirectoryScanner:
+    """Runs scan_image_files on a background thread.
+
+    Batches are handed over through a queue and collected with poll() from the
+    Tk thread, so large folders can be shown while they are still being read.
+    """
+
+    def __init__(self, path: str, recursive: bool = False, exclude: Tuple[str, ...] = ()):
+        self.path = path
+        self.error = None
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(
+            target=self._run, args=(path, recursive, exclude), name="directory-scanner", daemon=True
+        )
+        self._thread.start()
+
+    def poll(self) -> Tuple[List[Tuple[str, str]], bool]:
+        """Collect the files found since the last poll without blocking.
+
+        Returns:
+            Tuple of (new (name, filepath) pairs, whether the scan has finished)
+        """
+        files = []
+        while not self._finished:
+            try:
+                batch = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                self._finished = True
+            else:
+                files.extend(batch)
+        return files, self._finished
+
+    def cancel(self) -> None:
+        """Stop scanning after the current directory entry batch."""
+        self._cancelled.set()
+
+    def _run(self, path: str, recursive: bool, exclude: Tuple[str, ...]) -> None:
+        try:
+            for batch in scan_image_files(path, recursive, exclude):
+                if self._cancelled.is_set():
+                    return
+                self._queue.put(batch)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._queue.put(None)
+
+
+def get_encoder_profile(name: Optional[str] = None) -> EncoderProfile:
+    """Get an encoder profile by name.
+
+    Args:
+        name: Profile name, or None for the default profile
+
+    Returns:
+        The encoder profile
+
+    Raises:
+        ValueError: If there is no profile of that name
+    """
+    try:
+        return ENCODER_PROFILES[name or DEFAULT_ENCODER_PROFILE]
+    except KeyError:
+        raise ValueError(f"Unknown encoder profile '{name}'") from None
+
+
+def encoder_profile_for_path(filepath: str) -> EncoderProfile:
+    """Get the first encoder profile writing files with the extension of a path.
+
+    Args:
+        filepath: File path
+
+    Returns:
+        The encoder profile
+
+    Raises:
+        ValueError: If no profile writes that extension
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == ".jpeg":
+        extension = ".jpg"
+    default = get_encoder_profile()
+    if default.extension == extension:
+        return default
+    for profile in ENCODER_PROFILES.values():
+        if profile.extension == extension:
+            return profile
+    raise ValueError(f"File extension '{extension}' not allowed")
+
+
+def save_image_to_file(image: Image.Image, filepath: str, profile: Optional[EncoderProfile] = None) -> None:
     """Save an image to a file.
 
     Args:
         image: PIL Image object to save
         filepath: Destination file path (must have image extension)
+        profile: Encoder profile, or None to pick one by the file extension
     """
     safe_path = validate_write_path(filepath, [".png", ".jpg", ".jpeg", ".webp"])
     create_folder(os.path.dirname(safe_path))
-    image.save(safe_path, quality=100, optimize=True)
+    _write_image(image, safe_path, profile)
 
 
 def save_image_description_to_file(description: Optional[str], filepath: str) -> None:
@@ -100,8 +345,237 @@ def save_image_description_to_file(description: Optional[str], filepath: str) ->
     if description is not None:
         safe_path = validate_write_path(filepath, [".txt"])
         create_folder(os.path.dirname(safe_path))
-        with open(safe_path, "w") as text_file:
-            text_file.write(description)
+        _write_text(description, safe_path)
+
+
+def atomic_write(filepath: str, write: Callable[[IO[bytes]], None]) -> None:
+    """Write a file through a temporary file in the same folder and rename it into place.
+
+    Readers never observe a partially written file, and a failed write leaves any
+    previous file at filepath untouched. The file keeps the permissions of the
+    file it replaces, and is otherwise created as open() would (0666 less the
+    umask), rather than owner-only like the temporary file.
+
+    Args:
+        filepath: Destination file path
+        write: Callable receiving the open binary temporary file
+    """
+    directory, name = os.path.split(filepath)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory or None)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        try:
+            mode = os.stat(filepath).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _write_image(image: Image.Image, filepath: str, profile: Optional[EncoderProfile] = None) -> None:
+    if profile is None:
+        profile = encoder_profile_for_path(filepath)
+    if profile.format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    # Encoded in memory first so that encode and write time are measured apart
+    with profiling.stage("encode"):
+        buffer = io.BytesIO()
+        image.save(buffer, format=profile.format, **profile.options)
+    with profiling.stage("write"):
+        atomic_write(filepath, lambda f: f.write(buffer.getbuffer()))
+
+
+def _write_text(text: str, filepath: str) -> None:
+    atomic_write(filepath, lambda f: f.write(text.encode("utf-8")))
+
+
+@functools.lru_cache(maxsize=32)
+def next_free_crop_paths(folder: str, base_name: str, index: int, extension: str) -> Tuple[int, str, str]:
+    """Find the first crop index, from index on, whose image and description files don't exist yet.
+
+    Args:
+        folder: Folder the crop is written to
+        base_name: File name of the crop's source without extension
+        index: Index to start from
+        extension: Extension of the image file
+
+    Returns:
+        Tuple of (index, image_path, description_path)
+    """
+    while True:
+        image_path = os.path.join(folder, f"{base_name}_{index}{extension}")
+        description_path = os.path.join(folder, f"{base_name}_{index}.txt")
+        if not os.path.exists(image_path) and not os.path.exists(description_path):
+            return index, image_path, description_path
+        index += 1
+
+
+def resolve_output_path(output_path: str, base_path: str) -> str:
+    """Resolve an output folder, treating invalid paths as relative to base_path.
+
+    Results are cached so repeated saves do not re-validate the same folder.
+
+    Args:
+        output_path: Output folder as entered by the user
+        base_path: Folder to resolve output_path against when it is not valid on its own
+
+    Returns:
+        The output folder path
+    """
+    if not check_path_valid(output_path):
+        return os.path.join(base_path, output_path)
+    return output_path
+
+
+class CropJob(NamedTuple):
+    """A cropped image waiting to be resized, encoded and written.
+
+    on_written is called with the job on the writer thread once its files are written.
+    """
+
+    image: Image.Image
+    image_path: str
+    description: Optional[str] = None
+    description_path: Optional[str] = None
+    output_size: Optional[Tuple[int, int]] = None
+    profile: Optional[EncoderProfile] = None
+    on_written: Optional[Callable[["CropJob"], None]] = None
+
+
+class CropWriter:
+    """Write-behind writer for crops.
+
+    Jobs are accepted into a bounded queue and resized, encoded and written on
+    worker threads, so the caller only blocks when the queue is full. Folders that
+    have already been created are remembered instead of being checked per save.
+    Failures are collected and can be drained with pop_failures().
+    """
+
+    def __init__(self, max_queue_size: int = DEFAULT_WRITER_QUEUE_SIZE, workers: int = DEFAULT_WRITER_WORKERS):
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._failures = queue.Queue()
+        self._created_folders = set()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f"crop-writer-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: CropJob) -> None:
+        """Queue a crop job, blocking while the queue is full.
+
+        Raises:
+            RuntimeError: If the writer has been closed
+        """
+        if self._closed:
+            raise RuntimeError("Crop writer is closed")
+        with self._lock:
+            self._pending += 1
+        self._queue.put(job)
+
+    def pending(self) -> int:
+        """Return the number of jobs queued or being written."""
+        with self._lock:
+            return self._pending
+
+    def flush(self) -> None:
+        """Block until every submitted job has been written or has failed."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Flush outstanding jobs and stop the worker threads."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def pop_failures(self) -> List[Tuple[str, str]]:
+        """Return and forget the (image_path, error message) pairs of failed jobs."""
+        failures = []
+        while True:
+            try:
+                failures.append(self._failures.get_nowait())
+            except queue.Empty:
+                return failures
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(job)
+            except Exception as exc:
+                self._failures.put((job.image_path, str(exc)))
+            finally:
+                if job is not None:
+                    with self._lock:
+                        self._pending -= 1
+                self._queue.task_done()
+
+    def _write(self, job: CropJob) -> None:
+        image = job.image
+        if job.output_size is not None:
+            with profiling.stage("resize"):
+                image = iops.resize_image(image, width=job.output_size[0], height=job.output_size[1])
+
+        image_path = validate_write_path(job.image_path, [".png", ".jpg", ".jpeg", ".webp"])
+        self._ensure_folder(os.path.dirname(image_path))
+        _write_image(image, image_path, job.profile)
+
+        if job.description is not None and job.description_path is not None:
+            description_path = validate_write_path(job.description_path, [".txt"])
+            self._ensure_folder(os.path.dirname(description_path))
+            _write_text(job.description, description_path)
+
+        if job.on_written is not None:
+            job.on_written(job)
+
+    def _ensure_folder(self, path: str) -> None:
+        with self._lock:
+            if path in self._created_folders:
+                return
+        create_folder(path)
+        with self._lock:
+            self._created_folders.add(path)
+
+
+def tag_base_path(image_path: str) -> str:
+    """Return the base path of an image's .tagdata and .txt files.
+
+    The base path is the image path without its extension. Tag files written
+    by earlier versions of the Tag Editor, which cut the file name at its first
+    dot, are still used when only they exist.
+
+    Args:
+        image_path: Path of the tagged image
+
+    Returns:
+        Base path, to which load_tag_data and save_tag_data add extensions
+    """
+    base_path = os.path.splitext(image_path)[0]
+    folder, name = os.path.split(image_path)
+    legacy_base_path = os.path.join(folder, name.split(".")[0])
+    if (
+        legacy_base_path != base_path
+        and not os.path.exists(f"{base_path}.tagdata")
+        and os.path.exists(f"{legacy_base_path}.tagdata")
+    ):
+        return legacy_base_path
+    return base_path
 
 
 def load_tag_data(filename: str) -> Optional[dict]:
@@ -143,6 +617,32 @@ def save_tag_data(filename: str, tag_data: dict) -> None:
         f.write(keywords_string)
 
 
+class CropJournal:
+    """Append-only JSON Lines record of the crops written to an output folder.
+
+    Entries use the batch manifest format (see batch.py) with an extra "output"
+    key holding the image path relative to the output folder, so the folder can
+    be re-rendered from its journal.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, CROP_JOURNAL_FILENAME)
+        self._folder_created = False
+
+    def append(self, entry: dict) -> None:
+        """Append a crop record to the journal.
+
+        Args:
+            entry: Crop record, must be JSON serializable
+        """
+        if not self._folder_created:
+            create_folder(self.output_path)
+            self._folder_created = True
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
 def check_path_valid(path: str) -> bool:
     """Validate a file system path.
 
@@ -184,11 +684,29 @@ def check_path_valid(path: str) -> bool:
         return True
 
 
+def get_cache_folder(*parts: str) -> str:
+    """Get a per-user cache folder for the application, creating it if needed.
+
+    Args:
+        parts: Subfolder names below the application cache folder
+
+    Returns:
+        Cache folder path
+    """
+    if sys.platform == "win32":
+        root = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        root = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    path = os.path.join(root, CACHE_FOLDER_NAME, *parts)
+    create_folder(path)
+    return path
+
+
 def create_folder(path: str) -> None:
     """Create a directory if it doesn't exist.
 
     Args:
         path: Directory path to create
     """
-    if not os.path.exists(path):
-        os.makedirs(path)
+    if path and not os.path.exists(path):
+        os.makedirs(path, exist_ok=True)
@@ -0,0 +1,181 @@
+"""Perceptual hash index of an output dataset for near-duplicate search."""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import fileops as fops
+import imageops as iops
+
+HASH_INDEX_FILENAME = "hashes.jsonl"
+DEFAULT_DUPLICATE_THRESHOLD = 6
+
+
+class BKTree:
+    """BK-tree over integer hashes under the Hamming distance.
+
+    A radius search only descends into children whose edge distance is within
+    the radius of the query's distance to their parent, which for small radii
+    visits a small fraction of the tree.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, hash_value: int, item) -> None:
+        """Add an item under a hash; items sharing a hash share a node."""
+        self._size += 1
+        if self._root is None:
+            self._root = (hash_value, [item], {})
+            return
+
+        node = self._root
+        while True:
+            distance = iops.hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (hash_value, [item], {})
+                return
+            node = child
+
+    def search(self, hash_value: int, radius: int) -> List[Tuple[int, object]]:
+        """Return (distance, item) pairs of all items within a radius of a hash, closest first."""
+        if self._root is None:
+            return []
+
+        results = []
+        stack = [self._root]
+        while stack:
+            node_hash, items, children = stack.pop()
+            distance = iops.hamming_distance(hash_value, node_hash)
+            if distance <= radius:
+                results.extend((distance, item) for item in items)
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+class DatasetHashIndex:
+    """Persistent dhash index of the images of an output folder.
+
+    Hashes are appended to hashes.jsonl in the output folder as crops are made,
+    one {"output": relative path, "hash": hex} record per line, later records
+    replacing earlier ones for the same path. rewrite() replaces the file with
+    a fresh set of hashes, as the dedup report does.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, HASH_INDEX_FILENAME)
+        self._hashes = {}
+        self._tree = BKTree()
+
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._insert(record["output"], int(record["hash"], 16))
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Skip a torn or foreign line
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def find(self, hash_value: int, threshold: int = DEFAULT_DUPLICATE_THRESHOLD) -> List[Tuple[int, str]]:
+        """Return (distance, relative path) of indexed images within a Hamming threshold, closest first."""
+        return [
+            (distance, output)
+            for distance, (output, item_hash) in self._tree.search(hash_value, threshold)
+            if self._hashes.get(output) == item_hash
+        ]
+
+    def add(self, output: str, hash_value: int) -> None:
+        """Index an image by its path relative to the output folder and append it to the file."""
+        fops.create_folder(self.output_path)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"output": output, "hash": format_hash(hash_value)}) + "\n")
+        self._insert(output, hash_value)
+
+    def rewrite(self, hashes: Dict[str, int]) -> None:
+        """Replace the index with the given relative path to hash mapping."""
+        lines = "".join(
+            json.dumps({"output": output, "hash": format_hash(hash_value)}) + "\n"
+            for output, hash_value in sorted(hashes.items())
+        )
+        fops.atomic_write(self.path, lambda f: f.write(lines.encode("utf-8")))
+        self._hashes = {}
+        self._tree = BKTree()
+        for output, hash_value in hashes.items():
+            self._insert(output, hash_value)
+
+    def _insert(self, output: str, hash_value: int) -> None:
+        self._hashes[output] = hash_value
+        self._tree.add(hash_value, (output, hash_value))
+
+
+def format_hash(hash_value: int) -> str:
+    return f"{hash_value:016x}"
+
+
+def hash_image_file(path: str) -> Tuple[str, Optional[int], Optional[str]]:
+    """Compute the dhash of an image file, for use on a process pool.
+
+    Returns:
+        Tuple of (path, hash or None, error message or None)
+    """
+    try:
+        return path, iops.dhash(iops.ImageSource(path)), None
+    except Exception as exc:
+        return path, None, str(exc)
+
+
+def find_duplicate_groups(hashes: Dict[str, int], threshold: int = DEFAULT_DUPLICATE_THRESHOLD) -> List[List[str]]:
+    """Group paths whose hashes are linked by chains of Hamming distances within a threshold.
+
+    Returns:
+        Groups of two or more paths, each sorted, largest groups first
+    """
+    tree = BKTree()
+    for path, hash_value in hashes.items():
+        tree.add(hash_value, path)
+
+    parents = {path: path for path in hashes}
+
+    def find_root(path):
+        while parents[path] != path:
+            parents[path] = parents[parents[path]]
+            path = parents[path]
+        return path
+
+    for path, hash_value in hashes.items():
+        for _, other in tree.search(hash_value, threshold):
+            root, other_root = find_root(path), find_root(other)
+            if root != other_root:
+                parents[other_root] = root
+
+    groups = {}
+    for path in hashes:
+        groups.setdefault(find_root(path), []).append(path)
+    return sorted(
+        (sorted(group) for group in groups.values() if len(group) > 1),
+        key=lambda group: (-len(group), group[0]),
+    )
+
+
+def iter_dataset_images(output_path: str) -> Iterable[str]:
+    """Yield the paths of all images below an output folder."""
+    for batch in fops.scan_image_files(output_path, recursive=True):
+        for _, path in batch:
+            yield path
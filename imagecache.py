@@ -0,0 +1,420 @@
+"""Decoded image cache and background prefetching for browsing image sets."""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Hashable, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+import fileops as fops
+import imageops as iops
+import profiling
+
+DEFAULT_CACHE_BYTES = 768 * 1024 * 1024
+DEFAULT_PREVIEW_CACHE_BYTES = 1024 * 1024 * 1024
+PREVIEW_JPEG_QUALITY = 90
+PREVIEW_PNG_COMPRESS_LEVEL = 1
+# Bumped when previews of the same file change, e.g. since EXIF orientation is applied
+PREVIEW_CACHE_VERSION = 2
+DEFAULT_PREFETCH_WORKERS = 2
+DEFAULT_PREFETCH_RADIUS = 3
+
+
+class DecodedImage:
+    """A decoded image together with its canvas-sized preview.
+
+    interim marks previews scaled with iops.fast_scale_image, which are shown
+    but not cached until ImagePrefetcher.settle() replaces them. canvas_size is the
+    canvas the preview was fitted to.
+    """
+
+    def __init__(
+        self, image, preview, ratio: float, interim: bool = False, canvas_size: Optional[Tuple[int, int]] = None
+    ):
+        self.image = image
+        self.preview = preview
+        self.ratio = ratio
+        self.interim = interim
+        self.canvas_size = canvas_size
+
+    @property
+    def nbytes(self) -> int:
+        return iops.image_nbytes(self.image) + iops.image_nbytes(self.preview)
+
+    def release(self) -> None:
+        """Drop full resolution pixels decoded on demand by a lazy image."""
+        if isinstance(self.image, iops.ImageSource):
+            self.image.release()
+
+
+def cache_key(path: str, canvas_size: Tuple[int, int]) -> Hashable:
+    """Build a cache key from a file path, its modification time and the canvas size.
+
+    Raises:
+        OSError: If the file cannot be stat'ed
+    """
+    return path, os.stat(path).st_mtime_ns, canvas_size[0], canvas_size[1]
+
+
+def decode_image(
+    path: str,
+    canvas_size: Tuple[int, int],
+    lazy: bool = True,
+    disk_cache: Optional["PreviewDiskCache"] = None,
+    fast: bool = False,
+) -> DecodedImage:
+    """Decode an image file and scale a preview fitting the given canvas size.
+
+    With lazy set, the image is an iops.ImageSource: the preview comes from a
+    reduced-resolution decode and the full image is decoded only when cropped.
+    With a disk cache, previews are looked up there before being decoded.
+    With fast set, a preview that has to be decoded is scaled with
+    iops.fast_scale_image and the entry is marked interim.
+    """
+    image = iops.ImageSource(path) if lazy else iops.load_image(path)
+    ratio = iops.fit_ratio(image.size, canvas_size)
+
+    if disk_cache is not None:
+        preview = disk_cache.get(path, iops.scaled_size(image.size, ratio))
+        if preview is not None:
+            return DecodedImage(image, preview, ratio, canvas_size=canvas_size)
+
+    if fast:
+        return DecodedImage(image, iops.fast_scale_image(image, ratio), ratio, interim=True, canvas_size=canvas_size)
+
+    preview = iops.scale_image(image, ratio)
+    if disk_cache is not None:
+        disk_cache.put(path, preview)
+    return DecodedImage(image, preview, ratio, canvas_size=canvas_size)
+
+
+_shared_preview_cache = None
+
+
+def get_shared_preview_cache() -> "PreviewDiskCache":
+    """Return the preview disk cache shared by all tabs, creating it on first use."""
+    global _shared_preview_cache
+    if _shared_preview_cache is None:
+        _shared_preview_cache = PreviewDiskCache()
+    return _shared_preview_cache
+
+
+class PreviewDiskCache:
+    """Persistent cache of canvas-sized previews with a byte budget and LRU eviction.
+
+    Previews are keyed by source path, file size, modification time and preview
+    size, so edited files miss the cache. Previews are turned upright by the
+    file's EXIF orientation. RGB and grayscale previews are stored as JPEG,
+    anything else as quickly compressed PNG. Access times are tracked
+    through file modification times, so recency survives restarts. The cache is
+    best effort: any I/O error is treated as a miss, and a cache folder that
+    cannot be created or read disables the cache (enabled is False).
+    """
+
+    def __init__(self, folder: Optional[str] = None, max_bytes: int = DEFAULT_PREVIEW_CACHE_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.enabled = True
+        # File name -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        try:
+            if self.folder is None:
+                self.folder = fops.get_cache_folder("previews")
+            fops.create_folder(self.folder)
+            found = []
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith((".jpg", ".png")):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name, stat.st_size))
+        except OSError:
+            self.enabled = False
+            return
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.current_bytes += size
+
+    def get(self, path: str, preview_size: Tuple[int, int]) -> Optional[Image.Image]:
+        """Return the cached preview of a file at a given size, or None."""
+        if not self.enabled:
+            return None
+        try:
+            key = self._key(path, preview_size)
+        except OSError:
+            return None
+
+        for extension in (".jpg", ".png"):
+            name = key + extension
+            with self._lock:
+                if name not in self._entries:
+                    continue
+            file_path = os.path.join(self.folder, name)
+            try:
+                with Image.open(file_path) as img:
+                    preview = img.copy()
+                os.utime(file_path)
+            except OSError:
+                return None
+            with self._lock:
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+            return preview
+        return None
+
+    def put(self, path: str, preview: Image.Image) -> None:
+        """Store the preview of a file, evicting least recently used previews."""
+        if not self.enabled:
+            return
+        try:
+            key = self._key(path, preview.size)
+            if preview.mode in ("RGB", "L"):
+                name = key + ".jpg"
+                file_path = os.path.join(self.folder, name)
+                fops.atomic_write(file_path, lambda f: preview.save(f, format="JPEG", quality=PREVIEW_JPEG_QUALITY))
+            else:
+                name = key + ".png"
+                file_path = os.path.join(self.folder, name)
+                image = preview.convert("RGBA")
+                fops.atomic_write(file_path, lambda f: image.save(f, format="PNG", compress_level=PREVIEW_PNG_COMPRESS_LEVEL))
+            stat = os.stat(file_path)
+        except (OSError, ValueError):
+            return
+
+        with self._lock:
+            self.current_bytes -= self._entries.pop(name, 0)
+            self._entries[name] = stat.st_size
+            self.current_bytes += stat.st_size
+            evicted = self._pop_least_recently_used()
+
+        for evicted_name in evicted:
+            try:
+                os.remove(os.path.join(self.folder, evicted_name))
+            except OSError:
+                pass
+
+    def _pop_least_recently_used(self) -> List[str]:
+        evicted = []
+        while self.current_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self.current_bytes -= size
+            evicted.append(name)
+        return evicted
+
+    @staticmethod
+    def _key(path: str, preview_size: Tuple[int, int]) -> str:
+        stat = os.stat(path)
+        key = f"{PREVIEW_CACHE_VERSION}|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{preview_size[0]}x{preview_size[1]}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """Thread-safe LRU cache of decoded images bounded by their memory footprint."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[DecodedImage]:
+        """Return the cached entry for a key and mark it as most recently used."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, entry: DecodedImage) -> None:
+        """Store an entry, evicting least recently used ones to stay within budget."""
+        size = entry.nbytes
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old_item = self._entries.pop(key, None)
+            if old_item is not None:
+                self.current_bytes -= old_item[1]
+
+            self._entries[key] = (entry, size)
+            self.current_bytes += size
+            self._evict()
+
+    def recharge(self, entry: DecodedImage) -> None:
+        """Re-measure a cached entry whose lazy image was fully decoded or released since it was stored.
+
+        Least recently used entries are evicted to stay within budget. Entries
+        that are not cached are ignored.
+        """
+        with self._lock:
+            for key, (cached_entry, size) in self._entries.items():
+                if cached_entry is entry:
+                    break
+            else:
+                return
+
+            new_size = entry.nbytes
+            self._entries[key] = (entry, new_size)
+            self.current_bytes += new_size - size
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+
+class ImagePrefetcher:
+    """Decodes and pre-scales images around the current selection on worker threads.
+
+    Decoded results land in an ImageCache; only load() is meant to be called from
+    the Tk thread, and it never touches Tk itself.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[ImageCache] = None,
+        workers: int = DEFAULT_PREFETCH_WORKERS,
+        radius: int = DEFAULT_PREFETCH_RADIUS,
+        lazy: bool = True,
+        disk_cache: Optional[PreviewDiskCache] = None,
+    ):
+        self.cache = cache if cache is not None else ImageCache()
+        self.radius = radius
+        self.lazy = lazy
+        self.disk_cache = disk_cache
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str, canvas_size: Tuple[int, int], fast: bool = False) -> DecodedImage:
+        """Return a decoded image, from cache, an in-flight prefetch or a direct decode.
+
+        With fast set, a direct decode returns an uncached interim preview
+        (see decode_image) for the caller to upgrade later.
+        """
+        key = cache_key(path, canvas_size)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception:
+                pass  # Retry synchronously so the caller sees the real error
+
+        entry = decode_image(path, canvas_size, self.lazy, self.disk_cache, fast)
+        if not entry.interim:
+            self.cache.put(key, entry)
+        return entry
+
+    def prefetch(self, paths: Iterable[str], canvas_size: Tuple[int, int]) -> None:
+        """Schedule background decoding of paths, dropping stale queued requests."""
+        wanted = []
+        for path in paths:
+            try:
+                wanted.append((cache_key(path, canvas_size), path))
+            except OSError:
+                continue
+
+        with self._lock:
+            wanted_keys = {key for key, _ in wanted}
+            for key in list(self._pending):
+                if key not in wanted_keys and self._pending[key].cancel():
+                    del self._pending[key]
+
+            for key, path in wanted:
+                if key in self._pending or key in self.cache:
+                    continue
+                self._pending[key] = self._executor.submit(
+                    self._decode_into_cache, key, path, canvas_size
+                )
+
+    def settle(self, path: str, entry: DecodedImage, preview) -> None:
+        """Replace the interim preview of an entry with its full quality one and cache the entry.
+
+        The preview goes to the disk cache too, so revisits skip both the
+        interim preview and its upgrade.
+        """
+        if not entry.interim:
+            return
+        entry.preview = preview
+        entry.interim = False
+        try:
+            self.cache.put(cache_key(path, entry.canvas_size), entry)
+        except OSError:
+            return  # The file is gone; nothing to cache it under
+        if self.disk_cache is not None:
+            self.disk_cache.put(path, preview)
+
+    def upgrade(self, image, ratio: float, scope: Optional[str] = None) -> Future:
+        """Scale the full quality preview of an image on a worker thread, ahead of queued prefetches.
+
+        Lazy images reuse the reduced decode their interim preview was scaled
+        from (see iops.fast_scale_image). Prefetches that have not started yet
+        are queued again behind the upgrade. The time taken is recorded as the
+        "scale" stage of scope.
+
+        Returns:
+            Future of the preview
+        """
+        with self._lock:
+            future = self._executor.submit(self._scale, image, ratio, scope)
+            for key, pending in list(self._pending.items()):
+                if pending.cancel():
+                    # cache_key() leads with the path and ends with the canvas size
+                    self._pending[key] = self._executor.submit(self._decode_into_cache, key, key[0], key[2:])
+        return future
+
+    def recharge(self, entry: DecodedImage) -> None:
+        """Update the cache's account of an entry after a crop decoded or release() dropped its full pixels."""
+        self.cache.recharge(entry)
+
+    def neighbour_indices(self, index: int, length: int) -> List[int]:
+        """Return indices around index ordered by distance, forward direction first."""
+        indices = []
+        for distance in range(1, self.radius + 1):
+            for candidate in (index + distance, index - distance):
+                if 0 <= candidate < length:
+                    indices.append(candidate)
+        return indices
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _scale(self, image, ratio: float, scope: Optional[str]):
+        with profiling.stage("scale", scope):
+            return iops.scale_image(image, ratio)
+
+    def _decode_into_cache(self, key: Hashable, path: str, canvas_size: Tuple[int, int]):
+        try:
+            entry = decode_image(path, canvas_size, self.lazy, self.disk_cache)
+            self.cache.put(key, entry)
+            return entry
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
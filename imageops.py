@@ -1,18 +1,66 @@
 """Image processing operations."""
 
-from PIL import Image, ImageTk
+import functools
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image, ImageFile, ImageTk
+
+PREVIEW_REDUCING_GAP = 2.0
+HASH_SIZE = 8
+PHASH_HIGHFREQ_FACTOR = 4
+FULL_DECODE_BYTES = 256 * 1024 * 1024
+REGION_BAND_BYTES = 64 * 1024 * 1024
+# Largest full decode kept for cropping when a format cannot be decoded by region
+KEPT_DECODE_BYTES = 768 * 1024 * 1024
+# Modes Image.reduce() supports, for previews reduced band by band
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "I", "F")
+# Pillow refuses images above 179 MP by default; ImageSource decodes large images by region instead
+MAX_IMAGE_PIXELS = 2_000_000_000
+
+EXIF_ORIENTATION_TAG = 0x0112
+# Counter-clockwise rotations, as rotate_image takes them
+ROTATION_TRANSPOSES = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+# The transpose turning an image upright for each EXIF orientation, as ImageOps.exif_transpose does
+EXIF_ORIENTATION_TRANSPOSES = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+INVERSE_TRANSPOSES = {
+    Image.FLIP_LEFT_RIGHT: Image.FLIP_LEFT_RIGHT,
+    Image.FLIP_TOP_BOTTOM: Image.FLIP_TOP_BOTTOM,
+    Image.ROTATE_90: Image.ROTATE_270,
+    Image.ROTATE_180: Image.ROTATE_180,
+    Image.ROTATE_270: Image.ROTATE_90,
+    Image.TRANSPOSE: Image.TRANSPOSE,
+    Image.TRANSVERSE: Image.TRANSVERSE,
+}
 
 
 def load_image(path):
-    """Load an image from a file."""
-    with Image.open(path) as img:
-        return img.copy()
+    """Load an image from a file, turned upright by its EXIF orientation."""
+    image, method = load_unoriented_image(path)
+    return image if method is None else image.transpose(method)
+
+def load_unoriented_image(path):
+    """Load an image from a file as stored, with the transpose its EXIF orientation calls for, or None."""
+    image, orientation = _load_file(path)
+    return image, EXIF_ORIENTATION_TRANSPOSES.get(orientation)
+
+def scale_box(box, scale_ratio):
+    """Map a bounding box from scaled image coordinates back to image coordinates."""
+    return (
+    int(box[0] / scale_ratio), int(box[1] / scale_ratio), int(box[2] / scale_ratio), int(box[3] / scale_ratio))
 
 def crop_image(image: Image, scale_ratio, box):
     """Crop an image using a bounding box."""
-    scaled_box = (
-    int(box[0] / scale_ratio), int(box[1] / scale_ratio), int(box[2] / scale_ratio), int(box[3] / scale_ratio))
-    return image.crop(scaled_box)
+    return image.crop(scale_box(box, scale_ratio))
 
 def resize_image(image: Image, width=None, height=None):
     """Resize an image to specified dimensions."""
@@ -25,9 +73,451 @@ def resize_image(image: Image, width=None, height=None):
     return image.resize((width, height), Image.LANCZOS)
 
 def rotate_image(image, angle):
-    """Rotate an image by specified angle."""
+    """Rotate an image by specified angle, losslessly by transposing for multiples of 90 degrees."""
+    angle %= 360
+    if angle == 0:
+        return image
+    method = ROTATION_TRANSPOSES.get(angle)
+    if method is not None:
+        return image.transpose(method)
     return image.rotate(angle, Image.BICUBIC, expand=True)
 
 def scale_image(image: Image, ratio=None):
     """Scale an image by a ratio."""
-    return image.resize((int(image.width * ratio), int(image.height * ratio)), Image.LANCZOS)
+    return image.resize(scaled_size(image.size, ratio), Image.LANCZOS)
+
+def fast_scale_image(image: Image, ratio=None):
+    """Scale an image by a ratio quickly, for a first preview to be upgraded later.
+
+    Large reductions go through Image.reduce() before a bilinear resample. A
+    lazy image keeps the reduced decode the preview is scaled from, so the
+    upgrade with scale_image does not decode the file again.
+    """
+    size = scaled_size(image.size, ratio)
+    if isinstance(image, ImageSource):
+        image.keep_reduced(size)
+    return image.resize(size, Image.BILINEAR, reducing_gap=PREVIEW_REDUCING_GAP)
+
+def resize_preview(image: Image, size):
+    """Cheaply resize an already scaled preview, for interim display only."""
+    return image.resize(size, Image.BILINEAR)
+
+def scaled_size(size, ratio):
+    """Return the size of an image of given size scaled by a ratio."""
+    return max(1, int(size[0] * ratio)), max(1, int(size[1] * ratio))
+
+def fit_ratio(size, canvas_size):
+    """Return the scale ratio that fits an image of given size inside a canvas."""
+    return min(canvas_size[0] / size[0], canvas_size[1] / size[1])
+
+def image_nbytes(image: Image):
+    """Estimate the memory held by a decoded image."""
+    if image is None:
+        return 0
+    if isinstance(image, ImageSource):
+        return image.kept_nbytes
+    return image.width * image.height * len(image.getbands())
+
+def dhash(image, hash_size=HASH_SIZE):
+    """Compute the difference hash of an image as an int of hash_size ** 2 bits."""
+    small = image.resize((hash_size + 1, hash_size), Image.BILINEAR).convert("L")
+    return dhash_array(np.asarray(small, dtype=np.int16))
+
+def phash(image, hash_size=HASH_SIZE):
+    """Compute the DCT based perceptual hash of an image as an int of hash_size ** 2 bits."""
+    size = hash_size * PHASH_HIGHFREQ_FACTOR
+    small = image.resize((size, size), Image.BILINEAR).convert("L")
+    return phash_array(np.asarray(small, dtype=np.float64), hash_size)
+
+def dhash_array(gray):
+    """Compute the difference hash of a grayscale array of hash_size rows and hash_size + 1 columns."""
+    return pack_bits(gray[:, 1:] > gray[:, :-1])
+
+def phash_array(gray, hash_size=HASH_SIZE):
+    """Compute the perceptual hash of a square grayscale array from its lowest DCT frequencies."""
+    dct = _dct_matrix(gray.shape[0])
+    low_frequencies = (dct @ gray @ dct.T)[:hash_size, :hash_size]
+    return pack_bits(low_frequencies > np.median(low_frequencies))
+
+def pack_bits(bits):
+    """Pack a boolean array into an int, first element most significant."""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def hamming_distance(a, b):
+    """Count the differing bits of two hashes."""
+    return bin(a ^ b).count("1")
+
+@functools.lru_cache(maxsize=4)
+def _dct_matrix(size):
+    rows = np.arange(size)[:, None]
+    columns = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * columns + 1) * rows / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_pixel_limit_lock = threading.Lock()
+_pixel_limit_users = 0
+_default_max_image_pixels = None
+
+
+@contextmanager
+def _large_image_limit():
+    """Raise Pillow's pixel limit to MAX_IMAGE_PIXELS for the paths that decode large images by region.
+
+    Every other decode, e.g. load_image in batch runs, keeps Pillow's limit,
+    except in other threads while such a path runs.
+    """
+    global _pixel_limit_users, _default_max_image_pixels
+    with _pixel_limit_lock:
+        if _pixel_limit_users == 0:
+            _default_max_image_pixels = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+        _pixel_limit_users += 1
+    try:
+        yield
+    finally:
+        with _pixel_limit_lock:
+            _pixel_limit_users -= 1
+            if _pixel_limit_users == 0:
+                Image.MAX_IMAGE_PIXELS = _default_max_image_pixels
+
+
+def _load_file(path):
+    """Decode an image file in file pixels, returning it with its EXIF orientation."""
+    with Image.open(path) as img:
+        orientation = _exif_orientation(img)
+        return img.copy(), orientation
+
+
+def _exif_orientation(img):
+    """Return the EXIF orientation of an opened, unloaded image, which then decodes in file pixels.
+
+    Pillow turns TIFF files upright as they load and reports their upright size;
+    dropping the tag leaves orientation to ImageSource and load_image alone, and
+    keeps region decodes in file pixels.
+    """
+    # PNGs may keep EXIF after the pixel data; never decode just to find it
+    if img.format == "PNG" and "exif" not in img.info:
+        return 1
+    exif = img.getexif()
+    orientation = exif.get(EXIF_ORIENTATION_TAG, 1)
+    if img.format == "TIFF" and orientation != 1:
+        del exif[EXIF_ORIENTATION_TAG]
+        img.tag_v2.pop(EXIF_ORIENTATION_TAG, None)
+        img._size = img._tile_size
+    return orientation
+
+
+def transposed_size(size, method):
+    """Return the size of an image of given size after a transpose."""
+    if method in (Image.ROTATE_90, Image.ROTATE_270, Image.TRANSPOSE, Image.TRANSVERSE):
+        return size[1], size[0]
+    return size
+
+
+def transpose_box(box, size, method):
+    """Map a box in an image of given size to the same pixels after a transpose."""
+    width, height = size
+    left, upper, right, lower = box
+    if method == Image.FLIP_LEFT_RIGHT:
+        return width - right, upper, width - left, lower
+    if method == Image.FLIP_TOP_BOTTOM:
+        return left, height - lower, right, height - upper
+    if method == Image.ROTATE_90:
+        return upper, width - right, lower, width - left
+    if method == Image.ROTATE_180:
+        return width - right, height - lower, width - left, height - upper
+    if method == Image.ROTATE_270:
+        return height - lower, left, height - upper, right
+    if method == Image.TRANSPOSE:
+        return upper, left, lower, right
+    if method == Image.TRANSVERSE:
+        return height - lower, width - right, height - upper, width - left
+    raise ValueError(f"Unknown transpose {method}")
+
+
+def to_source_point(image, point):
+    """Map a pixel of a possibly transposed ImageSource view to its source file pixel."""
+    if not isinstance(image, ImageSource):
+        return point
+    return image.source_box((point[0], point[1], point[0] + 1, point[1] + 1))[:2]
+
+
+def to_view_point(image, point):
+    """Map a source file pixel to where a possibly transposed ImageSource view shows it."""
+    if not isinstance(image, ImageSource):
+        return point
+    return image.view_box((point[0], point[1], point[0] + 1, point[1] + 1))[:2]
+
+
+def _tile(codec, extents, offset, args):
+    # Pillow 11 made decoder tiles named tuples, which later versions require
+    tile_type = getattr(ImageFile, "_Tile", None)
+    return (codec, extents, offset, args) if tile_type is None else tile_type(codec, extents, offset, args)
+
+
+def _region_tiles(img, box):
+    """Restrict the decoder tiles of an opened, unloaded image to rows and columns covering a box.
+
+    Images stored as several tiles or strips (e.g. uncompressed TIFF) keep only
+    the tiles intersecting the box, single uncompressed images get a tile for
+    the box's rows, and non-interlaced PNGs are decoded only down to the box's
+    lower edge. The image is resized to the area of the kept tiles.
+
+    Returns:
+        Offset (left, upper) of the restricted image in the full image, or None
+        if the format can only be decoded whole
+    """
+    left, upper, right, lower = box
+    tiles = img.tile
+    if len(tiles) > 1:
+        # Tiles are (codec, (x0, y0, x1, y1), offset, args)
+        kept = [
+            tile for tile in tiles
+            if tile[1][0] < right and tile[1][2] > left and tile[1][1] < lower and tile[1][3] > upper
+        ]
+        if not kept:
+            return None
+        x0 = min(tile[1][0] for tile in kept)
+        y0 = min(tile[1][1] for tile in kept)
+        x1 = max(tile[1][2] for tile in kept)
+        y1 = max(tile[1][3] for tile in kept)
+        img.tile = [
+            _tile(codec, (tx0 - x0, ty0 - y0, tx1 - x0, ty1 - y0), offset, args)
+            for codec, (tx0, ty0, tx1, ty1), offset, args in kept
+        ]
+        img._size = (x1 - x0, y1 - y0)
+        return x0, y0
+
+    if len(tiles) != 1 or tuple(tiles[0][1]) != (0, 0) + img.size:
+        return None
+    codec, _, offset, args = tiles[0]
+    width, height = img.size
+    if codec == "raw" and isinstance(args, tuple) and len(args) == 3 and args[2] in (1, -1):
+        rawmode, stride, orientation = args
+        if not stride:
+            stride = len(Image.new(img.mode, (width, 1)).tobytes("raw", rawmode))
+        # Bottom-up images (BMP) store the last row first
+        first_row = upper if orientation == 1 else height - lower
+        img.tile = [_tile(codec, (0, 0, width, lower - upper), offset + first_row * stride, args)]
+        img._size = (width, lower - upper)
+        return 0, upper
+    if codec == "zip" and img.format == "PNG" and not img.info.get("interlace"):
+        img.tile = [_tile(codec, (0, 0, width, lower), offset, args)]
+        img._size = (width, lower)
+        return 0, 0
+    return None
+
+
+def decode_region(path, box):
+    """Decode only the part of an image file needed to crop a box, where the format allows it.
+
+    Formats decoded as a whole (JPEG, WebP, compressed TIFF) fall back to a
+    full decode that is not kept.
+    """
+    with _large_image_limit(), Image.open(path) as img:
+        _exif_orientation(img)
+        offset = _region_tiles(img, box)
+        if offset is None:
+            return img.crop(box)
+        img.load()
+        return img.crop((box[0] - offset[0], box[1] - offset[1], box[2] - offset[0], box[3] - offset[1]))
+
+
+def region_decodable(path):
+    """Return whether decode_region can decode full-width bands of an image without decoding it whole."""
+    with _large_image_limit(), Image.open(path) as img:
+        return _tiles_region_decodable(img)
+
+
+def _tiles_region_decodable(img):
+    return len(img.tile) > 1 or (len(img.tile) == 1 and img.tile[0][0] == "raw")
+
+
+class ImageSource:
+    """An image file whose full resolution pixels are decoded only when needed.
+
+    Opening a source reads the file header only. Resizing, which is how previews
+    are produced, uses the reduced-resolution draft decode where the format
+    supports it (JPEG), and reduces tiled, striped or uncompressed images band
+    by band, so a canvas-sized preview never holds the full image. The reduced
+    decode is dropped once scaled, unless kept with keep_reduced(); one kept at
+    full size, as formats without a draft decode have, also serves crops.
+    Images up to FULL_DECODE_BYTES are decoded on first crop and kept until
+    release(); larger tiled, striped or uncompressed ones decode only the
+    region each crop covers (see decode_region). Other formats (JPEG, WebP,
+    PNG, compressed TIFF) cannot skip pixels, so their full decode is kept too,
+    up to KEPT_DECODE_BYTES; beyond that every crop decodes as little as
+    decode_region can and keeps nothing.
+
+    The EXIF orientation and 90 degree rotations (transpose()) are kept as a
+    list of transposes. Decoded pixels, the kept full decode included, stay as
+    stored in the file: crop boxes are mapped back to file pixels and only the
+    cropped or resized result is transposed, so rotating a source costs nothing
+    and its transposed views share one full decode. size and crop boxes are in
+    the transposed view. Sources are interchangeable with PIL images in
+    crop_image, scale_image and rotate_image.
+    """
+
+    def __init__(self, path, transposes=None):
+        self.path = path
+        self._root = self
+        self._loaded_image = None
+        self._reduced_image = None
+        with _large_image_limit(), Image.open(path) as img:
+            orientation = EXIF_ORIENTATION_TRANSPOSES.get(_exif_orientation(img))
+            self.source_size = img.size
+            self.mode = img.mode
+            self.region_decodable = _tiles_region_decodable(img)
+        if transposes is None:
+            transposes = () if orientation is None else (orientation,)
+        self.transposes = tuple(transposes)
+        self.size = self.source_size
+        for method in self.transposes:
+            self.size = transposed_size(self.size, method)
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def loaded_image(self):
+        """The kept full decode, shared with all transposed views, or None."""
+        return self._root._loaded_image
+
+    def load(self):
+        """Decode the full resolution image as stored in the file, once."""
+        root = self._root
+        if root._loaded_image is None:
+            if root._reduced_image is not None and root._reduced_image.size == self.source_size:
+                root._loaded_image = root._reduced_image
+            else:
+                with _large_image_limit():
+                    root._loaded_image = _load_file(self.path)[0]
+        return root._loaded_image
+
+    def keep_reduced(self, size):
+        """Decode the image reduced to cover a view size, as resize() does, and keep it for later resizes.
+
+        Nothing is kept beyond KEPT_DECODE_BYTES.
+        """
+        source_size = self._to_source_size(size)
+        if self._decoded_covering(source_size) is None:
+            reduced = self._decode_reduced(source_size)
+            if image_nbytes(reduced) <= KEPT_DECODE_BYTES:
+                self._root._reduced_image = reduced
+
+    def release(self):
+        """Drop the kept pixels of this and all transposed views, keeping them usable."""
+        self._root._loaded_image = None
+        self._root._reduced_image = None
+
+    @property
+    def kept_nbytes(self):
+        """Memory held by the kept full and reduced decodes."""
+        loaded, reduced = self._root._loaded_image, self._root._reduced_image
+        return image_nbytes(loaded) + (0 if reduced is loaded else image_nbytes(reduced))
+
+    @property
+    def nbytes(self):
+        """Memory a full decode of the image would take."""
+        return self.width * self.height * Image.getmodebands(self.mode)
+
+    def resize(self, size, resample=Image.LANCZOS, reducing_gap=None):
+        source_size = self._to_source_size(size)
+        image = self._decoded_covering(source_size)
+        if image is None:
+            image = self._decode_reduced(source_size)
+        return self._to_view(image.resize(source_size, resample, reducing_gap=reducing_gap))
+
+    def crop(self, box):
+        if self._decoded_covering(self.source_size) is None and self.nbytes > FULL_DECODE_BYTES:
+            if self.region_decodable or self.nbytes > KEPT_DECODE_BYTES:
+                return self._to_view(decode_region(self.path, self.source_box(box)))
+        return self._to_view(self.load().crop(self.source_box(box)))
+
+    def transpose(self, method):
+        """Return a source viewing this one through a further transpose, sharing its pixels."""
+        source = ImageSource.__new__(ImageSource)
+        source.path = self.path
+        source._root = self._root
+        source.mode = self.mode
+        source.source_size = self.source_size
+        source.region_decodable = self.region_decodable
+        source.transposes = self.transposes + (method,)
+        source.size = transposed_size(self.size, method)
+        return source
+
+    def rotate(self, angle, resample=Image.NEAREST, expand=False):
+        return self._to_view(self.load()).rotate(angle, resample, expand=expand)
+
+    def source_box(self, box):
+        """Map a box in the view to the box of source pixels it shows."""
+        size = self.size
+        for method in reversed(self.transposes):
+            inverse = INVERSE_TRANSPOSES[method]
+            box = transpose_box(box, size, inverse)
+            size = transposed_size(size, inverse)
+        return box
+
+    def view_box(self, box):
+        """Map a box of source pixels to the box showing them in the view."""
+        size = self.source_size
+        for method in self.transposes:
+            box = transpose_box(box, size, method)
+            size = transposed_size(size, method)
+        return box
+
+    def _to_source_size(self, size):
+        for method in reversed(self.transposes):
+            size = transposed_size(size, INVERSE_TRANSPOSES[method])
+        return size
+
+    def _decoded_covering(self, source_size):
+        """Return kept pixels at least source_size large, or None."""
+        root = self._root
+        if root._loaded_image is not None:
+            return root._loaded_image
+        reduced = root._reduced_image
+        if reduced is not None and reduced.width >= source_size[0] and reduced.height >= source_size[1]:
+            return reduced
+        return None
+
+    def _decode_reduced(self, source_size):
+        """Decode the image as stored at the smallest size covering source_size the file allows cheaply."""
+        if self.nbytes > REGION_BAND_BYTES and self.mode in REDUCIBLE_MODES and self.region_decodable:
+            return self._reduce_in_bands(source_size)
+        with _large_image_limit():
+            img = Image.open(self.path)
+            try:
+                _exif_orientation(img)
+                img.draft(img.mode, source_size)
+                img.load()
+            except BaseException:
+                img.close()
+                raise
+        return img
+
+    def _to_view(self, image):
+        for method in self.transposes:
+            image = image.transpose(method)
+        return image
+
+    def _reduce_in_bands(self, size):
+        """Box-reduce the source to at least twice the given size, one band of rows at a time."""
+        width, height = self.source_size
+        factor = max(1, min(width // (2 * size[0]), height // (2 * size[1])))
+        row_bytes = self.nbytes // height
+        band_height = max(factor, REGION_BAND_BYTES // row_bytes // factor * factor)
+
+        reduced = Image.new(self.mode, (-(-width // factor), -(-height // factor)))
+        for upper in range(0, height, band_height):
+            # Only the reduced band outlives the decode, so at most one full band is held
+            band = decode_region(self.path, (0, upper, width, min(upper + band_height, height))).reduce(factor)
+            reduced.paste(band, (0, upper // factor))
+        return reduced
@@ -0,0 +1,167 @@
+"""Per-stage timing of the preview and crop paths, and on-demand profiling of the Tk event loop."""
+
+import cProfile
+import io
+import json
+import math
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_STAGE_WINDOW = 200
+DEFAULT_PROFILE_SECONDS = 10
+PROFILE_REPORT_LINES = 40
+
+# Stages in pipeline order, for display; stages recorded under other names follow these
+STAGE_ORDER = ("load", "decode", "scale", "photoimage", "crop", "resize", "encode", "write")
+# Separates a scope, e.g. the tab recording a stage, from the stage name
+SCOPE_SEPARATOR = "."
+
+_shared_stage_timings = None
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Return a percentile of sorted values by the nearest-rank method."""
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class StageTimings:
+    """Rolling windows of the most recent durations of named stages.
+
+    Durations are recorded from any thread, so the crop writer's encode and
+    write stages land next to the Tk thread's decode and scale stages. Stages
+    named "scope.stage" belong to one scope, e.g. a tab, so that a video
+    playing in one tab does not crowd out the samples of another; unscoped
+    stages are shared by all scopes.
+    """
+
+    def __init__(self, window: int = DEFAULT_STAGE_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+                self._counts[stage] = 0
+            samples.append(seconds)
+            self._counts[stage] += 1
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Record the duration of the block under a stage name, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def percentiles(self, scope: Optional[str] = None) -> List[Tuple[str, float, float]]:
+        """Return (stage, p50 ms, p95 ms) over each stage's window, in pipeline order.
+
+        With a scope, only the stages of that scope, named without it, and the
+        unscoped stages are returned.
+        """
+        with self._lock:
+            windows = {stage: sorted(samples) for stage, samples in self._samples.items()}
+        if scope is not None:
+            prefix = scope + SCOPE_SEPARATOR
+            windows = {
+                stage[len(prefix):] if stage.startswith(prefix) else stage: values
+                for stage, values in windows.items()
+                if stage.startswith(prefix) or SCOPE_SEPARATOR not in stage
+            }
+        return [
+            (stage, percentile(values, 0.5) * 1000, percentile(values, 0.95) * 1000)
+            for stage, values in sorted(windows.items(), key=lambda item: _stage_sort_key(item[0]))
+        ]
+
+    def summary(self, scope: Optional[str] = None) -> str:
+        """Format the stage percentiles (see percentiles) as one line of 'stage p50/p95 ms' entries."""
+        return "  ".join(f"{stage} {p50:.0f}/{p95:.0f}" for stage, p50, p95 in self.percentiles(scope))
+
+    def export(self, path: str) -> None:
+        """Write the counts, percentiles and windowed samples of every stage to a JSON file."""
+        with self._lock:
+            stages = {
+                stage: {"count": self._counts[stage], "samples_ms": [seconds * 1000 for seconds in samples]}
+                for stage, samples in self._samples.items()
+            }
+        for stage, p50, p95 in self.percentiles():
+            if stage in stages:
+                stages[stage]["p50_ms"] = p50
+                stages[stage]["p95_ms"] = p95
+        with open(path, "w") as f:
+            json.dump({"window": self.window, "exported": time.time(), "stages": stages}, f, indent=2)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+def get_stage_timings() -> StageTimings:
+    """Return the stage timings shared by all tabs and the crop writer, creating them on first use."""
+    global _shared_stage_timings
+    if _shared_stage_timings is None:
+        _shared_stage_timings = StageTimings()
+    return _shared_stage_timings
+
+
+def stage(name: str, scope: Optional[str] = None):
+    """Time a block into the shared stage timings, under a scope when given."""
+    return get_stage_timings().stage(name if scope is None else scope + SCOPE_SEPARATOR + name)
+
+
+class EventLoopProfiler:
+    """cProfile capture of the thread that starts it, meant to be the Tk event loop.
+
+    start() and stop() must be called from that thread, e.g. from a key
+    binding and an after() callback.
+    """
+
+    def __init__(self):
+        self._profile: Optional[cProfile.Profile] = None
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self) -> None:
+        if self._profile is not None:
+            return
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, path: str) -> Optional[str]:
+        """Stop capturing and write the stats to path, plus a text report to path.txt.
+
+        Returns:
+            Path of the text report, or None if not running
+        """
+        if self._profile is None:
+            return None
+        profile, self._profile = self._profile, None
+        profile.disable()
+        profile.dump_stats(path)
+
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        report_path = path + ".txt"
+        with open(report_path, "w") as f:
+            f.write(report.getvalue())
+        return report_path
+
+
+def _stage_sort_key(stage: str):
+    name = stage.rpartition(SCOPE_SEPARATOR)[2]
+    if name in STAGE_ORDER:
+        return 0, STAGE_ORDER.index(name), stage
+    return 1, 0, stage
@@ -0,0 +1,192 @@
+"""Streaming export of Tag Editor annotations to COCO, YOLO and JSON Lines."""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from typing import IO, Dict, Iterable, Iterator, Optional, Tuple
+
+from PIL import Image
+
+import fileops as fops
+
+EXPORT_FORMATS = ("coco", "yolo", "jsonl")
+DEFAULT_BOX_SIZE = 16
+EXPORT_CHUNK_SIZE = 64
+YOLO_LABELS_FOLDER = "labels"
+YOLO_CLASSES_FILENAME = "classes.txt"
+COPY_BUFFER_BYTES = 1024 * 1024
+
+# (relative image name, width, height, tag data or None, error message or None)
+AnnotatedImage = Tuple[str, int, int, Optional[dict], Optional[str]]
+
+
+def read_annotated_image(item: Tuple[str, str]) -> AnnotatedImage:
+    """Read the tag data of an image and its dimensions from the file header only.
+
+    For use on a process pool; errors are returned rather than raised.
+    """
+    name, path = item
+    try:
+        tag_data = fops.load_tag_data(fops.tag_base_path(path))
+        if tag_data is None:
+            return name, 0, 0, None, None
+        with Image.open(path) as img:
+            width, height = img.size
+        return name, width, height, tag_data, None
+    except Exception as exc:
+        return name, 0, 0, None, str(exc)
+
+
+def iter_annotated_images(
+    folder: str, recursive: bool = False, workers: Optional[int] = None
+) -> Iterator[AnnotatedImage]:
+    """Yield the annotations of the images below a folder in listing order.
+
+    The folder is walked lazily and .tagdata files and image headers are read
+    on a process pool, so only a bounded window of results is held at a time.
+    """
+    files = (item for batch in fops.scan_image_files(folder, recursive) for item in batch)
+    with multiprocessing.Pool(processes=workers) as pool:
+        yield from pool.imap(read_annotated_image, files, chunksize=EXPORT_CHUNK_SIZE)
+
+
+def point_box(x: float, y: float, width: int, height: int, box_size: int) -> Tuple[float, float, float, float]:
+    """Return the (left, upper, box width, box height) of a box around a point, clipped to the image."""
+    left = min(max(x - box_size / 2, 0), width)
+    upper = min(max(y - box_size / 2, 0), height)
+    right = min(max(x + box_size / 2, 0), width)
+    lower = min(max(y + box_size / 2, 0), height)
+    return left, upper, right - left, lower - upper
+
+
+class ExportStats:
+    """Counts of exported images and tags, and (name, message) pairs of unreadable images."""
+
+    def __init__(self):
+        self.images = 0
+        self.tags = 0
+        self.errors = []
+
+
+def export_jsonl(annotated: Iterable[AnnotatedImage], output_path: str) -> ExportStats:
+    """Write one {"image", "width", "height", "class_name", "tags"} record per tagged image."""
+    stats = ExportStats()
+
+    def write(f: IO[bytes]) -> None:
+        for name, width, height, tag_data, error in annotated:
+            if _skip(name, tag_data, error, stats):
+                continue
+            record = {
+                "image": name,
+                "width": width,
+                "height": height,
+                "class_name": tag_data["class_name"],
+                "tags": tag_data["tags"],
+            }
+            f.write((json.dumps(record) + "\n").encode("utf-8"))
+            stats.images += 1
+            stats.tags += len(tag_data["tags"])
+
+    fops.atomic_write(output_path, write)
+    return stats
+
+
+def export_coco(annotated: Iterable[AnnotatedImage], output_path: str, box_size: int = DEFAULT_BOX_SIZE) -> ExportStats:
+    """Write a COCO-style JSON file with one category per tag name.
+
+    Each point tag becomes an annotation with a single keypoint and a box of
+    box_size pixels around it; the class name of an image is kept as an extra
+    "class_name" key of its image record. Image records are streamed straight
+    to the output and annotations through a temporary file, so memory use does
+    not grow with the dataset.
+    """
+    stats = ExportStats()
+    categories = {}
+
+    def write(f: IO[bytes]) -> None:
+        with tempfile.TemporaryFile() as annotations:
+            f.write(b'{"images": [')
+            annotation_id = 0
+            for name, width, height, tag_data, error in annotated:
+                if _skip(name, tag_data, error, stats):
+                    continue
+                stats.images += 1
+                image = {
+                    "id": stats.images,
+                    "file_name": name,
+                    "width": width,
+                    "height": height,
+                    "class_name": tag_data["class_name"],
+                }
+                f.write((b", " if stats.images > 1 else b"") + json.dumps(image).encode("utf-8"))
+
+                for tag in tag_data["tags"]:
+                    category_id = categories.setdefault(tag["tag"], len(categories) + 1)
+                    left, upper, box_width, box_height = point_box(tag["x"], tag["y"], width, height, box_size)
+                    annotation_id += 1
+                    annotation = {
+                        "id": annotation_id,
+                        "image_id": stats.images,
+                        "category_id": category_id,
+                        "bbox": [left, upper, box_width, box_height],
+                        "area": box_width * box_height,
+                        "iscrowd": 0,
+                        "keypoints": [tag["x"], tag["y"], 2],
+                        "num_keypoints": 1,
+                    }
+                    annotations.write((b", " if annotation_id > 1 else b"") + json.dumps(annotation).encode("utf-8"))
+                    stats.tags += 1
+
+            f.write(b'], "annotations": [')
+            annotations.seek(0)
+            shutil.copyfileobj(annotations, f, COPY_BUFFER_BYTES)
+            f.write(b'], "categories": ')
+            f.write(json.dumps([{"id": category_id, "name": tag} for tag, category_id in categories.items()]).encode("utf-8"))
+            f.write(b"}\n")
+
+    fops.atomic_write(output_path, write)
+    return stats
+
+
+def export_yolo(annotated: Iterable[AnnotatedImage], output_path: str, box_size: int = DEFAULT_BOX_SIZE) -> ExportStats:
+    """Write YOLO label files under output_path/labels plus output_path/classes.txt.
+
+    Each tagged image gets labels/<image name>.txt with one normalized
+    "class cx cy w h" line per point tag, class ids numbering tag names in
+    order of first appearance.
+    """
+    stats = ExportStats()
+    classes: Dict[str, int] = {}
+
+    for name, width, height, tag_data, error in annotated:
+        if _skip(name, tag_data, error, stats):
+            continue
+        lines = []
+        for tag in tag_data["tags"]:
+            class_id = classes.setdefault(tag["tag"], len(classes))
+            left, upper, box_width, box_height = point_box(tag["x"], tag["y"], width, height, box_size)
+            lines.append(
+                f"{class_id} {(left + box_width / 2) / width:.6f} {(upper + box_height / 2) / height:.6f}"
+                f" {box_width / width:.6f} {box_height / height:.6f}\n"
+            )
+
+        label_path = os.path.join(output_path, YOLO_LABELS_FOLDER, os.path.splitext(name)[0] + ".txt")
+        fops.create_folder(os.path.dirname(label_path))
+        with open(label_path, "w") as f:
+            f.writelines(lines)
+        stats.images += 1
+        stats.tags += len(lines)
+
+    fops.create_folder(output_path)
+    with open(os.path.join(output_path, YOLO_CLASSES_FILENAME), "w") as f:
+        f.writelines(f"{tag}\n" for tag in classes)
+    return stats
+
+
+def _skip(name: str, tag_data: Optional[dict], error: Optional[str], stats: ExportStats) -> bool:
+    if error is not None:
+        stats.errors.append((name, error))
+        return True
+    return tag_data is None
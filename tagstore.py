@@ -0,0 +1,211 @@
+"""SQLite tag database of an image folder, an alternative to per-image .tagdata files."""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import fileops as fops
+
+TAG_DATABASE_FILENAME = "tags.sqlite"
+DEFAULT_BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS classes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    class_id INTEGER REFERENCES classes (id)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_class_id ON images (class_id);
+CREATE INDEX IF NOT EXISTS tags_image_id ON tags (image_id, position);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+"""
+
+
+class TagStore:
+    """Classes and point tags of the images below a folder in one SQLite database.
+
+    Images are keyed by their path relative to the folder, as listed by
+    fileops.ImageFileList, and tag data is read and written in the same
+    {"class_name": ..., "tags": [{"x": ..., "y": ..., "tag": ...}]} format as
+    fileops.load_tag_data and fileops.save_tag_data. Each write commits on its
+    own unless made inside batch(), which groups writes into one transaction.
+    The connection belongs to the thread that opened the store.
+    """
+
+    def __init__(self, folder: str, path: Optional[str] = None):
+        self.folder = folder
+        self.path = path if path is not None else os.path.join(folder, TAG_DATABASE_FILENAME)
+        self._batch_depth = 0
+
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    @contextmanager
+    def batch(self) -> Iterator["TagStore"]:
+        """Group the writes made inside the block into a single transaction.
+
+        The transaction is rolled back if the block raises.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._connection.rollback()
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._connection.commit()
+
+    def add_images(self, names: Iterable[str]) -> None:
+        """Register images by relative path so that queries cover untagged ones too."""
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO images (path) VALUES (?)", ((name,) for name in names)
+        )
+        self._commit()
+
+    def load(self, name: str) -> Optional[dict]:
+        """Return the tag data of an image, or None if it has none stored."""
+        row = self._connection.execute(
+            "SELECT images.id, classes.name FROM images LEFT JOIN classes ON classes.id = images.class_id"
+            " WHERE images.path = ?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        image_id, class_name = row
+        tags = [
+            {"x": x, "y": y, "tag": tag}
+            for x, y, tag in self._connection.execute(
+                "SELECT x, y, tag FROM tags WHERE image_id = ? ORDER BY position", (image_id,)
+            )
+        ]
+        if class_name is None and not tags:
+            return None
+        return {"class_name": class_name or "", "tags": tags}
+
+    def save(self, name: str, tag_data: dict) -> None:
+        """Replace the class and tags of an image.
+
+        Args:
+            name: Image path relative to the folder
+            tag_data: Dictionary containing 'class_name' and 'tags' keys
+        """
+        class_id = self._class_id(tag_data["class_name"])
+        image_id = self._image_id(name)
+        self._connection.execute("UPDATE images SET class_id = ? WHERE id = ?", (class_id, image_id))
+        self._connection.execute("DELETE FROM tags WHERE image_id = ?", (image_id,))
+        self._connection.executemany(
+            "INSERT INTO tags (image_id, position, x, y, tag) VALUES (?, ?, ?, ?, ?)",
+            (
+                (image_id, position, tag["x"], tag["y"], tag["tag"])
+                for position, tag in enumerate(tag_data["tags"])
+            ),
+        )
+        self._commit()
+
+    def images_without_tags(self) -> List[str]:
+        """Return the relative paths of registered images that have no tags, sorted."""
+        return [
+            path
+            for path, in self._connection.execute(
+                "SELECT path FROM images WHERE NOT EXISTS"
+                " (SELECT 1 FROM tags WHERE tags.image_id = images.id) ORDER BY path"
+            )
+        ]
+
+    def images_by_class(self, class_name: str) -> List[str]:
+        """Return the relative paths of the images of a class, sorted."""
+        return [
+            path
+            for path, in self._connection.execute(
+                "SELECT images.path FROM images JOIN classes ON classes.id = images.class_id"
+                " WHERE classes.name = ? ORDER BY images.path",
+                (class_name,),
+            )
+        ]
+
+    def tag_counts(self) -> List[Tuple[str, int]]:
+        """Return (tag, count) pairs over all images, most frequent first."""
+        return self._connection.execute(
+            "SELECT tag, COUNT(*) AS count FROM tags GROUP BY tag ORDER BY count DESC, tag"
+        ).fetchall()
+
+    def import_files(self, names: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """Import the .tagdata files of images, committing every batch_size images.
+
+        Returns:
+            Number of images that had tag data
+        """
+        imported = 0
+        pending = 0
+        self._batch_depth += 1
+        try:
+            for name in names:
+                tag_data = fops.load_tag_data(self._base_filename(name))
+                if tag_data is None:
+                    continue
+                self.save(name, tag_data)
+                imported += 1
+                pending += 1
+                if pending >= batch_size:
+                    self._connection.commit()
+                    pending = 0
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._connection.commit()
+        return imported
+
+    def export_files(self) -> int:
+        """Write .tagdata and .txt files for every image with tag data.
+
+        Returns:
+            Number of images written
+        """
+        exported = 0
+        for name, in self._connection.execute("SELECT path FROM images ORDER BY path").fetchall():
+            tag_data = self.load(name)
+            if tag_data is None:
+                continue
+            fops.save_tag_data(self._base_filename(name), tag_data)
+            exported += 1
+        return exported
+
+    def _base_filename(self, name: str) -> str:
+        return fops.tag_base_path(os.path.join(self.folder, name))
+
+    def _class_id(self, class_name: str) -> Optional[int]:
+        if not class_name:
+            return None
+        self._connection.execute("INSERT OR IGNORE INTO classes (name) VALUES (?)", (class_name,))
+        return self._connection.execute("SELECT id FROM classes WHERE name = ?", (class_name,)).fetchone()[0]
+
+    def _image_id(self, name: str) -> int:
+        self._connection.execute("INSERT OR IGNORE INTO images (path) VALUES (?)", (name,))
+        return self._connection.execute("SELECT id FROM images WHERE path = ?", (name,)).fetchone()[0]
+
+    def _commit(self) -> None:
+        if self._batch_depth == 0:
+            self._connection.commit()
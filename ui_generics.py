@@ -2,6 +2,7 @@
 
 import tkinter as tk
 import tkinter.filedialog
+import tkinter.font
 from tkinter import ttk
 import os
 
@@ -54,44 +55,141 @@ class CheckBox(tk.Frame):
             self.callback_function(self.get_value())
 
 
-class ScrollableListbox(tk.LabelFrame):
+class VirtualListbox(tk.LabelFrame):
+    """Scrollable list that only materializes the rows currently visible.
+
+    data can be any sequence of items whose first element is the label (e.g.
+    fileops.ImageFileList) and is shared, not copied. The listbox widget only
+    ever holds one screen of rows; the scrollbar, mouse wheel and arrow keys
+    move that window over the data.
+    """
     data = None
 
     listbox = None
     scrollbar = None
 
     onclick_callback = None
+    top_index = 0
+    selected_index = None
+    line_height = None
 
     def __init__(self, label, master=None):
         tk.LabelFrame.__init__(self, master, text=label)
 
-        self.listbox = tk.Listbox(self)
+        self.listbox = tk.Listbox(self, exportselection=False)
         self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
 
+        # Same as Tk's own listbox line height
+        font = tkinter.font.Font(font=self.listbox.cget('font'))
+        self.line_height = font.metrics('linespace') + 1 + 2 * self.listbox.winfo_pixels(
+            self.listbox.cget('selectborderwidth'))
+
         self.scrollbar = tk.Scrollbar(self)
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.BOTH)
+        self.scrollbar.config(command=self.yview)
 
-        self.listbox.config(yscrollcommand=self.scrollbar.set)
-        self.scrollbar.config(command=self.listbox.yview)
+        self.listbox.bind('<<ListboxSelect>>', self.listbox_select_callback)
+        self.listbox.bind('<Configure>', lambda event: self.refresh())
+        self.listbox.bind('<MouseWheel>', self.mousewheel_callback)
+        self.listbox.bind('<Button-4>', self.mousewheel_callback)
+        self.listbox.bind('<Button-5>', self.mousewheel_callback)
+        self.listbox.bind('<Up>', lambda event: self.step_selection(-1))
+        self.listbox.bind('<Down>', lambda event: self.step_selection(1))
 
     def clear(self):
-        self.listbox.delete(0, tk.END)
+        self.data = None
+        self.top_index = 0
+        self.selected_index = None
+        self.refresh()
 
     def get_list_length(self):
-        return self.listbox.size()
+        return len(self.data) if self.data is not None else 0
 
     def set_data(self, data):
         self.data = data
-        for item in self.data:
-            self.listbox.insert(tk.END, item[0])
+        self.top_index = 0
+        self.selected_index = None
+        self.refresh()
+
+    def append_data(self, data):
+        self.data.extend(data)
+        self.refresh()
 
     def bind_onclick(self, callback):
         self.onclick_callback = callback
-        self.listbox.bind('<<ListboxSelect>>', callback)
 
     def get_widget(self):
         return self.listbox
 
+    def get_selected_index(self):
+        return self.selected_index
+
+    def select_index(self, index):
+        """Select the row at index, scroll it into view and notify the onclick callback."""
+        rows = self.get_visible_rows()
+        self.selected_index = index
+        if index < self.top_index:
+            self.top_index = index
+        elif index >= self.top_index + rows:
+            self.top_index = index - rows + 1
+        self.refresh()
+        if self.onclick_callback is not None:
+            self.onclick_callback(None)
+
+    def step_selection(self, step):
+        length = self.get_list_length()
+        if length != 0:
+            current = self.selected_index if self.selected_index is not None else -step
+            self.select_index(min(max(current + step, 0), length - 1))
+        return 'break'
+
+    def get_visible_rows(self):
+        inner_height = self.listbox.winfo_height() - 2 * (
+            self.listbox.winfo_pixels(self.listbox.cget('borderwidth')) +
+            self.listbox.winfo_pixels(self.listbox.cget('highlightthickness')))
+        return max(1, inner_height // self.line_height)
+
+    def refresh(self):
+        length = self.get_list_length()
+        rows = self.get_visible_rows()
+        self.top_index = max(0, min(self.top_index, length - rows))
+        end_index = min(length, self.top_index + rows + 1)
+
+        self.listbox.delete(0, tk.END)
+        if end_index > self.top_index:
+            self.listbox.insert(tk.END, *[self.data[i][0] for i in range(self.top_index, end_index)])
+
+        if self.selected_index is not None and self.top_index <= self.selected_index < end_index:
+            self.listbox.selection_set(self.selected_index - self.top_index)
+
+        if length == 0:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.top_index / length, min(1, (self.top_index + rows) / length))
+
+    def yview(self, *args):
+        length = self.get_list_length()
+        if args[0] == 'moveto':
+            self.top_index = int(float(args[1]) * length)
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self.top_index += step * self.get_visible_rows() if args[2] == 'pages' else step
+        self.refresh()
+
+    def mousewheel_callback(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.yview('scroll', -3, 'units')
+        elif event.num == 5 or event.delta < 0:
+            self.yview('scroll', 3, 'units')
+        return 'break'
+
+    def listbox_select_callback(self, event):
+        selection = self.listbox.curselection()
+        if selection:
+            self.selected_index = self.top_index + int(selection[0])
+            if self.onclick_callback is not None:
+                self.onclick_callback(event)
+
 
 class LabelEntryFileBrowse(tk.LabelFrame):
     text_variable = None
@@ -282,15 +380,40 @@ class LabelEntryFloat(tk.LabelFrame):
         self.text_variable.set(str(value))
 
 
+class LabelComboBox(tk.LabelFrame):
+    text_variable = None
+    combobox = None
+
+    def __init__(self, label, values, master=None):
+        tk.LabelFrame.__init__(self, master, text=label)
+        self.text_variable = tk.StringVar()
+        self.columnconfigure(0, weight=1)
+
+        self.combobox = ttk.Combobox(self, textvariable=self.text_variable, values=list(values), state='readonly')
+        self.combobox.grid(column=0, row=0, sticky='news', padx=5, pady=5)
+
+    def get_value(self):
+        return self.text_variable.get()
+
+    def set_value(self, value):
+        self.text_variable.set(value)
+
+
 class SingleLineConsole(tk.Frame):
     console_label = None
     console_stringvar = None
+    stats_label = None
+    stats_stringvar = None
 
     def __init__(self, master=None):
         tk.Frame.__init__(self, master)
         self.columnconfigure(0, weight=1)
         self.rowconfigure(0, weight=1)
 
+        self.stats_stringvar = tk.StringVar()
+        self.stats_label = tk.Label(self, textvariable=self.stats_stringvar, bg='black', fg='gray')
+        self.stats_label.pack(side=tk.RIGHT, fill=tk.Y)
+
         self.console_stringvar = tk.StringVar()
         self.console_label = tk.Label(self, textvariable=self.console_stringvar, bg='black', fg='green')
         self.console_label.pack(expand=True, fill=tk.BOTH)
@@ -299,10 +422,18 @@ class SingleLineConsole(tk.Frame):
         self.console_stringvar.set('INFO: ' + text)
         self.update_idletasks()
 
+    def write_warning(self, text):
+        self.console_stringvar.set('WARNING: ' + text)
+        self.update_idletasks()
+
     def write_error(self, text):
         self.console_stringvar.set('ERROR: ' + text)
         self.update_idletasks()
 
+    def write_stats(self, text):
+        """Show text, such as stage timings, next to the last message."""
+        self.stats_stringvar.set(text)
+
 
 class Console(tk.LabelFrame):
     console_listbox = None
@@ -326,6 +457,11 @@ class Console(tk.LabelFrame):
         self.console_listbox.yview(tk.END)
         self.update_idletasks()
 
+    def write_warning(self, text):
+        self.console_listbox.insert(tk.END, 'WARNING: ' + text)
+        self.console_listbox.yview(tk.END)
+        self.update_idletasks()
+
     def write_error(self, text):
         self.console_listbox.insert(tk.END, 'ERROR: ' + text)
         self.console_listbox.yview(tk.END)
@@ -6,8 +6,10 @@ from typing import Optional, Tuple, List
 import os
 import fileops as fops
 import imageops as iops
+import profiling
 import ui_generics as ui
 from attribute_selector import AttributeSelector
+from imagecache import ImagePrefetcher, get_shared_preview_cache
 from rectangle_mixin import RectangleMixin
 
 from PIL import ImageTk
@@ -24,13 +26,20 @@ DEFAULT_OUTPUT_HEIGHT = 512
 TAGS_FILE = "tags.yaml"
 CLASSES_FILE = "classes.txt"
 
+SCAN_POLL_MS = 50
+
 
 class ImagesetTab(tk.Frame, RectangleMixin):
-    def __init__(self, console):
+    # Scope of the stage timings this tab records (see profiling.StageTimings)
+    stage_scope = "imageset"
+
+    def __init__(self, console, crop_writer, crop_recorder):
         super().__init__()
         self.current_crop_rect_multiplier_step = CROP_RECT_STEP_MIN
 
         self.console = console
+        self.crop_writer = crop_writer
+        self.crop_recorder = crop_recorder
         self.input_path_entry = None
         self.output_path_entry = None
         self.output_width_entry = None
@@ -38,6 +47,10 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         self.crop_aspect_x_entry = None
         self.crop_aspect_y_entry = None
         self.files_listbox = None
+        self.recursive_checkbox = None
+        self.progressive_preview_checkbox = None
+        self.encoder_profile_combobox = None
+        self.warn_duplicates_checkbox = None
         self.scale_output_checkbox = None
         self.roll_on_crop_checkbox = None
         self.use_class_name_checkbox = None
@@ -63,11 +76,18 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         self.current_rect_right = None
         self.current_rect_lower = None
         self.input_files = None
+        self.scanner = None
         self.raw_image = None
+        self.decoded_image = None
         self.scaled_image = None
+        self.settled_image = None
+        self.interim_preview = False
+        self.preview_upgrade = None
         self.ratio = None
         self.crop_count = 0
+        self.rotation = 0
         self.attribute_selector = None
+        self.prefetcher = None
 
         self.init_data()
         self.init_ui()
@@ -75,6 +95,7 @@ class ImagesetTab(tk.Frame, RectangleMixin):
 
     def init_data(self):
         self.attribute_selector = AttributeSelector(TAGS_FILE)
+        self.prefetcher = ImagePrefetcher(disk_cache=get_shared_preview_cache())
 
     def init_ui(self):
         self.columnconfigure(0, weight=1)
@@ -103,8 +124,13 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         )
         self.input_path_entry.grid(column=0, row=0, sticky="news")
 
+        self.recursive_checkbox = ui.CheckBox(
+            "Include Subfolders", self.recursive_checkbox_callback, paths_frame
+        )
+        self.recursive_checkbox.grid(column=0, row=1, sticky="news")
+
         self.output_path_entry = ui.LabelEntryFolderBrowse("Output Folder", paths_frame)
-        self.output_path_entry.grid(column=0, row=1, sticky="news")
+        self.output_path_entry.grid(column=0, row=2, sticky="news")
 
         parameters_frame = tk.LabelFrame(left_widget_frame, text="Parameters")
         parameters_frame.grid(column=0, row=1, sticky="news")
@@ -154,18 +180,36 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         )
         self.ask_for_tags_checkbox.grid(column=0, row=9, sticky="news")
 
+        self.progressive_preview_checkbox = ui.CheckBox(
+            "Progressive Preview", None, parameters_frame
+        )
+        self.progressive_preview_checkbox.grid(column=0, row=10, sticky="news")
+
+        self.encoder_profile_combobox = ui.LabelComboBox(
+            "Output Format", fops.ENCODER_PROFILES, parameters_frame
+        )
+        self.encoder_profile_combobox.grid(column=0, row=11, sticky="news")
+        self.encoder_profile_combobox.set_value(fops.DEFAULT_ENCODER_PROFILE)
+
+        self.warn_duplicates_checkbox = ui.CheckBox(
+            "Warn On Duplicate Crops", None, parameters_frame
+        )
+        self.warn_duplicates_checkbox.grid(column=0, row=12, sticky="news")
+        self.warn_duplicates_checkbox.set_value(1)
+
         self.scale_output_checkbox.set_value(0)
         self.roll_on_crop_checkbox.set_value(1)
         self.use_class_name_checkbox.set_value(0)
         self.use_image_description_checkbox.set_value(0)
         self.ask_for_classes_checkbox.set_value(0)
+        self.progressive_preview_checkbox.set_value(1)
 
         mid_frame = tk.Frame(main_frame)
         mid_frame.grid(column=1, row=0, sticky="news")
         mid_frame.rowconfigure(0, weight=1)
         mid_frame.columnconfigure(0, weight=1)
 
-        self.files_listbox = ui.ScrollableListbox("Files", mid_frame)
+        self.files_listbox = ui.VirtualListbox("Files", mid_frame)
         self.files_listbox.grid(column=0, row=0, sticky="news")
         self.files_listbox.bind_onclick(self.listbox_onclick)
 
@@ -200,16 +244,32 @@ class ImagesetTab(tk.Frame, RectangleMixin):
             width=3,
         )
 
-    def window_reconfigure(self, event):
-        if self.current_image is not None:
-            try:
-                if not (
-                    (self.current_image.width() == self.image_canvas.winfo_width())
-                    or (self.current_image.height() == self.image_canvas.winfo_height())
-                ):
+    def window_reconfigure(self, final=True):
+        """Re-render after a window resize.
+
+        Interim passes cheaply rescale the last high quality preview; the final
+        pass, once resizing has settled, rescales from the raw image.
+        """
+        if self.current_image is None:
+            return
+        try:
+            ratio = iops.fit_ratio(
+                self.raw_image.size,
+                (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+            )
+            if final:
+                if ratio != self.ratio or self.interim_preview:
+                    self.scaled_image = None
                     self.load_image_to_canvas()
-            except tk.TclError:
-                pass  # Canvas not ready or destroyed
+            elif ratio != self.ratio:
+                self.ratio = ratio
+                self.scaled_image = iops.resize_preview(
+                    self.settled_image, iops.scaled_size(self.raw_image.size, ratio)
+                )
+                self.interim_preview = True
+                self.show_scaled_image()
+        except tk.TclError:
+            pass  # Canvas not ready or destroyed
 
     def scale_output_checkbox_callback(self, value):
         if value == 1:
@@ -219,21 +279,53 @@ class ImagesetTab(tk.Frame, RectangleMixin):
             self.output_height_entry.disable()
             self.output_width_entry.disable()
 
+    def recursive_checkbox_callback(self, value):
+        if self.input_path_entry.get_value():
+            self.set_files_to_listbox(self.input_path_entry.get_value())
+
     def set_files_to_listbox(self, path):
         self.output_path_entry.set_value(os.path.join(path, "out"))
         self.image_canvas.delete("all")
-        self.files_listbox.clear()
         self.crop_count = 0  # Reset crop count for new folder
-        self.input_files = fops.get_image_files(path)
+        self.input_files = fops.ImageFileList(path)
         self.files_listbox.set_data(self.input_files)
+        self.current_image_index = None
+
+        if self.scanner is not None:
+            self.scanner.cancel()
+        self.scanner = fops.DirectoryScanner(
+            path,
+            self.recursive_checkbox.get_value(),
+            exclude=(self.output_path_entry.get_value(),),
+        )
+        self.console.write_info("Scanning " + path + "...")
+        self.after(SCAN_POLL_MS, self.poll_scanner, self.scanner)
+
+    def poll_scanner(self, scanner):
+        if scanner is not self.scanner:
+            return
 
-        if self.files_listbox.get_list_length() != 0:
-            self.files_listbox.get_widget().selection_clear(0, tk.END)
-            self.files_listbox.get_widget().select_set(0)
-            self.current_image_index = 0
-            self.files_listbox.get_widget().event_generate("<<ListboxSelect>>")
+        files, finished = scanner.poll()
+        if files:
+            self.files_listbox.append_data(files)
 
-        self.console.write_info("Found " + str(len(self.input_files)) + " image(s).")
+            if self.current_image_index is None:
+                self.files_listbox.select_index(0)
+
+        if finished:
+            self.scanner = None
+            if scanner.error is not None:
+                self.console.write_error("Scan failed: " + str(scanner.error))
+            else:
+                self.console.write_info(
+                    "Found " + str(len(self.input_files)) + " image(s)."
+                )
+        else:
+            if files:
+                self.console.write_info(
+                    "Scanning... " + str(len(self.input_files)) + " image(s) found."
+                )
+            self.after(SCAN_POLL_MS, self.poll_scanner, scanner)
 
     def get_rect_half_size(self):
         """Return the half-size of the crop rectangle based on current settings."""
@@ -247,31 +339,115 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         if self.files_listbox.get_list_length() == 0:
             return
 
-        w = event.widget
-        index = w.curselection()
-        if index:
-            index = int(w.curselection()[0])
-
+        index = self.files_listbox.get_selected_index()
+        if index is not None:
             self.current_image_index = index
             self.image_canvas.focus_set()
             self.load_image_raw()
             self.load_image_to_canvas()
 
     def load_image_raw(self):
-        self.raw_image = iops.load_image(self.input_files[self.current_image_index][1])
+        canvas_size = (self.image_canvas.winfo_width(), self.image_canvas.winfo_height())
+        if self.decoded_image is not None:
+            self.decoded_image.release()
+            self.prefetcher.recharge(self.decoded_image)
+        with profiling.stage("load", self.stage_scope):
+            self.decoded_image = self.prefetcher.load(
+                self.input_files[self.current_image_index][1],
+                canvas_size,
+                fast=self.progressive_preview_checkbox.get_value(),
+            )
+        self.raw_image = self.decoded_image.image
+        self.scaled_image = self.decoded_image.preview
+        self.ratio = self.decoded_image.ratio
+        self.interim_preview = self.decoded_image.interim
+        self.rotation = 0
+
+        neighbours = self.prefetcher.neighbour_indices(
+            self.current_image_index, len(self.input_files)
+        )
+        self.prefetcher.prefetch(
+            [self.input_files[i][1] for i in neighbours], canvas_size
+        )
 
     def load_image_to_canvas(self):
         if self.input_files is None or self.raw_image is None:
             return
 
-        self.image_canvas.delete("all")
-
-        self.ratio = min(
-            self.image_canvas.winfo_width() / self.raw_image.width,
-            self.image_canvas.winfo_height() / self.raw_image.height,
+        ratio = iops.fit_ratio(
+            self.raw_image.size,
+            (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+        )
+        if self.scaled_image is None or ratio != self.ratio:
+            self.ratio = ratio
+            with profiling.stage("scale", self.stage_scope):
+                if self.progressive_preview_checkbox.get_value():
+                    self.scaled_image = iops.fast_scale_image(self.raw_image, self.ratio)
+                    self.interim_preview = True
+                else:
+                    self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
+                    self.interim_preview = False
+        self.settled_image = self.scaled_image
+        self.show_scaled_image()
+
+        self.cancel_preview_upgrade()
+        if self.interim_preview:
+            self.start_preview_upgrade()
+
+    def start_preview_upgrade(self):
+        """Scale a LANCZOS preview to replace the interim one on a prefetch thread.
+
+        The preview comes back through after_idle() to finish_preview_upgrade.
+        """
+        self.cancel_preview_upgrade()
+        image, ratio = self.raw_image, self.ratio
+        self.preview_upgrade = self.prefetcher.upgrade(image, ratio, self.stage_scope)
+        self.preview_upgrade.add_done_callback(
+            lambda future: self.deliver_preview_upgrade(future, image, ratio)
         )
-        self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
-        self.current_image = ImageTk.PhotoImage(self.scaled_image)
+
+    def cancel_preview_upgrade(self):
+        if self.preview_upgrade is not None:
+            self.preview_upgrade.cancel()
+            self.preview_upgrade = None
+
+    def deliver_preview_upgrade(self, future, image, ratio):
+        # Runs on a prefetch thread; Tk runs after_idle callbacks on its own thread
+        try:
+            self.after_idle(self.finish_preview_upgrade, future, image, ratio)
+        except (RuntimeError, tk.TclError):
+            pass  # The window has been closed
+
+    def finish_preview_upgrade(self, future, image, ratio):
+        """Show an upgraded preview unless another image, rotation or ratio replaced it.
+
+        An upgrade of the image as decoded is stored in the caches.
+        """
+        if future is not self.preview_upgrade:
+            return
+        self.preview_upgrade = None
+        if not self.interim_preview or image is not self.raw_image or ratio != self.ratio:
+            return
+        try:
+            self.scaled_image = future.result()
+        except Exception as exc:
+            self.console.write_error(f"Could not scale preview: {exc}")
+            return
+
+        self.settled_image = self.scaled_image
+        self.interim_preview = False
+        if self.raw_image is self.decoded_image.image and self.ratio == self.decoded_image.ratio:
+            self.prefetcher.settle(
+                self.input_files[self.current_image_index][1], self.decoded_image, self.scaled_image
+            )
+        with profiling.stage("photoimage", self.stage_scope):
+            self.current_image = ImageTk.PhotoImage(self.scaled_image)
+        self.image_canvas.itemconfig(self.image_container, image=self.current_image)
+
+    def show_scaled_image(self):
+        self.image_canvas.delete("all")
+        with profiling.stage("photoimage", self.stage_scope):
+            self.current_image = ImageTk.PhotoImage(self.scaled_image)
 
         self.image_container = self.image_canvas.create_image(
             self.image_canvas.winfo_width() / 2,
@@ -345,7 +521,8 @@ class ImagesetTab(tk.Frame, RectangleMixin):
 
         self.move_rectangle()
 
-    def get_image_inside_rectangle(self):
+    def get_rectangle_box(self):
+        """Return the crop rectangle in scaled image coordinates."""
         box_rel_tl_x = self.current_rect_left - (
             (self.current_canvas_size_x - self.scaled_image.width) / 2
         )
@@ -356,22 +533,52 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         box_rel_bl_y = box_rel_tl_y + (
             self.current_rect_lower - self.current_rect_upper
         )
-        return iops.crop_image(
-            self.raw_image,
-            self.ratio,
-            (box_rel_tl_x, box_rel_tl_y, box_rel_bl_x, box_rel_bl_y),
-        )
+        return box_rel_tl_x, box_rel_tl_y, box_rel_bl_x, box_rel_bl_y
+
+    def get_image_inside_rectangle(self):
+        return iops.crop_image(self.raw_image, self.ratio, self.get_rectangle_box())
 
     def toggle_roll(self, event):
         self.roll_on_crop_checkbox.set_value(not self.roll_on_crop_checkbox.get_value())
 
     def rotate_image_cw(self, event):
-        self.raw_image = iops.rotate_image(self.raw_image, 270)
-        self.load_image_to_canvas()
+        self.rotate_view(270)
 
     def rotate_image_ccw(self, event):
-        self.raw_image = iops.rotate_image(self.raw_image, 90)
-        self.load_image_to_canvas()
+        self.rotate_view(90)
+
+    def rotate_view(self, angle):
+        """Rotate by a multiple of 90 degrees counter-clockwise.
+
+        A lazy raw image only records the rotation, which crops apply to their
+        own pixels; the preview is transposed rather than rescaled, unless the
+        rotated image fits the canvas at a different ratio.
+        """
+        if self.raw_image is None:
+            return
+        self.raw_image = iops.rotate_image(self.raw_image, angle)
+        self.rotation = (self.rotation + angle) % 360
+        self.settled_image = iops.rotate_image(self.settled_image, angle)
+
+        ratio = iops.fit_ratio(
+            self.raw_image.size,
+            (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+        )
+        if ratio == self.ratio:
+            self.scaled_image = iops.rotate_image(self.scaled_image, angle)
+            self.show_scaled_image()
+            if self.interim_preview:
+                self.start_preview_upgrade()
+            return
+
+        self.ratio = ratio
+        with profiling.stage("scale", self.stage_scope):
+            self.scaled_image = iops.resize_preview(
+                self.settled_image, iops.scaled_size(self.raw_image.size, ratio)
+            )
+        self.interim_preview = True
+        self.show_scaled_image()
+        self.start_preview_upgrade()
 
     def roll(self, event):
         if self.files_listbox.get_list_length() == 0:
@@ -386,9 +593,7 @@ class ImagesetTab(tk.Frame, RectangleMixin):
                 )
                 self.current_image_index = 0
 
-            self.files_listbox.get_widget().selection_clear(0, tk.END)
-            self.files_listbox.get_widget().select_set(self.current_image_index)
-            self.files_listbox.get_widget().event_generate("<<ListboxSelect>>")
+            self.files_listbox.select_index(self.current_image_index)
 
     def _validate_crop_inputs(self) -> bool:
         """Validate inputs before cropping.
@@ -436,6 +641,16 @@ class ImagesetTab(tk.Frame, RectangleMixin):
             return self.attribute_selector.ask_attributes()
         return None
 
+    def _get_output_root(self) -> str:
+        """Get the output folder, resolved against the input folder if needed."""
+        return fops.resolve_output_path(
+            self.output_path_entry.get_value(), self.input_path_entry.get_value()
+        )
+
+    def _get_encoder_profile(self) -> fops.EncoderProfile:
+        """Get the encoder profile selected for crops."""
+        return fops.get_encoder_profile(self.encoder_profile_combobox.get_value())
+
     def _build_output_paths(self, class_name: Optional[str]) -> Tuple[str, str]:
         """Build output file paths for image and description.
 
@@ -445,23 +660,16 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         Returns:
             Tuple of (image_path, description_path)
         """
-        base_name = self.input_files[self.current_image_index][0].split(".")[0]
-        output_image_name = f"{base_name}_{self.crop_count}.png"
-        output_description_name = f"{base_name}_{self.crop_count}.txt"
-
-        output_path = self.output_path_entry.get_value()
-        if not fops.check_path_valid(output_path):
-            output_path = os.path.join(self.input_path_entry.get_value(), output_path)
-
+        base_name = os.path.splitext(self.input_files[self.current_image_index][0])[0]
+        folder = self._get_output_root()
         if class_name is not None:
-            return (
-                os.path.join(output_path, class_name, output_image_name),
-                os.path.join(output_path, class_name, output_description_name),
-            )
-        return (
-            os.path.join(output_path, output_image_name),
-            os.path.join(output_path, output_description_name),
+            folder = os.path.join(folder, class_name)
+
+        # Skip indices taken by earlier sessions, whose crop count started at 0 too
+        self.crop_count, image_path, description_path = fops.next_free_crop_paths(
+            folder, base_name, self.crop_count, self._get_encoder_profile().extension
         )
+        return image_path, description_path
 
     def canvas_mouseclick(self, event):
         if not self._validate_crop_inputs():
@@ -470,21 +678,45 @@ class ImagesetTab(tk.Frame, RectangleMixin):
         class_name = self._get_class_name()
         image_description = self._get_image_description()
 
-        cropped_image = self.get_image_inside_rectangle()
+        output_size = None
         if self.scale_output_checkbox.get_value():
-            cropped_image = iops.resize_image(
-                cropped_image,
-                height=self.output_height_entry.get_value(),
-                width=self.output_width_entry.get_value(),
+            output_size = (
+                self.output_width_entry.get_value(),
+                self.output_height_entry.get_value(),
             )
 
         image_path, description_path = self._build_output_paths(class_name)
-
-        fops.save_image_to_file(cropped_image, filepath=image_path)
-        fops.save_image_description_to_file(
-            image_description, filepath=description_path
+        box = self.get_rectangle_box()
+
+        with profiling.stage("crop", self.stage_scope):
+            cropped_image = iops.crop_image(self.raw_image, self.ratio, box)
+        self.prefetcher.recharge(self.decoded_image)
+        entry = {
+            "source": self.input_files[self.current_image_index][1],
+            "box": iops.scale_box(box, self.ratio),
+            "orientation": fops.ORIENTATION_EXIF,
+            "rotation": self.rotation,
+            "output_size": output_size,
+            "class_name": class_name,
+            "description": image_description,
+            "encoder": self._get_encoder_profile().name,
+        }
+        self.crop_writer.submit(
+            fops.CropJob(
+                cropped_image,
+                image_path,
+                image_description,
+                description_path,
+                output_size,
+                self._get_encoder_profile(),
+                self.crop_recorder.on_written(
+                    self._get_output_root(), entry, self.warn_duplicates_checkbox.get_value()
+                ),
+            )
+        )
+        self.console.write_info(
+            f"Queued {image_path} ({self.crop_writer.pending()} pending)."
         )
-        self.console.write_info("Image saved to: " + image_path)
         self.crop_count += 1
 
         if self.roll_on_crop_checkbox.get_value():
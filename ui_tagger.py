@@ -1,20 +1,30 @@
+import sqlite3
 import tkinter as tk
 from tkinter import messagebox
 from tkinter.simpledialog import askstring
 
 import fileops as fops
 import imageops as iops
+import profiling
+import tagstore
 import ui_generics as ui
+from imagecache import ImagePrefetcher, get_shared_preview_cache
 from rectangle_mixin import RectangleMixin
 
 from PIL import ImageTk
 
 TAG_RECT_SIZE = 16
 
+SCAN_POLL_MS = 50
+
 TAGDATA_TEMPLATE = {"class_name": "", "tags": []}
+TAG_COUNTS_SHOWN = 10
 
 
 class TagEditorTab(tk.Frame, RectangleMixin):
+    # Scope of the stage timings this tab records (see profiling.StageTimings)
+    stage_scope = "tagger"
+
     def __init__(self, console):
         super().__init__()
         self.console = console
@@ -22,6 +32,9 @@ class TagEditorTab(tk.Frame, RectangleMixin):
         self.class_name_entry = None
         self.image_tags_entry = None
         self.files_listbox = None
+        self.recursive_checkbox = None
+        self.progressive_preview_checkbox = None
+        self.tag_database_checkbox = None
 
         self.image_canvas = None
         self.image_container = None
@@ -39,11 +52,18 @@ class TagEditorTab(tk.Frame, RectangleMixin):
         self.current_rect_right = None
         self.current_rect_lower = None
         self.input_files = None
+        self.scanner = None
         self.raw_image = None
+        self.decoded_image = None
         self.scaled_image = None
+        self.settled_image = None
+        self.interim_preview = False
+        self.preview_upgrade = None
         self.ratio = None
         self.tag_rectangles = []
         self.current_tag_data = {}
+        self.tag_store = None
+        self.prefetcher = ImagePrefetcher(disk_cache=get_shared_preview_cache())
 
         self.init_ui()
         self.console.write_info("Tagger Tab init complete.")
@@ -75,12 +95,45 @@ class TagEditorTab(tk.Frame, RectangleMixin):
         )
         self.input_path_entry.grid(column=0, row=0, sticky="news")
 
+        self.recursive_checkbox = ui.CheckBox(
+            "Include Subfolders", self.recursive_checkbox_callback, paths_frame
+        )
+        self.recursive_checkbox.grid(column=0, row=1, sticky="news")
+
+        self.progressive_preview_checkbox = ui.CheckBox(
+            "Progressive Preview", None, paths_frame
+        )
+        self.progressive_preview_checkbox.grid(column=0, row=2, sticky="news")
+        self.progressive_preview_checkbox.set_value(1)
+
+        self.tag_database_checkbox = ui.CheckBox(
+            "Use Tag Database", self.tag_database_checkbox_callback, paths_frame
+        )
+        self.tag_database_checkbox.grid(column=0, row=3, sticky="news")
+
+        database_frame = tk.LabelFrame(left_widget_frame, text="Tag Database")
+        database_frame.grid(column=0, row=1, sticky="news")
+        database_frame.columnconfigure(0, weight=1)
+
+        for row, (text, command) in enumerate(
+            (
+                ("Import Tag Files", self.import_tag_files_callback),
+                ("Export Tag Files", self.export_tag_files_callback),
+                ("Show All Images", self.show_all_callback),
+                ("Show Untagged Images", self.show_untagged_callback),
+                ("Show Images Of Class", self.show_class_callback),
+                ("Count Tags", self.count_tags_callback),
+            )
+        ):
+            button = tk.Button(database_frame, text=text, command=command)
+            button.grid(column=0, row=row, sticky="news")
+
         mid_frame = tk.Frame(main_frame)
         mid_frame.grid(column=1, row=0, sticky="news")
         mid_frame.rowconfigure(0, weight=1)
         mid_frame.columnconfigure(0, weight=1)
 
-        self.files_listbox = ui.ScrollableListbox("Files", mid_frame)
+        self.files_listbox = ui.VirtualListbox("Files", mid_frame)
         self.files_listbox.grid(column=0, row=0, sticky="news")
         self.files_listbox.bind_onclick(self.listbox_onclick)
 
@@ -108,38 +161,177 @@ class TagEditorTab(tk.Frame, RectangleMixin):
             0, 0, TAG_RECT_SIZE, TAG_RECT_SIZE, outline="white", width=3
         )
 
-    def window_reconfigure(self, event):
-        if self.current_image is not None:
-            try:
-                if not (
-                    (self.current_image.width() == self.image_canvas.winfo_width())
-                    or (self.current_image.height() == self.image_canvas.winfo_height())
-                ):
+    def window_reconfigure(self, final=True):
+        """Re-render after a window resize.
+
+        Interim passes cheaply rescale the last high quality preview; the final
+        pass, once resizing has settled, rescales from the raw image.
+        """
+        if self.current_image is None:
+            return
+        try:
+            ratio = iops.fit_ratio(
+                self.raw_image.size,
+                (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+            )
+            if final:
+                if ratio != self.ratio or self.interim_preview:
+                    self.scaled_image = None
                     self.load_image_to_canvas()
-            except tk.TclError:
-                pass  # Canvas not ready or destroyed
+            elif ratio != self.ratio:
+                self.ratio = ratio
+                self.scaled_image = iops.resize_preview(
+                    self.settled_image, iops.scaled_size(self.raw_image.size, ratio)
+                )
+                self.interim_preview = True
+                self.show_scaled_image()
+        except tk.TclError:
+            pass  # Canvas not ready or destroyed
+
+    def recursive_checkbox_callback(self, value):
+        if self.input_path_entry.get_value():
+            self.set_files_to_listbox(self.input_path_entry.get_value())
+
+    def tag_database_checkbox_callback(self, value):
+        if self.input_path_entry.get_value():
+            self.set_files_to_listbox(self.input_path_entry.get_value())
+        elif not value:
+            self.close_tag_store()
+
+    def open_tag_store(self, path):
+        self.close_tag_store()
+        if not self.tag_database_checkbox.get_value():
+            return
+        try:
+            self.tag_store = tagstore.TagStore(path)
+        except sqlite3.Error as exc:
+            self.tag_database_checkbox.set_value(0)
+            self.console.write_error(f"Could not open tag database: {exc}")
+
+    def close_tag_store(self):
+        if self.tag_store is not None:
+            self.tag_store.close()
+            self.tag_store = None
+
+    def _require_tag_store(self) -> bool:
+        if self.tag_store is None:
+            messagebox.showerror(title="Error", message="Tag database is not in use.")
+            return False
+        if self.scanner is not None:
+            messagebox.showerror(title="Error", message="Folder scan in progress.")
+            return False
+        return True
+
+    def show_files(self, names):
+        self.image_canvas.delete("all")
+        self.input_files = fops.ImageFileList(
+            self.input_path_entry.get_value(), ((name, None) for name in names)
+        )
+        self.files_listbox.set_data(self.input_files)
+        self.current_image_index = None
+        if len(self.input_files):
+            self.files_listbox.select_index(0)
+
+    def import_tag_files_callback(self):
+        if not self._require_tag_store():
+            return
+        try:
+            imported = self.tag_store.import_files(
+                self.input_files.name(index) for index in range(len(self.input_files))
+            )
+        except (OSError, ValueError, KeyError, sqlite3.Error) as exc:
+            self.console.write_error(f"Could not import tag files: {exc}")
+            return
+        self.console.write_info(f"Imported tag files of {imported} image(s).")
+
+    def export_tag_files_callback(self):
+        if not self._require_tag_store():
+            return
+        try:
+            exported = self.tag_store.export_files()
+        except (OSError, sqlite3.Error) as exc:
+            self.console.write_error(f"Could not export tag files: {exc}")
+            return
+        self.console.write_info(f"Exported tag files of {exported} image(s).")
+
+    def show_all_callback(self):
+        if self.input_path_entry.get_value():
+            self.set_files_to_listbox(self.input_path_entry.get_value())
+
+    def show_untagged_callback(self):
+        if not self._require_tag_store():
+            return
+        self.show_files(self.tag_store.images_without_tags())
+        self.console.write_info(f"{len(self.input_files)} untagged image(s).")
+
+    def show_class_callback(self):
+        if not self._require_tag_store():
+            return
+        class_name = askstring("Class", "Enter the class name.")
+        if not class_name:
+            return
+        self.show_files(self.tag_store.images_by_class(class_name))
+        self.console.write_info(f"{len(self.input_files)} image(s) of class {class_name}.")
+
+    def count_tags_callback(self):
+        if not self._require_tag_store():
+            return
+        counts = self.tag_store.tag_counts()
+        if not counts:
+            self.console.write_info("No tags.")
+            return
+        summary = ", ".join(f"{tag} ({count})" for tag, count in counts[:TAG_COUNTS_SHOWN])
+        if len(counts) > TAG_COUNTS_SHOWN:
+            summary += f" and {len(counts) - TAG_COUNTS_SHOWN} more"
+        self.console.write_info(f"Tags: {summary}.")
 
     def set_files_to_listbox(self, path):
+        self.open_tag_store(path)
         self.image_canvas.delete("all")
-        self.files_listbox.clear()
-        self.input_files = fops.get_image_files(path)
+        self.input_files = fops.ImageFileList(path)
         self.files_listbox.set_data(self.input_files)
-        if self.files_listbox.get_list_length() != 0:
-            self.files_listbox.get_widget().selection_clear(0, tk.END)
-            self.files_listbox.get_widget().select_set(0)
-            self.current_image_index = 0
-            self.files_listbox.get_widget().event_generate("<<ListboxSelect>>")
-        self.console.write_info("Found " + str(len(self.input_files)) + " image(s).")
+        self.current_image_index = None
+
+        if self.scanner is not None:
+            self.scanner.cancel()
+        self.scanner = fops.DirectoryScanner(path, self.recursive_checkbox.get_value())
+        self.console.write_info("Scanning " + path + "...")
+        self.after(SCAN_POLL_MS, self.poll_scanner, self.scanner)
+
+    def poll_scanner(self, scanner):
+        if scanner is not self.scanner:
+            return
+
+        files, finished = scanner.poll()
+        if files:
+            self.files_listbox.append_data(files)
+            if self.tag_store is not None:
+                self.tag_store.add_images(name for name, _ in files)
+
+            if self.current_image_index is None:
+                self.files_listbox.select_index(0)
+
+        if finished:
+            self.scanner = None
+            if scanner.error is not None:
+                self.console.write_error("Scan failed: " + str(scanner.error))
+            else:
+                self.console.write_info(
+                    "Found " + str(len(self.input_files)) + " image(s)."
+                )
+        else:
+            if files:
+                self.console.write_info(
+                    "Scanning... " + str(len(self.input_files)) + " image(s) found."
+                )
+            self.after(SCAN_POLL_MS, self.poll_scanner, scanner)
 
     def listbox_onclick(self, event):
         if self.files_listbox.get_list_length() == 0:
             return
 
-        w = event.widget
-        index = w.curselection()
-        if index:
-            index = int(w.curselection()[0])
-
+        index = self.files_listbox.get_selected_index()
+        if index is not None:
             self.current_image_index = index
             self.image_canvas.focus_set()
             self.load_image_raw()
@@ -150,9 +342,12 @@ class TagEditorTab(tk.Frame, RectangleMixin):
         self.class_name_entry.set_value("")
         self.image_tags_entry.set_value("")
         self.current_tag_data.clear()
-        tag_data = fops.load_tag_data(
-            self.input_files[self.current_image_index][1].split(".")[0]
-        )
+        if self.tag_store is not None:
+            tag_data = self.tag_store.load(self.input_files.name(self.current_image_index))
+        else:
+            tag_data = fops.load_tag_data(
+                fops.tag_base_path(self.input_files[self.current_image_index][1])
+            )
         if tag_data is not None:
             self.current_tag_data = tag_data
             self.class_name_entry.set_value(self.current_tag_data["class_name"])
@@ -172,8 +367,10 @@ class TagEditorTab(tk.Frame, RectangleMixin):
             y_offset = int((self.image_canvas.winfo_height() - scl_img_height) / 2)
 
             for tag in tags:
-                coord_x = int((tag["x"] / scaling_factor) + x_offset)
-                coord_y = int((tag["y"] / scaling_factor) + y_offset)
+                # Tags are kept in file pixels, before any EXIF orientation
+                view_x, view_y = iops.to_view_point(self.raw_image, (tag["x"], tag["y"]))
+                coord_x = int((view_x / scaling_factor) + x_offset)
+                coord_y = int((view_y / scaling_factor) + y_offset)
 
                 self.tag_rectangles.append(
                     self.image_canvas.create_rectangle(
@@ -191,20 +388,106 @@ class TagEditorTab(tk.Frame, RectangleMixin):
             self.current_tag_data = TAGDATA_TEMPLATE.copy()
 
     def load_image_raw(self):
-        self.raw_image = iops.load_image(self.input_files[self.current_image_index][1])
+        canvas_size = (self.image_canvas.winfo_width(), self.image_canvas.winfo_height())
+        if self.decoded_image is not None:
+            self.decoded_image.release()
+            self.prefetcher.recharge(self.decoded_image)
+        with profiling.stage("load", self.stage_scope):
+            self.decoded_image = self.prefetcher.load(
+                self.input_files[self.current_image_index][1],
+                canvas_size,
+                fast=self.progressive_preview_checkbox.get_value(),
+            )
+        self.raw_image = self.decoded_image.image
+        self.scaled_image = self.decoded_image.preview
+        self.ratio = self.decoded_image.ratio
+        self.interim_preview = self.decoded_image.interim
+
+        neighbours = self.prefetcher.neighbour_indices(
+            self.current_image_index, len(self.input_files)
+        )
+        self.prefetcher.prefetch(
+            [self.input_files[i][1] for i in neighbours], canvas_size
+        )
 
     def load_image_to_canvas(self):
         if self.input_files is None or self.raw_image is None:
             return
 
-        self.image_canvas.delete("all")
-
-        self.ratio = min(
-            self.image_canvas.winfo_width() / self.raw_image.width,
-            self.image_canvas.winfo_height() / self.raw_image.height,
+        ratio = iops.fit_ratio(
+            self.raw_image.size,
+            (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+        )
+        if self.scaled_image is None or ratio != self.ratio:
+            self.ratio = ratio
+            with profiling.stage("scale", self.stage_scope):
+                if self.progressive_preview_checkbox.get_value():
+                    self.scaled_image = iops.fast_scale_image(self.raw_image, self.ratio)
+                    self.interim_preview = True
+                else:
+                    self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
+                    self.interim_preview = False
+        self.settled_image = self.scaled_image
+        self.show_scaled_image()
+
+        self.cancel_preview_upgrade()
+        if self.interim_preview:
+            self.start_preview_upgrade()
+
+    def start_preview_upgrade(self):
+        """Scale a LANCZOS preview to replace the interim one on a prefetch thread.
+
+        The preview comes back through after_idle() to finish_preview_upgrade.
+        """
+        self.cancel_preview_upgrade()
+        image, ratio = self.raw_image, self.ratio
+        self.preview_upgrade = self.prefetcher.upgrade(image, ratio, self.stage_scope)
+        self.preview_upgrade.add_done_callback(
+            lambda future: self.deliver_preview_upgrade(future, image, ratio)
         )
-        self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
-        self.current_image = ImageTk.PhotoImage(self.scaled_image)
+
+    def cancel_preview_upgrade(self):
+        if self.preview_upgrade is not None:
+            self.preview_upgrade.cancel()
+            self.preview_upgrade = None
+
+    def deliver_preview_upgrade(self, future, image, ratio):
+        # Runs on a prefetch thread; Tk runs after_idle callbacks on its own thread
+        try:
+            self.after_idle(self.finish_preview_upgrade, future, image, ratio)
+        except (RuntimeError, tk.TclError):
+            pass  # The window has been closed
+
+    def finish_preview_upgrade(self, future, image, ratio):
+        """Show an upgraded preview unless another image, rotation or ratio replaced it.
+
+        An upgrade of the image as decoded is stored in the caches.
+        """
+        if future is not self.preview_upgrade:
+            return
+        self.preview_upgrade = None
+        if not self.interim_preview or image is not self.raw_image or ratio != self.ratio:
+            return
+        try:
+            self.scaled_image = future.result()
+        except Exception as exc:
+            self.console.write_error(f"Could not scale preview: {exc}")
+            return
+
+        self.settled_image = self.scaled_image
+        self.interim_preview = False
+        if self.raw_image is self.decoded_image.image and self.ratio == self.decoded_image.ratio:
+            self.prefetcher.settle(
+                self.input_files[self.current_image_index][1], self.decoded_image, self.scaled_image
+            )
+        with profiling.stage("photoimage", self.stage_scope):
+            self.current_image = ImageTk.PhotoImage(self.scaled_image)
+        self.image_canvas.itemconfig(self.image_container, image=self.current_image)
+
+    def show_scaled_image(self):
+        self.image_canvas.delete("all")
+        with profiling.stage("photoimage", self.stage_scope):
+            self.current_image = ImageTk.PhotoImage(self.scaled_image)
 
         self.image_container = self.image_canvas.create_image(
             self.image_canvas.winfo_width() / 2,
@@ -255,9 +538,7 @@ class TagEditorTab(tk.Frame, RectangleMixin):
                 )
                 self.current_image_index = 0
 
-            self.files_listbox.get_widget().selection_clear(0, tk.END)
-            self.files_listbox.get_widget().select_set(self.current_image_index)
-            self.files_listbox.get_widget().event_generate("<<ListboxSelect>>")
+            self.files_listbox.select_index(self.current_image_index)
 
     def canvas_mouseclick(self, event):
         if self.input_files is None:
@@ -278,8 +559,10 @@ class TagEditorTab(tk.Frame, RectangleMixin):
         x_offset = int((self.image_canvas.winfo_width() - scl_img_width) / 2)
         y_offset = int((self.image_canvas.winfo_height() - scl_img_height) / 2)
 
-        orig_x = int((x - x_offset) * scaling_factor)
-        orig_y = int((y - y_offset) * scaling_factor)
+        orig_x, orig_y = iops.to_source_point(
+            self.raw_image,
+            (int((x - x_offset) * scaling_factor), int((y - y_offset) * scaling_factor)),
+        )
 
         tag = askstring("Tag", "Enter the tag.")
         if tag:
@@ -293,8 +576,13 @@ class TagEditorTab(tk.Frame, RectangleMixin):
 
         self.current_tag_data["class_name"] = self.class_name_entry.get_value()
 
-        fops.save_tag_data(
-            self.input_files[self.current_image_index][1].split(".")[0],
-            self.current_tag_data,
-        )
-        self.files_listbox.get_widget().event_generate("<<ListboxSelect>>")
+        if self.tag_store is not None:
+            self.tag_store.save(
+                self.input_files.name(self.current_image_index), self.current_tag_data
+            )
+        else:
+            fops.save_tag_data(
+                fops.tag_base_path(self.input_files[self.current_image_index][1]),
+                self.current_tag_data,
+            )
+        self.files_listbox.select_index(self.current_image_index)
@@ -1,16 +1,18 @@
 import os
+import time
 import cv2
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter.simpledialog import askstring
-from tkinter.simpledialog import askinteger
 from typing import Optional, Tuple
 from PIL import Image, ImageTk
 
 import fileops as fops
 import imageops as iops
+import profiling
 import ui_generics as ui
+import videoops as vops
 from attribute_selector import AttributeSelector
 from rectangle_mixin import RectangleMixin
 
@@ -25,13 +27,28 @@ DEFAULT_OUTPUT_HEIGHT = 512
 
 TAGS_FILE = "tags.yaml"
 
+PREVIEW_UPGRADE_DELAY_MS = 150
+PROGRESS_UPDATE_S = 0.25
+SEEK_POLL_MS = 20
+EXTRACT_POLL_MS = 100
+
+STEP_BACK_WINDOW = 30
+
+DEFAULT_DUPLICATE_THRESHOLD = 0
+PLAYBACK_STATS_S = 1.0
+
 
 class VideoTab(tk.Frame, RectangleMixin):
-    def __init__(self, console):
+    # Scope of the stage timings this tab records (see profiling.StageTimings)
+    stage_scope = vops.VIDEO_STAGE_SCOPE
+
+    def __init__(self, console, crop_writer, crop_recorder):
         super().__init__()
         self.current_crop_rect_multiplier_step = CROP_RECT_STEP_MIN
 
         self.console = console
+        self.crop_writer = crop_writer
+        self.crop_recorder = crop_recorder
         self.input_path_entry = None
         self.output_path_entry = None
         self.extract_frames_button = None
@@ -44,6 +61,10 @@ class VideoTab(tk.Frame, RectangleMixin):
         self.ask_for_image_description_checkbox = None
         self.ask_for_classes_checkbox = None
         self.ask_for_tags_checkbox = None
+        self.progressive_preview_checkbox = None
+        self.encoder_profile_combobox = None
+        self.warn_duplicates_checkbox = None
+        self.duplicate_threshold_entry = None
 
         self.seek_backward_button = None
         self.play_button = None
@@ -56,9 +77,16 @@ class VideoTab(tk.Frame, RectangleMixin):
         self.video_length = None
         self.playing = False
         self.percentage = 0
-        self.cap = None
-        self.percentage = 0
-        self.cap = None
+        self.decoder = None
+        self.clock = None
+        self.playback_job = None
+        self.seek_job = None
+        self.seek_target = None
+        self.frame_buffer = None
+        self.stepped = False
+        self.frame_extractor = None
+        self.progress_update_time = 0.0
+        self.playback_stats_time = 0.0
 
         self.image_canvas = None
         self.image_container = None
@@ -79,6 +107,9 @@ class VideoTab(tk.Frame, RectangleMixin):
         self.scaled_image = None
         self.ratio = None
         self.crop_count = 0
+        self.current_frame_index = None
+        self.interim_preview = False
+        self.preview_upgrade_job = None
 
         self.init_data()
         self.init_ui()
@@ -168,8 +199,32 @@ class VideoTab(tk.Frame, RectangleMixin):
         )
         self.ask_for_tags_checkbox.grid(column=0, row=7, sticky="news")
 
+        self.progressive_preview_checkbox = ui.CheckBox(
+            "Progressive Preview", None, parameters_frame
+        )
+        self.progressive_preview_checkbox.grid(column=0, row=8, sticky="news")
+
+        self.encoder_profile_combobox = ui.LabelComboBox(
+            "Output Format", fops.ENCODER_PROFILES, parameters_frame
+        )
+        self.encoder_profile_combobox.grid(column=0, row=9, sticky="news")
+        self.encoder_profile_combobox.set_value(fops.DEFAULT_ENCODER_PROFILE)
+
+        self.warn_duplicates_checkbox = ui.CheckBox(
+            "Warn On Duplicate Crops", None, parameters_frame
+        )
+        self.warn_duplicates_checkbox.grid(column=0, row=10, sticky="news")
+        self.warn_duplicates_checkbox.set_value(1)
+
+        self.duplicate_threshold_entry = ui.LabelEntryInt(
+            "Skip Duplicate Frames (Bits, 0 = Off)", parameters_frame
+        )
+        self.duplicate_threshold_entry.grid(column=0, row=11, sticky="news")
+        self.duplicate_threshold_entry.set_value(DEFAULT_DUPLICATE_THRESHOLD)
+
         self.scale_output_checkbox.set_value(0)
         self.ask_for_class_name_checkbox.set_value(0)
+        self.progressive_preview_checkbox.set_value(1)
 
         image_frame = tk.LabelFrame(main_frame, text="Image")
         image_frame.rowconfigure(0, weight=1)
@@ -227,64 +282,69 @@ class VideoTab(tk.Frame, RectangleMixin):
         self.progress_bar.bind("<ButtonPress-1>", self.progress_bar_seek_callback)
 
     def seek_backward_button_callback(self):
-        if self.cap is None or self.video_length == 0:
+        if self.decoder is None or self.video_length == 0:
             return
 
-        self.cap.set(
-            cv2.CAP_PROP_POS_FRAMES,
-            int(((self.percentage - 5) / 100) * self.video_length),
-        )
-        self.percentage = int(
-            self.cap.get(cv2.CAP_PROP_POS_FRAMES) / self.video_length * 100
-        )
-        self.progress_bar.config(value=self.percentage)
+        self.seek_to_frame(int(((self.percentage - 5) / 100) * self.video_length))
 
     def play_button_callback(self):
-        if self.cap is None:
+        if self.decoder is None:
             if not self.input_path_entry.get_value():
                 messagebox.showerror(title="Error", message="No video file selected.")
                 return
             if not self.output_path_entry.get_value():
                 messagebox.showerror(title="Error", message="No output path given.")
                 return
-            self.cap = cv2.VideoCapture(self.input_path_entry.get_value())
-            self.video_length = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.frame_buffer = vops.FrameRingBuffer()
+            try:
+                self.decoder = vops.VideoDecoder(
+                    self.input_path_entry.get_value(), frame_buffer=self.frame_buffer
+                )
+            except OSError as exc:
+                self.frame_buffer = None
+                messagebox.showerror(title="Error", message=str(exc))
+                return
+            self.clock = vops.PlaybackClock(self.decoder)
+            self.video_length = self.decoder.frame_count
 
         self.play_video()
 
     def pause_button_callback(self):
-        self.playing = False
+        self.pause_video()
 
     def stop_button_callback(self):
-        self.playing = False
-        if self.cap is not None:
-            self.cap.release()
-            self.cap = None
+        self.close_video()
         self.percentage = 0
         self.progress_bar.config(value=0)
         self.image_canvas.delete("all")
         self.image_container = None
         self.rectangle_container = None
 
+    def close_video(self):
+        self.playing = False
+        if self.playback_job is not None:
+            self.after_cancel(self.playback_job)
+            self.playback_job = None
+        self.cancel_seek_job()
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
+            self.clock = None
+            self.frame_buffer.close()
+            self.frame_buffer = None
+            self.current_frame_index = None
+
     def seek_forward_button_callback(self):
-        if self.cap is None or self.video_length == 0:
+        if self.decoder is None or self.video_length == 0:
             return
 
-        self.cap.set(
-            cv2.CAP_PROP_POS_FRAMES,
-            int(((self.percentage + 5) / 100) * self.video_length),
-        )
-        self.percentage = int(
-            self.cap.get(cv2.CAP_PROP_POS_FRAMES) / self.video_length * 100
-        )
-        self.progress_bar.config(value=self.percentage)
+        self.seek_to_frame(int(((self.percentage + 5) / 100) * self.video_length))
 
     def progress_bar_seek_callback(self, event):
-        if self.cap is None or self.video_length == 0:
+        if self.decoder is None or self.video_length == 0:
             return
 
-        self.cap.set(
-            cv2.CAP_PROP_POS_FRAMES,
+        self.seek_to_frame(
             int(
                 (
                     self.progress_bar["maximum"]
@@ -293,43 +353,177 @@ class VideoTab(tk.Frame, RectangleMixin):
                 )
                 / 100
                 * self.video_length
-            ),
-        )
-        self.percentage = int(
-            self.cap.get(cv2.CAP_PROP_POS_FRAMES) / self.video_length * 100
+            )
         )
-        self.progress_bar.config(value=self.percentage)
+
+    def seek_to_frame(self, frame_index, decode_from=None):
+        """Seek to a frame, optionally decoding (and buffering) from an earlier one."""
+        self.decoder.seek(frame_index if decode_from is None else decode_from)
+        self.clock.reset()
+        self.stepped = False
+        self.update_progress_bar(frame_index, force=True)
+        if not self.playing:
+            self.seek_target = frame_index
+            self.cancel_seek_job()
+            self.show_seek_frame()
+
+    def show_seek_frame(self):
+        """While paused, show the frame a seek landed on once the decoder delivers it."""
+        self.seek_job = None
+        if self.playing or self.decoder is None:
+            return
+        try:
+            frame = self.decoder.next_frame()
+            while frame is not None and frame.index < self.seek_target:
+                frame = self.decoder.next_frame()
+        except EOFError:
+            return
+        if frame is None:
+            self.seek_job = self.after(SEEK_POLL_MS, self.show_seek_frame)
+            return
+
+        self.show_frame(frame)
+        if self.interim_preview:
+            self.schedule_preview_upgrade()
+
+    def cancel_seek_job(self):
+        if self.seek_job is not None:
+            self.after_cancel(self.seek_job)
+            self.seek_job = None
+
+    def update_progress_bar(self, position, force=False):
+        """Track the playback position, redrawing the progress bar at most every PROGRESS_UPDATE_S."""
+        self.percentage = int(position / self.video_length * 100)
+        now = time.perf_counter()
+        if force or now - self.progress_update_time >= PROGRESS_UPDATE_S:
+            self.progress_update_time = now
+            self.progress_bar.config(value=self.percentage)
 
     def play_video(self):
-        if self.cap is None:
+        if self.decoder is None or self.playing:
             return
 
         self.playing = True
+        self.cancel_seek_job()
+        if self.stepped:
+            # Frames stepped to came from the buffer; resume decoding after them
+            self.decoder.seek(self.current_frame_index + 1)
+            self.clock.reset()
+            self.stepped = False
+        self.decoder.set_preview_size(
+            (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+            fast=self.progressive_preview_checkbox.get_value(),
+        )
+        self.clock.start()
+        self.playback_stats_time = time.perf_counter()
 
         self.display_frame()
 
     def display_frame(self):
-        ret, frame = self.cap.read()
+        """Show the frame due on the playback clock and schedule the next one."""
+        self.playback_job = None
+        if not self.playing:
+            return
 
-        if not ret:
+        try:
+            frame, delay = self.clock.poll()
+        except EOFError:
             self.stop_button_callback()
             return
 
+        if frame is not None:
+            self.show_frame(frame)
+            self.report_playback_stats()
+
+        self.playback_job = self.after(max(1, int(delay * 1000)), self.display_frame)
+
+    def show_frame(self, frame):
+        self.current_frame_index = frame.index
+
         if self.video_length > 0:
-            self.percentage = int(
-                self.cap.get(cv2.CAP_PROP_POS_FRAMES) / self.video_length * 100
+            self.update_progress_bar(frame.index + 1)
+
+        self.raw_image = frame.image
+        self.ratio = iops.fit_ratio(
+            self.raw_image.size,
+            (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+        )
+        if frame.preview is not None and frame.ratio == self.ratio:
+            self.scaled_image = frame.preview
+            self.interim_preview = bool(self.progressive_preview_checkbox.get_value())
+        elif self.progressive_preview_checkbox.get_value():
+            with profiling.stage("scale", self.stage_scope):
+                self.scaled_image = iops.fast_scale_image(self.raw_image, self.ratio)
+            self.interim_preview = True
+        else:
+            with profiling.stage("scale", self.stage_scope):
+                self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
+            self.interim_preview = False
+        self.show_scaled_image()
+
+    def step_frame(self, step):
+        """Pause and move by a number of frames, from the frame buffer when possible."""
+        if self.decoder is None or self.current_frame_index is None:
+            return
+        if self.playing:
+            self.pause_video()
+
+        target = max(0, min(self.current_frame_index + step, self.video_length - 1))
+        frame = self.frame_buffer.get(target)
+        if frame is None:
+            # Decode a window before the target so further steps back are buffered
+            decode_from = max(0, target - STEP_BACK_WINDOW) if step < 0 else target
+            self.seek_to_frame(target, decode_from)
+            return
+
+        self.cancel_seek_job()
+        self.stepped = True
+        self.show_frame(
+            vops.VideoFrame(
+                target, self.decoder.timestamp(target), Image.fromarray(frame), None, None
             )
-            self.progress_bar.config(value=self.percentage)
+        )
+        self.update_progress_bar(target + 1, force=True)
+        if self.interim_preview:
+            self.schedule_preview_upgrade()
+
+    def step_forward_callback(self, event):
+        self.step_frame(1)
 
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def step_backward_callback(self, event):
+        self.step_frame(-1)
 
-        self.raw_image = Image.fromarray(frame)
-        self.ratio = min(
-            self.image_canvas.winfo_width() / self.raw_image.width,
-            self.image_canvas.winfo_height() / self.raw_image.height,
+    def report_playback_stats(self):
+        now = time.perf_counter()
+        if now - self.playback_stats_time < PLAYBACK_STATS_S:
+            return
+        self.playback_stats_time = now
+        fps, dropped = self.clock.pop_stats()
+        self.console.write_info(
+            f"Playback {fps:.1f} of {self.decoder.fps:.1f} fps, {dropped} late frame(s) dropped."
+        )
+
+    def schedule_preview_upgrade(self):
+        if self.preview_upgrade_job is not None:
+            self.after_cancel(self.preview_upgrade_job)
+        self.preview_upgrade_job = self.after(
+            PREVIEW_UPGRADE_DELAY_MS, self.upgrade_preview
         )
-        self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
-        self.current_image = ImageTk.PhotoImage(self.scaled_image)
+
+    def upgrade_preview(self):
+        """Replace the interim preview of a paused frame with a LANCZOS scaled one."""
+        self.preview_upgrade_job = None
+        if not self.interim_preview or self.playing or self.raw_image is None:
+            return
+
+        with profiling.stage("scale", self.stage_scope):
+            self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
+        self.interim_preview = False
+        self.show_scaled_image()
+
+    def show_scaled_image(self):
+        with profiling.stage("photoimage", self.stage_scope):
+            self.current_image = ImageTk.PhotoImage(self.scaled_image)
 
         canvas_center_x = self.image_canvas.winfo_width() / 2
         canvas_center_y = self.image_canvas.winfo_height() / 2
@@ -355,12 +549,48 @@ class VideoTab(tk.Frame, RectangleMixin):
         self.image_canvas.tag_raise(self.rectangle_container)
         self.move_rectangle()
 
+    def window_reconfigure(self, final=True):
+        """Re-render a paused frame after a window resize.
+
+        While playing, the decoder is told the new canvas size and the next
+        frames pick it up.
+        """
+        if self.decoder is None:
+            return
         if self.playing:
-            self.after(1, self.display_frame)
+            self.decoder.set_preview_size(
+                (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+                fast=self.progressive_preview_checkbox.get_value(),
+            )
+            return
+        if self.raw_image is None:
+            return
+        try:
+            ratio = iops.fit_ratio(
+                self.raw_image.size,
+                (self.image_canvas.winfo_width(), self.image_canvas.winfo_height()),
+            )
+            if final:
+                self.ratio = ratio
+                with profiling.stage("scale", self.stage_scope):
+                    self.scaled_image = iops.scale_image(self.raw_image, self.ratio)
+                self.interim_preview = False
+                self.show_scaled_image()
+            elif ratio != self.ratio:
+                self.ratio = ratio
+                self.scaled_image = iops.resize_preview(
+                    self.scaled_image, iops.scaled_size(self.raw_image.size, ratio)
+                )
+                self.show_scaled_image()
+        except tk.TclError:
+            pass  # Canvas not ready or destroyed
 
     def pause_video(self):
         self.playing = False
-        self.current_frame = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if self.playback_job is not None:
+            self.after_cancel(self.playback_job)
+            self.playback_job = None
+        self.schedule_preview_upgrade()
 
     def scale_output_checkbox_callback(self, value):
         if value == 1:
@@ -399,6 +629,11 @@ class VideoTab(tk.Frame, RectangleMixin):
             return
 
     def extract_frames_callback(self):
+        if self.frame_extractor is not None:
+            self.frame_extractor.cancel()
+            self.console.write_info("Cancelling frame extraction...")
+            return
+
         if not self.input_path_entry.get_value():
             messagebox.showerror(title="Error", message="No video file selected.")
             return
@@ -410,33 +645,86 @@ class VideoTab(tk.Frame, RectangleMixin):
                 messagebox.showerror(title="Error", message="Path not valid.")
                 return
 
-            cap = cv2.VideoCapture(self.input_path_entry.get_value())
-            video_fps = round(cap.get(cv2.CAP_PROP_FPS))
-            target_fps = askinteger(
-                "FPS", "What FPS to extract? (Video FPS: " + str(video_fps) + ")"
+            video_path = self.input_path_entry.get_value()
+            cap = cv2.VideoCapture(video_path)
+            video_fps = cap.get(cv2.CAP_PROP_FPS) or vops.FALLBACK_FPS
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+
+            spec_text = askstring(
+                "Sampling",
+                f"What to extract? (Video FPS: {round(video_fps)})\n"
+                "FPS like '2' or '2fps' (0 for all frames), 'every 1.5s', 'every 10' (frames),\n"
+                "'at 0:05, 1:30' (timestamps), 'from 1:00 to 2:00' (range), combined with ';'.\n"
+                "Add 'scenes' and/or 'motion' (or 'flow') to keep only scene cuts and moving\n"
+                "frames of those, 'max 2fps' to cap them, 'phash' to skip duplicates by DCT hash.",
             )
+            if spec_text is None:
+                return
+            try:
+                spec = vops.parse_sampling_spec(spec_text)
+            except ValueError as exc:
+                messagebox.showerror(title="Error", message=f"Invalid sampling: {exc}")
+                return
 
-            if target_fps == 0:
-                target_fps = video_fps
+            output_size = None
+            if self.scale_output_checkbox.get_value():
+                output_size = (
+                    self.output_width_entry.get_value(),
+                    self.output_height_entry.get_value(),
+                )
 
-            hop = round(video_fps / target_fps)
-            current_frame = 0
+            selector = vops.make_frame_selector(
+                spec, video_fps, self.duplicate_threshold_entry.get_value()
+            )
 
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                if current_frame % hop == 0:
-                    target_file = os.path.join(path, f"{current_frame}.png")
-                    cv2.imwrite(target_file, frame)
-                    self.console.write_info(
-                        "Extracted frame " + str(current_frame) + "."
-                    )
-                current_frame += 1
+            self.frame_extractor = vops.FrameExtractor(
+                video_path,
+                spec,
+                path,
+                frame_count,
+                video_fps,
+                output_size,
+                self._get_encoder_profile(),
+                selector=selector,
+            )
+            self.extract_frames_button.config(text="Cancel Extraction")
+            self.console.write_info("Planning frames to extract...")
+            self.after(EXTRACT_POLL_MS, self.poll_frame_extractor)
+
+    def poll_frame_extractor(self):
+        extractor = self.frame_extractor
+        written, finished = extractor.poll()
+        if not finished:
+            if written:
+                self.console.write_info(
+                    f"Extracted frame {written[-1]} ({extractor.done} of {extractor.total})."
+                )
+            self.after(EXTRACT_POLL_MS, self.poll_frame_extractor)
+            return
 
-            cap.release()
+        self.frame_extractor = None
+        self.extract_frames_button.config(text="Extract Frames")
+        if extractor.errors:
+            self.console.write_error(
+                f"Frame extraction failed after {extractor.done} frame(s): {extractor.errors[0]}"
+            )
+        elif extractor.cancelled:
+            self.console.write_info(
+                f"Frame extraction cancelled after {extractor.done} of {extractor.total} frame(s)."
+            )
+        elif extractor.skipped:
+            self.console.write_info(
+                f"Frame extraction complete, {extractor.skipped} frame(s) skipped."
+            )
+        else:
             self.console.write_info("Frame extraction complete.")
 
+    def close_frame_extractor(self):
+        if self.frame_extractor is not None:
+            self.frame_extractor.close()
+            self.frame_extractor = None
+
     def space_button_callback(self, event):
         if self.playing:
             self.pause_video()
@@ -465,12 +753,16 @@ class VideoTab(tk.Frame, RectangleMixin):
         self.bind_all("<Button-4>", self.canvas_mousewheel)
         self.bind_all("<Button-5>", self.canvas_mousewheel)
         self.bind_all("<space>", self.space_button_callback)
+        self.bind_all("<Right>", self.step_forward_callback)
+        self.bind_all("<Left>", self.step_backward_callback)
 
     def on_canvas_leave(self, event):
         self.unbind_all("<MouseWheel>")
         self.unbind_all("<Button-4>")
         self.unbind_all("<Button-5>")
         self.unbind_all("<space>")
+        self.unbind_all("<Right>")
+        self.unbind_all("<Left>")
 
     def canvas_mousewheel(self, event):
         if self.current_image is not None:
@@ -505,7 +797,7 @@ class VideoTab(tk.Frame, RectangleMixin):
         if not self.output_path_entry.get_value():
             messagebox.showerror(title="Error", message="No output path given.")
             return False
-        if self.cap is None:
+        if self.decoder is None:
             messagebox.showerror(title="Error", message="No video.")
             return False
         return True
@@ -532,6 +824,16 @@ class VideoTab(tk.Frame, RectangleMixin):
             return self.attribute_selector.ask_attributes()
         return None
 
+    def _get_output_root(self) -> str:
+        """Get the output folder, resolved against the input path if needed."""
+        return fops.resolve_output_path(
+            self.output_path_entry.get_value(), self.input_path_entry.get_value()
+        )
+
+    def _get_encoder_profile(self) -> fops.EncoderProfile:
+        """Get the encoder profile selected for crops."""
+        return fops.get_encoder_profile(self.encoder_profile_combobox.get_value())
+
     def _build_output_paths(self, class_name: Optional[str]) -> Tuple[str, str]:
         """Build output file paths for image and description.
 
@@ -541,23 +843,16 @@ class VideoTab(tk.Frame, RectangleMixin):
         Returns:
             Tuple of (image_path, description_path)
         """
-        base_name = os.path.basename(self.input_path_entry.get_value()).split(".")[0]
-        output_image_name = f"{base_name}_{self.crop_count}.png"
-        output_description_name = f"{base_name}_{self.crop_count}.txt"
-
-        output_path = self.output_path_entry.get_value()
-        if not fops.check_path_valid(output_path):
-            output_path = os.path.join(self.input_path_entry.get_value(), output_path)
-
+        base_name = os.path.splitext(os.path.basename(self.input_path_entry.get_value()))[0]
+        folder = self._get_output_root()
         if class_name is not None:
-            return (
-                os.path.join(output_path, class_name, output_image_name),
-                os.path.join(output_path, class_name, output_description_name),
-            )
-        return (
-            os.path.join(output_path, output_image_name),
-            os.path.join(output_path, output_description_name),
+            folder = os.path.join(folder, class_name)
+
+        # Skip indices taken by earlier sessions, whose crop count started at 0 too
+        self.crop_count, image_path, description_path = fops.next_free_crop_paths(
+            folder, base_name, self.crop_count, self._get_encoder_profile().extension
         )
+        return image_path, description_path
 
     def canvas_mouseclick(self, event):
         if not self._validate_crop_inputs():
@@ -568,24 +863,47 @@ class VideoTab(tk.Frame, RectangleMixin):
         class_name = self._get_class_name()
         image_description = self._get_image_description()
 
-        cropped_image = self.get_image_inside_rectangle()
+        output_size = None
         if self.scale_output_checkbox.get_value():
-            cropped_image = iops.resize_image(
-                cropped_image,
-                height=self.output_height_entry.get_value(),
-                width=self.output_width_entry.get_value(),
+            output_size = (
+                self.output_width_entry.get_value(),
+                self.output_height_entry.get_value(),
             )
 
         image_path, description_path = self._build_output_paths(class_name)
-
-        fops.save_image_to_file(cropped_image, filepath=image_path)
-        fops.save_image_description_to_file(
-            image_description, filepath=description_path
+        box = self.get_rectangle_box()
+
+        with profiling.stage("crop", self.stage_scope):
+            cropped_image = iops.crop_image(self.raw_image, self.ratio, box)
+        entry = {
+            "source": self.input_path_entry.get_value(),
+            "frame": self.current_frame_index,
+            "box": iops.scale_box(box, self.ratio),
+            "output_size": output_size,
+            "class_name": class_name,
+            "description": image_description,
+            "encoder": self._get_encoder_profile().name,
+        }
+        self.crop_writer.submit(
+            fops.CropJob(
+                cropped_image,
+                image_path,
+                image_description,
+                description_path,
+                output_size,
+                self._get_encoder_profile(),
+                self.crop_recorder.on_written(
+                    self._get_output_root(), entry, self.warn_duplicates_checkbox.get_value()
+                ),
+            )
+        )
+        self.console.write_info(
+            f"Queued {image_path} ({self.crop_writer.pending()} pending)."
         )
-        self.console.write_info("Image saved to: " + image_path)
         self.crop_count += 1
 
-    def get_image_inside_rectangle(self):
+    def get_rectangle_box(self):
+        """Return the crop rectangle in scaled frame coordinates."""
         box_rel_tl_x = self.current_rect_left - (
             (self.current_canvas_size_x - self.scaled_image.width) / 2
         )
@@ -594,10 +912,9 @@ class VideoTab(tk.Frame, RectangleMixin):
         )
         box_rel_bl_x = box_rel_tl_x + (self.current_rect_right - self.current_rect_left)
         box_rel_bl_y = box_rel_tl_y + (
-            self.current_rect_upper - self.current_rect_lower
-        )
-        return iops.crop_image(
-            self.raw_image,
-            self.ratio,
-            (box_rel_tl_x, box_rel_tl_y, box_rel_bl_x, box_rel_bl_y),
+            self.current_rect_lower - self.current_rect_upper
         )
+        return box_rel_tl_x, box_rel_tl_y, box_rel_bl_x, box_rel_bl_y
+
+    def get_image_inside_rectangle(self):
+        return iops.crop_image(self.raw_image, self.ratio, self.get_rectangle_box())
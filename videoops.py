@@ -0,0 +1,1114 @@
+"""Video decoding, indexing and playback timing."""
+
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import fileops as fops
+import imageops as iops
+import profiling
+
+DEFAULT_FRAME_QUEUE_SIZE = 8
+FALLBACK_FPS = 25.0
+QUEUE_PUT_TIMEOUT_S = 0.1
+LATE_FRAME_RETRY_S = 0.005
+INDEX_WAIT_POLL_S = 0.1
+VIDEO_INDEX_VERSION = 1
+SEEK_DECODE_BUDGET = 300
+DEFAULT_EXTRACT_ENCODERS = 2
+DEFAULT_FRAME_BUFFER_BYTES = 512 * 1024 * 1024
+DEFAULT_DUPLICATE_HISTORY = 8
+DEFAULT_SCENE_THRESHOLD = 0.4
+DEFAULT_MOTION_THRESHOLD = 0.5
+SIGNAL_WIDTH = 160
+SIGNAL_HISTOGRAM_BINS = 32
+# Stage timings scope of decoding for playback (see profiling.StageTimings)
+VIDEO_STAGE_SCOPE = "video"
+
+# Per index file, so that the decoder and an extraction never build one index twice
+_index_locks = {}
+_index_locks_lock = threading.Lock()
+
+
+class VideoFrame(NamedTuple):
+    index: int
+    timestamp: float
+    image: Image.Image
+    preview: Optional[Image.Image]
+    ratio: Optional[float]
+
+
+class SamplingSpec(NamedTuple):
+    """Which frames of a video to extract.
+
+    every_frames and every_seconds sample at a fixed interval, restricted to
+    ranges (start, end) in seconds when given. timestamps adds single frames.
+    With neither an interval nor timestamps, every frame (of the ranges) is
+    sampled.
+
+    scene_threshold and motion_threshold turn the sampled frames into
+    candidates for a MotionSampler (see make_frame_selector), which keeps scene
+    cuts and frames after enough accumulated motion, at most max_fps per second.
+
+    duplicate_hash is the frame_hash method DuplicateFilter compares frames by.
+    """
+
+    every_frames: Optional[int] = None
+    every_seconds: Optional[float] = None
+    timestamps: Tuple[float, ...] = ()
+    ranges: Tuple[Tuple[float, float], ...] = ()
+    scene_threshold: Optional[float] = None
+    motion_threshold: Optional[float] = None
+    optical_flow: bool = False
+    max_fps: Optional[float] = None
+    duplicate_hash: str = "dhash"
+
+
+class VideoIndex:
+    """Presentation timestamps of every frame of a video and its keyframe positions.
+
+    keyframes is None when the OpenCV build cannot report them.
+    """
+
+    def __init__(self, timestamps: np.ndarray, keyframes: Optional[np.ndarray] = None):
+        self.timestamps = timestamps
+        self.keyframes = keyframes
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def timestamp(self, frame_index: int) -> float:
+        """Return the timestamp in seconds of a frame."""
+        return float(self.timestamps[min(max(frame_index, 0), len(self.timestamps) - 1)])
+
+    def frame_at(self, timestamp: float) -> int:
+        """Return the frame whose timestamp is closest to a time in seconds."""
+        index = int(np.searchsorted(self.timestamps, timestamp))
+        if index >= len(self.timestamps):
+            return len(self.timestamps) - 1
+        if index > 0 and timestamp - self.timestamps[index - 1] < self.timestamps[index] - timestamp:
+            return index - 1
+        return index
+
+    def keyframe_before(self, frame_index: int) -> Optional[int]:
+        """Return the last keyframe at or before a frame, or None if unknown."""
+        if self.keyframes is None or len(self.keyframes) == 0:
+            return None
+        position = int(np.searchsorted(self.keyframes, frame_index, side="right"))
+        return int(self.keyframes[position - 1]) if position > 0 else None
+
+    def save(self, path: str) -> None:
+        keyframes = self.keyframes if self.keyframes is not None else np.empty(0, dtype=np.int64)
+        fops.atomic_write(
+            path,
+            lambda f: np.savez(
+                f,
+                version=VIDEO_INDEX_VERSION,
+                timestamps=self.timestamps,
+                keyframes=keyframes,
+                has_keyframes=self.keyframes is not None,
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["VideoIndex"]:
+        """Load a saved index, or return None if it is missing or of another version."""
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != VIDEO_INDEX_VERSION:
+                    return None
+                keyframes = data["keyframes"] if bool(data["has_keyframes"]) else None
+                return cls(data["timestamps"], keyframes)
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def video_index_path(path: str) -> str:
+    """Return the cache file of a video's index, keyed by path, size and modification time.
+
+    Raises:
+        OSError: If the video cannot be stat'ed
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npz"
+    return os.path.join(fops.get_cache_folder("video-index"), name)
+
+
+def build_video_index(path: str, cancelled: Optional[threading.Event] = None) -> Optional[VideoIndex]:
+    """Index a video by reading its packets.
+
+    Where OpenCV can hand out raw packets, this only demuxes the file and also
+    records keyframes; otherwise every frame is grabbed (decoded, not converted).
+
+    Returns:
+        The index, or None if cancelled or the video cannot be read
+    """
+    raw = hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME")
+    cap = None
+    if raw:
+        cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        if not cap.isOpened():
+            cap.release()
+            raw = False
+    if not raw:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            cap.release()
+            return None
+
+    timestamps = []
+    keyframes = []
+    try:
+        while cap.grab():
+            if cancelled is not None and cancelled.is_set():
+                return None
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+            if raw:
+                keyframes.append(bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+    finally:
+        cap.release()
+
+    if not timestamps:
+        return None
+
+    # Packets come in decode order; frames are numbered in presentation order
+    order = np.argsort(np.asarray(timestamps, dtype=np.float64), kind="stable")
+    sorted_timestamps = np.asarray(timestamps, dtype=np.float64)[order]
+    if not raw:
+        return VideoIndex(sorted_timestamps)
+    return VideoIndex(sorted_timestamps, np.flatnonzero(np.asarray(keyframes)[order]))
+
+
+def get_video_index(path: str, cancelled: Optional[threading.Event] = None) -> Optional[VideoIndex]:
+    """Load the cached index of a video, building and caching it if needed.
+
+    Threads asking for the same video at once build its index only once: the
+    others wait for it, checking cancelled while they do.
+
+    Returns:
+        The index, or None if cancelled or the video cannot be read
+    """
+    try:
+        index_path = video_index_path(path)
+    except OSError:
+        return None
+
+    with _index_locks_lock:
+        lock = _index_locks.setdefault(index_path, threading.Lock())
+    while not lock.acquire(timeout=INDEX_WAIT_POLL_S):
+        if cancelled is not None and cancelled.is_set():
+            return None
+    try:
+        index = VideoIndex.load(index_path)
+        if index is None:
+            index = build_video_index(path, cancelled)
+            if index is not None:
+                try:
+                    index.save(index_path)
+                except OSError:
+                    pass  # The index still serves this session
+        return index
+    finally:
+        lock.release()
+
+
+def parse_time(text: str) -> float:
+    """Parse seconds given as SS, MM:SS or HH:MM:SS, with optional decimals.
+
+    Raises:
+        ValueError: If the text is not a time
+    """
+    seconds = 0.0
+    for part in text.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Negative time: {text}")
+    return seconds
+
+
+def parse_sampling_spec(text: str) -> SamplingSpec:
+    """Parse a sampling specification made of ';' separated parts.
+
+    Parts are "N" or "Nfps" (N frames per second, 0 for every frame),
+    "every Xs" (every X seconds), "every N" (every N-th frame),
+    "at T1, T2, ..." (single timestamps) and "from T1 to T2" (time range).
+    Times use the parse_time format, e.g. "1fps; from 1:30 to 2:00".
+
+    "scenes [X]" keeps scene cuts, "motion [X]" keeps frames once motion has
+    accumulated (optional thresholds, see MotionSampler), "flow" measures
+    motion with optical flow and "max Nfps" caps the kept frames per second,
+    e.g. "scenes; motion 0.3; max 2fps". "phash" compares frames for
+    duplicates by DCT instead of difference hash.
+
+    Raises:
+        ValueError: If a part cannot be parsed
+    """
+    every_frames = None
+    every_seconds = None
+    timestamps = []
+    ranges = []
+    scene_threshold = None
+    motion_threshold = None
+    optical_flow = False
+    max_fps = None
+    duplicate_hash = "dhash"
+    for part in text.lower().split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        keyword, _, value = part.partition(" ")
+        value = value.strip()
+        if keyword == "scenes":
+            scene_threshold = float(value) if value else DEFAULT_SCENE_THRESHOLD
+        elif keyword == "motion":
+            motion_threshold = float(value) if value else DEFAULT_MOTION_THRESHOLD
+        elif keyword == "flow":
+            optical_flow = True
+            if motion_threshold is None:
+                motion_threshold = DEFAULT_MOTION_THRESHOLD
+        elif keyword == "phash":
+            duplicate_hash = "phash"
+        elif keyword == "max":
+            max_fps = float(value[:-3] if value.endswith("fps") else value)
+        elif part.startswith("every "):
+            value = part[len("every "):].strip()
+            if value.endswith("s"):
+                every_seconds = float(value[:-1])
+            else:
+                every_frames = int(value.rstrip("f").strip())
+        elif part.startswith("at "):
+            timestamps.extend(parse_time(value) for value in part[len("at "):].split(","))
+        elif part.startswith("from ") and " to " in part:
+            start, end = part[len("from "):].split(" to ", 1)
+            ranges.append((parse_time(start), parse_time(end)))
+        else:
+            fps = float(part[:-3] if part.endswith("fps") else part)
+            if fps > 0:
+                every_seconds = 1 / fps
+    if every_frames is not None and every_frames <= 0:
+        raise ValueError("Frame interval must be positive")
+    if every_seconds is not None and every_seconds <= 0:
+        raise ValueError("Time interval must be positive")
+    if max_fps is not None and max_fps <= 0:
+        raise ValueError("Frame rate cap must be positive")
+    return SamplingSpec(
+        every_frames,
+        every_seconds,
+        tuple(timestamps),
+        tuple(ranges),
+        scene_threshold,
+        motion_threshold,
+        optical_flow,
+        max_fps,
+        duplicate_hash,
+    )
+
+
+def plan_frames(
+    spec: SamplingSpec, frame_count: int, fps: float, index: Optional[VideoIndex] = None
+) -> List[int]:
+    """Turn a sampling specification into a sorted list of frame numbers.
+
+    Times are mapped to frames through the index when given, else through fps.
+    """
+    if index is not None:
+        frame_count = len(index)
+        duration = index.timestamp(frame_count - 1)
+
+        def to_frame(seconds):
+            return index.frame_at(seconds)
+    else:
+        duration = (frame_count - 1) / fps
+
+        def to_frame(seconds):
+            return min(frame_count - 1, int(round(seconds * fps)))
+
+    frames = set(to_frame(timestamp) for timestamp in spec.timestamps)
+    interval = spec.every_frames is not None or spec.every_seconds is not None
+    if interval or spec.ranges or not spec.timestamps:
+        for start, end in spec.ranges or ((0.0, duration),):
+            end = min(end, duration)
+            if spec.every_seconds is not None:
+                steps = int((end - start) / spec.every_seconds) + 1
+                frames.update(to_frame(start + step * spec.every_seconds) for step in range(max(0, steps)))
+            else:
+                frames.update(range(to_frame(start), to_frame(end) + 1, spec.every_frames or 1))
+    return sorted(frame for frame in frames if 0 <= frame < frame_count)
+
+
+def read_frames(
+    path: str,
+    frames: List[int],
+    index: Optional[VideoIndex] = None,
+    cancelled: Optional[threading.Event] = None,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """Decode only the given frames of a video, in order.
+
+    Frames between two requested ones are grabbed without being converted; the
+    capture seeks instead when a keyframe lies in between, or without keyframe
+    information when the gap exceeds SEEK_DECODE_BUDGET. Nothing after the
+    last requested frame is read.
+
+    Yields:
+        Tuples of (frame number, BGR frame)
+
+    Raises:
+        OSError: If the video cannot be opened
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        cap.release()
+        raise OSError(f"Could not open video file {path}")
+
+    position = 0
+    try:
+        for target in frames:
+            if cancelled is not None and cancelled.is_set():
+                return
+            keyframe = index.keyframe_before(target) if index is not None else None
+            if keyframe is not None:
+                if target < position or keyframe > position:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+                    position = keyframe
+            elif target < position or target - position > SEEK_DECODE_BUDGET:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+
+            while True:
+                if not cap.grab():
+                    return
+                if index is not None:
+                    current = index.frame_at(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                else:
+                    current = position
+                position = current + 1
+                if current >= target:
+                    break
+
+            ret, frame = cap.retrieve()
+            if ret:
+                yield current, frame
+    finally:
+        cap.release()
+
+
+def fit_frame(frame: np.ndarray, output_size: Tuple[Optional[int], Optional[int]]) -> np.ndarray:
+    """Downscale a frame to fit inside (width, height), keeping its aspect ratio.
+
+    Either dimension may be None; frames are never enlarged.
+    """
+    height, width = frame.shape[:2]
+    ratios = [
+        limit / size for limit, size in zip(output_size, (width, height)) if limit is not None
+    ]
+    ratio = min(ratios, default=1.0)
+    if ratio >= 1.0:
+        return frame
+    size = iops.scaled_size((width, height), ratio)
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def opencv_write_params(profile: fops.EncoderProfile) -> List[int]:
+    """Translate an encoder profile to cv2.imwrite parameters."""
+    if profile.format == "PNG":
+        return [cv2.IMWRITE_PNG_COMPRESSION, profile.options.get("compress_level", 6)]
+    if profile.format == "JPEG":
+        return [cv2.IMWRITE_JPEG_QUALITY, profile.options.get("quality", 95)]
+    if profile.format == "WEBP":
+        # OpenCV writes lossless WebP for qualities above 100
+        quality = 101 if profile.options.get("lossless") else profile.options.get("quality", 90)
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return []
+
+
+def write_frame(frame: np.ndarray, filepath: str, params: List[int] = ()) -> None:
+    """Encode and write a BGR frame.
+
+    Raises:
+        OSError: If OpenCV could not write the file
+    """
+    if not cv2.imwrite(filepath, frame, list(params)):
+        raise OSError(f"Could not write {filepath}")
+
+
+def frame_hash(frame: np.ndarray, method: str = "dhash") -> int:
+    """Compute the dhash or phash of a BGR frame on a downscaled grayscale copy."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if method == "phash":
+        size = iops.HASH_SIZE * iops.PHASH_HIGHFREQ_FACTOR
+        small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+        return iops.phash_array(small.astype(np.float64))
+    small = cv2.resize(gray, (iops.HASH_SIZE + 1, iops.HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return iops.dhash_array(small.astype(np.int16))
+
+
+class DuplicateFilter:
+    """Frame selector dropping frames that nearly duplicate a recently kept one.
+
+    A frame is a duplicate when the Hamming distance of its perceptual hash to
+    one of the last history kept frames is at most threshold (of 64 bits).
+    """
+
+    def __init__(self, threshold: int, history: int = DEFAULT_DUPLICATE_HISTORY, method: str = "dhash"):
+        self.threshold = threshold
+        self.method = method
+        self._kept_hashes = deque(maxlen=history)
+
+    def keep(self, frame_index: int, frame: np.ndarray) -> bool:
+        """Return whether to keep a frame, remembering it if so."""
+        frame_hash_value = frame_hash(frame, self.method)
+        for kept_hash in self._kept_hashes:
+            if iops.hamming_distance(frame_hash_value, kept_hash) <= self.threshold:
+                return False
+        self._kept_hashes.append(frame_hash_value)
+        return True
+
+
+class MotionSampler:
+    """Frame selector keeping scene cuts and frames after enough motion.
+
+    Signals are computed on a SIGNAL_WIDTH wide grayscale copy of each frame
+    against the previous candidate: the Bhattacharyya distance of the
+    histograms (0 to 1) detects cuts, and the mean absolute difference as a
+    fraction of full scale, or with optical_flow the mean Farneback flow
+    magnitude as a fraction of the width, accumulates as motion. A frame is
+    kept at a cut or once accumulated motion reaches motion_threshold, but
+    never sooner than 1 / max_fps seconds after the last kept frame.
+    """
+
+    def __init__(
+        self,
+        fps: float,
+        scene_threshold: Optional[float] = DEFAULT_SCENE_THRESHOLD,
+        motion_threshold: Optional[float] = DEFAULT_MOTION_THRESHOLD,
+        optical_flow: bool = False,
+        max_fps: Optional[float] = None,
+    ):
+        self.fps = fps
+        self.scene_threshold = scene_threshold
+        self.motion_threshold = motion_threshold
+        self.optical_flow = optical_flow
+        self.min_interval = 1 / max_fps if max_fps else 0.0
+        self._previous_gray = None
+        self._previous_histogram = None
+        self._motion = 0.0
+        self._last_kept_time = None
+
+    def keep(self, frame_index: int, frame: np.ndarray) -> bool:
+        """Return whether to keep a frame; every frame updates the signals."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        signal_size = (SIGNAL_WIDTH, max(1, height * SIGNAL_WIDTH // width))
+        gray = cv2.resize(gray, signal_size, interpolation=cv2.INTER_AREA)
+        histogram = cv2.calcHist([gray], [0], None, [SIGNAL_HISTOGRAM_BINS], [0, 256])
+        cv2.normalize(histogram, histogram)
+
+        previous_gray = self._previous_gray
+        previous_histogram = self._previous_histogram
+        self._previous_gray = gray
+        self._previous_histogram = histogram
+
+        scene_cut = False
+        if previous_gray is None:
+            scene_cut = True
+        else:
+            if self.scene_threshold is not None:
+                distance = cv2.compareHist(previous_histogram, histogram, cv2.HISTCMP_BHATTACHARYYA)
+                scene_cut = distance >= self.scene_threshold
+            if self.motion_threshold is not None:
+                self._motion += self._motion_between(previous_gray, gray)
+
+        moved = self.motion_threshold is not None and self._motion >= self.motion_threshold
+        if not (scene_cut or moved):
+            return False
+
+        timestamp = frame_index / self.fps
+        if self._last_kept_time is not None and timestamp - self._last_kept_time < self.min_interval:
+            return False
+        self._last_kept_time = timestamp
+        self._motion = 0.0
+        return True
+
+    def _motion_between(self, previous_gray: np.ndarray, gray: np.ndarray) -> float:
+        if self.optical_flow:
+            flow = cv2.calcOpticalFlowFarneback(previous_gray, gray, None, 0.5, 2, 9, 2, 5, 1.1, 0)
+            return float(np.mean(np.hypot(flow[..., 0], flow[..., 1]))) / gray.shape[1]
+        return float(cv2.absdiff(previous_gray, gray).mean()) / 255
+
+
+class SelectorChain:
+    """Frame selector keeping frames every one of its selectors keeps, asked in order."""
+
+    def __init__(self, selectors: List):
+        self.selectors = selectors
+
+    def keep(self, frame_index: int, frame: np.ndarray) -> bool:
+        return all(selector.keep(frame_index, frame) for selector in self.selectors)
+
+
+def make_frame_selector(spec: SamplingSpec, fps: float, duplicate_threshold: int = 0):
+    """Build the frame selector for a sampling specification and duplicate threshold, or None."""
+    selectors = []
+    if spec.scene_threshold is not None or spec.motion_threshold is not None:
+        selectors.append(
+            MotionSampler(fps, spec.scene_threshold, spec.motion_threshold, spec.optical_flow, spec.max_fps)
+        )
+    if duplicate_threshold > 0:
+        selectors.append(DuplicateFilter(duplicate_threshold, method=spec.duplicate_hash))
+    if not selectors:
+        return None
+    return selectors[0] if len(selectors) == 1 else SelectorChain(selectors)
+
+
+def split_segments(frames: List[int], segments: int) -> List[List[int]]:
+    """Split a sorted frame list into up to a number of contiguous, similarly sized segments."""
+    segments = max(1, min(segments, len(frames)))
+    size, remainder = divmod(len(frames), segments)
+    result = []
+    start = 0
+    for segment in range(segments):
+        end = start + size + (1 if segment < remainder else 0)
+        result.append(frames[start:end])
+        start = end
+    return [segment for segment in result if segment]
+
+
+def extract_segment(
+    path: str,
+    frames: List[int],
+    output_folder: str,
+    index: Optional[VideoIndex],
+    output_size: Optional[Tuple[Optional[int], Optional[int]]],
+    profile: fops.EncoderProfile,
+    encoders: int,
+    progress,
+    cancelled,
+    selector=None,
+) -> int:
+    """Extract the frames of one segment, decoding here and encoding on a thread pool.
+
+    Runs in a worker process with its own capture. Decoded frames are offered
+    to the selector's keep(frame_index, frame) when given, and only kept frames
+    are encoded. Every frame is reported on the progress queue as a tuple of
+    (frame number, whether it was written); cancelled is checked between frames.
+
+    Returns:
+        Number of frames written
+    """
+    written = 0
+    pending = deque()
+    params = opencv_write_params(profile)
+    with ThreadPoolExecutor(max_workers=encoders, thread_name_prefix="frame-encoder") as executor:
+        try:
+            for frame_index, frame in read_frames(path, frames, index, cancelled):
+                if selector is not None and not selector.keep(frame_index, frame):
+                    progress.put((frame_index, False))
+                    continue
+                if output_size is not None:
+                    frame = fit_frame(frame, output_size)
+                target_file = os.path.join(output_folder, f"{frame_index}{profile.extension}")
+                pending.append((frame_index, executor.submit(write_frame, frame, target_file, params)))
+                # Keep decoding at most one batch ahead of the encoders
+                while len(pending) > 2 * encoders:
+                    done_index, future = pending.popleft()
+                    future.result()
+                    progress.put((done_index, True))
+                    written += 1
+            while pending:
+                done_index, future = pending.popleft()
+                future.result()
+                progress.put((done_index, True))
+                written += 1
+        finally:
+            for _, future in pending:
+                future.cancel()
+    return written
+
+
+class FrameExtractor:
+    """Extracts sampled frames of a video to image files on worker processes.
+
+    The video's index is loaded, or built, on a planning thread, so that the
+    Tk thread never waits for it; the sampling specification is then turned
+    into frames (see plan_frames), and total is set. The frames are split into
+    contiguous segments, each decoded by its own process and capture and
+    encoded there by a small thread pool. A frame selector (see
+    make_frame_selector) decides on each frame from the frames before it, so
+    with one the candidates are decoded and selected in a single ordered pass,
+    and only the encoding fans out, over as many threads as there would have
+    been workers. Progress and cancellation go through a multiprocessing
+    manager, and poll() never blocks, so the Tk thread can drive it with
+    after(). The manager and workers are spawned rather than forked, since
+    forking the threaded Tk process can deadlock the child on a lock some
+    other thread held.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        spec: SamplingSpec,
+        output_folder: str,
+        frame_count: int,
+        fps: float,
+        output_size: Optional[Tuple[Optional[int], Optional[int]]] = None,
+        profile: Optional[fops.EncoderProfile] = None,
+        workers: Optional[int] = None,
+        encoders: int = DEFAULT_EXTRACT_ENCODERS,
+        selector=None,
+    ):
+        self.path = path
+        self.total = 0
+        self.done = 0
+        self.skipped = 0
+        self.errors = []
+        self.cancelled = False
+        self._finished = False
+
+        self._context = multiprocessing.get_context("spawn")
+        self._manager = self._context.Manager()
+        self._progress = self._manager.Queue()
+        self._cancelled = self._manager.Event()
+        # Checked for every packet while indexing, where a manager round trip would not do
+        self._stop_planning = threading.Event()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = None
+        self._planner = threading.Thread(
+            target=self._start,
+            args=(spec, output_folder, frame_count, fps, output_size, profile, workers, encoders, selector),
+            name="frame-planner",
+            daemon=True,
+        )
+        self._planner.start()
+
+    def poll(self) -> Tuple[List[int], bool]:
+        """Collect the frames written since the last poll without blocking.
+
+        done counts written and skipped frames, skipped those the selector dropped.
+
+        Returns:
+            Tuple of (written frame numbers, whether extraction has finished)
+        """
+        if self._finished:
+            return [], True
+
+        # Once the planner has exited, the futures it started (or not) are final
+        planning = self._planner.is_alive()
+        with self._lock:
+            futures = self._futures
+        if futures is None:
+            if not planning:
+                self._shutdown()
+            return [], self._finished
+
+        written = self._drain_progress()
+        if all(future.done() for future in futures):
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as exc:
+                    self.errors.append(str(exc))
+            written.extend(self._drain_progress())
+            self._shutdown()
+        return written, self._finished
+
+    def cancel(self) -> None:
+        """Stop all workers after the frames they are currently writing."""
+        if not self._finished:
+            self.cancelled = True
+            with self._lock:
+                self._stop_planning.set()
+            self._cancelled.set()
+
+    def close(self) -> None:
+        """Cancel and wait for the planner and workers to exit."""
+        self.cancel()
+        if not self._finished:
+            self._planner.join()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            self._shutdown()
+
+    def _start(self, spec, output_folder, frame_count, fps, output_size, profile, workers, encoders, selector):
+        try:
+            index = get_video_index(self.path, self._stop_planning)
+            frames = plan_frames(spec, frame_count, fps, index)
+        except Exception as exc:
+            self.errors.append(str(exc))
+            return
+
+        workers = workers or os.cpu_count() or 1
+        if selector is None:
+            segments = split_segments(frames, workers)
+        else:
+            segments = [frames] if frames else []
+            encoders = max(encoders, workers)
+        with self._lock:
+            if self._stop_planning.is_set():
+                return
+            self.total = len(frames)
+            self._executor = ProcessPoolExecutor(max_workers=max(1, len(segments)), mp_context=self._context)
+            self._futures = [
+                self._executor.submit(
+                    extract_segment,
+                    self.path,
+                    segment,
+                    output_folder,
+                    index,
+                    output_size,
+                    profile or fops.get_encoder_profile(),
+                    encoders,
+                    self._progress,
+                    self._cancelled,
+                    selector,
+                )
+                for segment in segments
+            ]
+
+    def _drain_progress(self) -> List[int]:
+        written = []
+        while True:
+            try:
+                frame_index, was_written = self._progress.get_nowait()
+            except queue.Empty:
+                break
+            self.done += 1
+            if was_written:
+                written.append(frame_index)
+            else:
+                self.skipped += 1
+        return written
+
+    def _shutdown(self) -> None:
+        self._finished = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._manager.shutdown()
+
+
+class FrameRingBuffer:
+    """Recently decoded RGB frames by frame number, within a memory budget.
+
+    Frames are kept as numpy arrays and the oldest are evicted first. Safe to
+    fill from the decoder thread while the Tk thread reads.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_FRAME_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, frame_index: int) -> bool:
+        with self._lock:
+            return frame_index in self._frames
+
+    def put(self, frame_index: int, frame: np.ndarray) -> None:
+        """Store a frame, evicting the oldest ones to stay within budget."""
+        if frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old_frame = self._frames.pop(frame_index, None)
+            if old_frame is not None:
+                self.current_bytes -= old_frame.nbytes
+            self._frames[frame_index] = frame
+            self.current_bytes += frame.nbytes
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted_frame = self._frames.popitem(last=False)
+                self.current_bytes -= evicted_frame.nbytes
+
+    def get(self, frame_index: int) -> Optional[np.ndarray]:
+        """Return a buffered frame, or None."""
+        with self._lock:
+            return self._frames.get(frame_index)
+
+    def close(self) -> None:
+        """Drop all frames."""
+        with self._lock:
+            self._frames.clear()
+            self.current_bytes = 0
+
+
+class VideoDecoder:
+    """Decodes a video on a background thread into a bounded frame queue.
+
+    The capture is owned by the decoder thread. Frames are converted to RGB and,
+    once set_preview_size() has been called, scaled for display there too, so
+    the Tk thread only has to pick them up with next_frame(). seek() discards
+    everything decoded for the previous position.
+
+    A VideoIndex is loaded or built on another thread. Once it is available,
+    frames are numbered by their timestamps and seeks start at the keyframe
+    before the target and skip forward to it without converting frames, within
+    SEEK_DECODE_BUDGET frames.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        queue_size: int = DEFAULT_FRAME_QUEUE_SIZE,
+        frame_buffer: Optional[FrameRingBuffer] = None,
+    ):
+        """Open a video and start decoding from its first frame.
+
+        Every converted frame is also stored in frame_buffer when given.
+
+        Raises:
+            OSError: If the video cannot be opened
+        """
+        self._cap = cv2.VideoCapture(path)
+        if not self._cap.isOpened():
+            self._cap.release()
+            raise OSError(f"Could not open video file {path}")
+
+        self.path = path
+        self.frame_buffer = frame_buffer
+        self.frame_count = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else FALLBACK_FPS
+
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._generation = 0
+        self._seek_to = None
+        self._preview_size = None
+        self._fast_preview = True
+        self._finished = False
+        self._index = None
+        self._thread = threading.Thread(target=self._run, name="video-decoder", daemon=True)
+        self._thread.start()
+        self._index_thread = threading.Thread(target=self._load_index, name="video-indexer", daemon=True)
+        self._index_thread.start()
+
+    @property
+    def index(self) -> Optional[VideoIndex]:
+        with self._lock:
+            return self._index
+
+    def set_preview_size(self, canvas_size: Optional[Tuple[int, int]], fast: bool = True) -> None:
+        """Scale frames decoded from now on to fit a canvas, with iops.fast_scale_image if fast."""
+        with self._lock:
+            self._preview_size = canvas_size
+            self._fast_preview = fast
+
+    def timestamp(self, frame_index: int) -> float:
+        """Return the timestamp in seconds of a frame, from the index once it is available."""
+        index = self.index
+        if index is not None:
+            return index.timestamp(frame_index)
+        return frame_index / self.fps
+
+    def seek(self, frame_index: int) -> None:
+        """Continue decoding at a frame, dropping frames decoded for the old position."""
+        frame_index = max(0, min(frame_index, self.frame_count - 1))
+        with self._lock:
+            self._generation += 1
+            self._seek_to = frame_index
+            self._finished = False
+        self._drain()
+        self._wake.set()
+
+    def next_frame(self) -> Optional[VideoFrame]:
+        """Return the next decoded frame without blocking, or None if it is not ready yet.
+
+        Raises:
+            EOFError: If the end of the video has been reached
+        """
+        while True:
+            with self._lock:
+                if self._finished:
+                    raise EOFError(self.path)
+                generation = self._generation
+            try:
+                frame_generation, frame = self._frames.get_nowait()
+            except queue.Empty:
+                return None
+            if frame_generation != generation:
+                continue
+            if frame is None:
+                with self._lock:
+                    if frame_generation == self._generation:
+                        self._finished = True
+                continue
+            return frame
+
+    def close(self) -> None:
+        """Stop the decoder thread and release the video."""
+        self._stopped.set()
+        self._wake.set()
+        self._drain()
+        self._thread.join()
+        self._cap.release()
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                self._frames.get_nowait()
+            except queue.Empty:
+                return
+
+    def _load_index(self) -> None:
+        index = get_video_index(self.path, self._stopped)
+        if index is not None:
+            with self._lock:
+                self._index = index
+
+    def _seek(self, frame_index: int, video_index: Optional[VideoIndex]) -> None:
+        start = frame_index
+        if video_index is not None:
+            keyframe = video_index.keyframe_before(frame_index)
+            if keyframe is not None and frame_index - keyframe <= SEEK_DECODE_BUDGET:
+                start = keyframe
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    def _run(self) -> None:
+        target = None
+        skip_budget = 0
+        while not self._stopped.is_set():
+            with self._lock:
+                generation = self._generation
+                seek_to, self._seek_to = self._seek_to, None
+                preview_size = self._preview_size
+                fast_preview = self._fast_preview
+                video_index = self._index
+            if seek_to is not None:
+                self._seek(seek_to, video_index)
+                target = seek_to
+                skip_budget = SEEK_DECODE_BUDGET
+
+            if not self._cap.grab():
+                self._put(generation, None)
+                # Idle until a seek or close instead of spinning at the end
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            milliseconds = self._cap.get(cv2.CAP_PROP_POS_MSEC)
+            if video_index is not None:
+                index = video_index.frame_at(milliseconds / 1000)
+                timestamp = video_index.timestamp(index)
+            else:
+                index = int(self._cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+                timestamp = milliseconds / 1000 if milliseconds > 0 or index == 0 else index / self.fps
+
+            if target is not None:
+                # Frames before a seek target are grabbed but never converted
+                if index < target and skip_budget > 0:
+                    skip_budget -= 1
+                    continue
+                target = None
+
+            with profiling.stage("decode", VIDEO_STAGE_SCOPE):
+                ret, frame = self._cap.retrieve()
+                if not ret:
+                    continue
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if self.frame_buffer is not None:
+                self.frame_buffer.put(index, rgb_frame)
+            image = Image.fromarray(rgb_frame)
+            preview = ratio = None
+            if preview_size is not None:
+                ratio = iops.fit_ratio(image.size, preview_size)
+                with profiling.stage("scale", VIDEO_STAGE_SCOPE):
+                    if fast_preview:
+                        preview = iops.fast_scale_image(image, ratio)
+                    else:
+                        preview = iops.scale_image(image, ratio)
+
+            self._put(generation, VideoFrame(index, timestamp, image, preview, ratio))
+
+    def _put(self, generation: int, frame: Optional[VideoFrame]) -> None:
+        while not self._stopped.is_set():
+            with self._lock:
+                if generation != self._generation:
+                    return
+            try:
+                self._frames.put((generation, frame), timeout=QUEUE_PUT_TIMEOUT_S)
+                return
+            except queue.Full:
+                continue
+
+
+class PlaybackClock:
+    """Paces frames from a VideoDecoder by their timestamps in real time.
+
+    Frames that are already late when the next one is due are dropped rather
+    than shown, so playback keeps the video's speed when rendering falls behind.
+    """
+
+    def __init__(self, decoder: VideoDecoder):
+        self.decoder = decoder
+        self.delivered = 0
+        self.dropped = 0
+        self._pending = None
+        self._start_time = None
+        self._start_timestamp = None
+        self._stats_time = time.perf_counter()
+
+    def start(self) -> None:
+        """Start or resume the clock at the next frame the decoder delivers."""
+        self._start_time = None
+        self.pop_stats()
+
+    def reset(self) -> None:
+        """Forget the pending frame, after the decoder was seeked."""
+        self._pending = None
+        self._start_time = None
+
+    def poll(self) -> Tuple[Optional[VideoFrame], float]:
+        """Return the frame due now, if any, and the seconds until the next poll.
+
+        Raises:
+            EOFError: If the end of the video has been reached
+        """
+        frame = None
+        now = time.perf_counter()
+        while True:
+            if self._pending is None:
+                try:
+                    self._pending = self.decoder.next_frame()
+                except EOFError:
+                    if frame is None:
+                        raise
+                if self._pending is None:
+                    break
+            if self._start_time is None:
+                self._start_time = now
+                self._start_timestamp = self._pending.timestamp
+            if self._pending.timestamp - self._start_timestamp > now - self._start_time:
+                break
+            if frame is not None:
+                self.dropped += 1
+            frame, self._pending = self._pending, None
+
+        if frame is not None:
+            self.delivered += 1
+        if self._pending is None:
+            return frame, LATE_FRAME_RETRY_S
+        due = self._start_time + self._pending.timestamp - self._start_timestamp
+        return frame, max(0.0, due - time.perf_counter())
+
+    def pop_stats(self) -> Tuple[float, int]:
+        """Return the delivered frame rate and dropped frames since the last call."""
+        now = time.perf_counter()
+        elapsed = now - self._stats_time
+        fps = self.delivered / elapsed if elapsed > 0 else 0.0
+        dropped = self.dropped
+        self.delivered = 0
+        self.dropped = 0
+        self._stats_time = now
+        return fps, dropped